@@ -0,0 +1,292 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from config2 import font, line_breaking, unicode_text
+from extraction_cache1 import EXTRACTOR_VERSION, PARAGRAPHS_VERSION, file_hash
+from main3 import (
+    default_variant, parse_variant, prepare_paragraphs, render_variant,
+    variant_output_path
+)
+from unicode_fonts1 import fonts_tag, is_ttf_family
+
+
+def find_books(source):
+    """List the PDFs in a directory tree, or those named in a list file."""
+    if os.path.isdir(source):
+        return sorted(
+            os.path.abspath(os.path.join(root, name))
+            for root, _, names in os.walk(source)
+            for name in names if name.lower().endswith(".pdf")
+        )
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        return [
+            os.path.join(base_dir, line.strip()) for line in f
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+def library_root(source):
+    """Directory book paths are taken relative to: the directory itself,
+    or the one holding the list file.
+    """
+    if os.path.isdir(source):
+        return os.path.abspath(source)
+    return os.path.dirname(os.path.abspath(source))
+
+
+def settings_hash(variants):
+    """Hash of everything besides the input that shapes the output."""
+    settings = [list(variant._replace(output_path=None))
+                for variant in variants]
+    # The header and footer use the configured font
+    uses_ttf = unicode_text or any(
+        is_ttf_family(name) for name in [font] + [v.font for v in variants]
+    )
+    payload = json.dumps([
+        EXTRACTOR_VERSION, PARAGRAPHS_VERSION, line_breaking, unicode_text,
+        font, fonts_tag() if uses_ttf else None, settings,
+    ], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_manifest(manifest_path):
+    """Read the run manifest, or start an empty one."""
+    if not os.path.exists(manifest_path):
+        return {"books": {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    """Write the manifest atomically so an interrupted run can resume."""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def input_hash(pdf_path, entry):
+    """Content hash of a book, reused from the manifest if size and mtime
+    have not changed since it was recorded.
+    """
+    stat = os.stat(pdf_path)
+    if entry and entry.get("size") == stat.st_size \
+            and entry.get("mtime") == stat.st_mtime:
+        return entry["input_hash"]
+    return file_hash(pdf_path)
+
+
+def convert_book(pdf_path, variants):
+    """Convert one book in a worker; failures come back as a record."""
+    started = time.perf_counter()
+    try:
+        # The batch pool already uses every core, so each book runs serially
+        merged_paragraphs = prepare_paragraphs(pdf_path, workers=1)
+        for variant in variants:
+            render_variant(merged_paragraphs, variant, workers=1)
+    except Exception as e:
+        return {
+            "status": "failed",
+            "error": f"{type(e).__name__}: {e}",
+            "traceback": traceback.format_exc(),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+    return {
+        "status": "done",
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def book_output_path(pdf_path, output_dir, root):
+    """Output file of a book, mirroring its path under the library root.
+
+    Books in different subdirectories can share a file name, so the
+    subdirectories are kept; a listed book outside the root is placed by
+    its full absolute path instead.
+    """
+    relative = os.path.relpath(os.path.abspath(pdf_path), root)
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        relative = os.path.splitdrive(
+            os.path.abspath(pdf_path))[1].lstrip(os.sep)
+    return os.path.join(output_dir, f"{os.path.splitext(relative)[0]}.pdf")
+
+
+def book_variants(pdf_path, output_dir, variants, root):
+    """Point each variant at this book's output file."""
+    book_path = book_output_path(pdf_path, output_dir, root)
+    if len(variants) == 1:
+        return [variants[0]._replace(output_path=book_path)]
+    return [variant._replace(output_path=variant_output_path(book_path,
+                                                             variant))
+            for variant in variants]
+
+
+def convert_books(jobs, workers, finish):
+    """Run convert_book on (pdf_path, variants) jobs in order, calling
+    finish(pdf_path, result) as each book ends.
+
+    A worker that dies (say PyMuPDF crashing on one bad file) breaks the
+    whole pool and fails every book in it. Only `workers` books are
+    handed to the pool at a time, so just those are suspects: each is
+    retried alone in a pool of its own, where only the book that crashes
+    again is marked failed, and the rest of the queue goes on in a new
+    pool.
+    """
+    workers = workers or os.cpu_count() or 1
+    queue = list(reversed(jobs))
+    while queue:
+        suspects = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = {}
+            while (queue or in_flight) and not suspects:
+                while queue and len(in_flight) < workers:
+                    pdf_path, variants = queue.pop()
+                    future = pool.submit(convert_book, pdf_path, variants)
+                    in_flight[future] = (pdf_path, variants)
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        finish(job[0], future.result())
+                    except BrokenProcessPool:
+                        suspects.append(job)
+            # The books still in the broken pool cannot finish either
+            suspects += in_flight.values()
+
+        for pdf_path, variants in suspects:
+            finish(pdf_path, _convert_alone(pdf_path, variants))
+
+
+def _convert_alone(pdf_path, variants):
+    """convert_book in a pool of its own, to tell whether this book is the
+    one that kills its worker.
+    """
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        try:
+            return pool.submit(convert_book, pdf_path, variants).result()
+        except BrokenProcessPool as e:
+            return {"status": "failed",
+                    "error": f"worker process died: {e}"}
+
+
+def run_batch(books, output_dir, manifest_path, variants,
+              workers=None, retry_failed=True, root=None):
+    """Convert many books across a process pool, largest first.
+
+    Per-book status, hashes and timings are recorded in the manifest after
+    every book, and books whose input and settings are unchanged since a
+    successful run are skipped. Outputs mirror each book's path relative
+    to `root`, which defaults to the books' common directory.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if root is None:
+        root = os.path.commonpath(
+            [os.path.dirname(os.path.abspath(book)) for book in books]
+        ) if books else output_dir
+    manifest = load_manifest(manifest_path)
+    entries = manifest["books"]
+    settings = settings_hash(variants)
+
+    jobs = []
+    unreadable = []
+    skipped = 0
+    for pdf_path in books:
+        entry = entries.get(pdf_path)
+        try:
+            content_hash = input_hash(pdf_path, entry)
+            stat = os.stat(pdf_path)
+        except OSError as e:
+            # A missing or unreadable book fails alone, like a crashing one
+            entries[pdf_path] = {
+                "status": "failed",
+                "error": f"{type(e).__name__}: {e}",
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            unreadable.append(pdf_path)
+            continue
+        outputs = book_variants(pdf_path, output_dir, variants, root)
+
+        unchanged = (entry and entry.get("input_hash") == content_hash
+                     and entry.get("settings_hash") == settings)
+        if unchanged:
+            finished = entry["status"] == "done" and all(
+                os.path.exists(variant.output_path) for variant in outputs
+            )
+            if finished or (entry["status"] == "failed" and
+                            not retry_failed):
+                skipped += 1
+                continue
+
+        entries[pdf_path] = {
+            "status": "pending",
+            "input_hash": content_hash,
+            "settings_hash": settings,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "outputs": [v.output_path for v in outputs],
+        }
+        os.makedirs(os.path.dirname(outputs[0].output_path), exist_ok=True)
+        jobs.append((stat.st_size, pdf_path, outputs))
+    save_manifest(manifest, manifest_path)
+
+    # Largest books first so the long tail is made of small ones
+    jobs.sort(reverse=True)
+    print(f"{len(jobs)} books to convert, {skipped} unchanged")
+
+    def finish(pdf_path, result):
+        entries[pdf_path].update(result)
+        entries[pdf_path]["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        save_manifest(manifest, manifest_path)
+        print(f"[{result['status']}] {pdf_path} "
+              f"({result.get('seconds', 0)}s)")
+
+    convert_books([(pdf_path, outputs) for _, pdf_path, outputs in jobs],
+                  workers, finish)
+
+    failures = {path: entries[path]["error"] for path in unreadable}
+    failures.update((path, entries[path]["error"]) for _, path, _ in jobs
+                    if entries[path]["status"] == "failed")
+    print(f"Converted {len(jobs) + len(unreadable) - len(failures)} books, "
+          f"{len(failures)} failed, {skipped} skipped")
+    for pdf_path, error in failures.items():
+        print(f"  FAILED {pdf_path}: {error}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a library of PDFs with a resumable manifest."
+    )
+    parser.add_argument("source",
+                        help="directory of PDFs, or a file listing one "
+                             "PDF path per line")
+    parser.add_argument("output_dir", help="where converted PDFs are written")
+    parser.add_argument("--manifest",
+                        help="run manifest (default: OUTPUT_DIR/"
+                             "manifest.json)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="books converted at once (default: all cores)")
+    parser.add_argument("--variant", action="append", type=parse_variant,
+                        metavar="FONT:SIZE:RATIO:light|dark:WIDTH",
+                        help="render this variant of every book; repeat "
+                             "for several outputs")
+    parser.add_argument("--skip-failed", action="store_true",
+                        help="do not retry books that failed last time")
+    args = parser.parse_args()
+
+    failures = run_batch(
+        find_books(args.source), args.output_dir,
+        args.manifest or os.path.join(args.output_dir, "manifest.json"),
+        args.variant or [default_variant()],
+        workers=args.workers, retry_failed=not args.skip_failed,
+        root=library_root(args.source),
+    )
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,379 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from fpdf import FPDF
+from formatting_analyzer3 import (
+    extract_data, bunch_lines, detect_formatting, export_csv
+)
+from text_extractor3 import (
+    convert_csv_to_lines, group_text_blocks_into_paragraphs
+)
+from text_formatter4 import (
+    clean_paragraphs, join_hyphenated_words, merge_consecutive_headings,
+    calculate_indent_width, reformat_paragraphs
+)
+from pdf_handler4 import PDF, create_custom_pdf
+
+SIZES = (10, 100, 1000, 5000)
+STAGES = ("extract_data", "bunch_lines", "detect_formatting", "wrap_text",
+          "create_custom_pdf")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "benchmark_baseline.json")
+# Bump when the generator changes so old corpora and baselines are not mixed
+GENERATOR_VERSION = 1
+
+# Settings the converted book is rendered with
+RENDER_FONT = "helvetica"
+RENDER_FONT_SIZE = 12
+RENDER_LINE_HEIGHT_RATIO = .5
+RENDER_PAGE_WIDTH_MM = 80
+
+# Layout of a synthetic book, in points on a letter page
+BookSpec = namedtuple("BookSpec", [
+    "pages", "seed", "body_font", "heading_font", "body_size",
+    "heading_size", "chapter_every", "toc_pages", "hyphen_rate",
+    "footnote_rate",
+])
+
+WORDS = (
+    "the of and to in that was his with as for had you not be her on at by "
+    "which have or from this him but all she they were my are me one their "
+    "so an said them we who would been will no when there if more out up "
+    "into do any your what has man could other than our some very time "
+    "upon about may its only now like little then can should made did us "
+    "such great before must two these see know over much down after first "
+    "reading margin chapter paragraph narrative character historical "
+    "philosophical considerable circumstances understanding particularly "
+    "remarkable government consciousness extraordinary independence "
+    "representation nevertheless acknowledgement interpretation"
+).split()
+LONG_WORDS = [word for word in WORDS if len(word) >= 8]
+
+
+def book_spec(pages, seed=0, body_font="times", heading_font="helvetica",
+              body_size=11, heading_size=16, chapter_every=12, toc_pages=None,
+              hyphen_rate=0.15, footnote_rate=0.1):
+    """Spec for a synthetic book; TOC length scales with the chapter count."""
+    if toc_pages is None:
+        chapters = max(1, pages // chapter_every)
+        toc_pages = 1 if pages < 20 else max(1, min(chapters // 25 + 1, 10))
+    return BookSpec(pages, seed, body_font, heading_font, body_size,
+                    heading_size, chapter_every, toc_pages, hyphen_rate,
+                    footnote_rate)
+
+
+def spec_hash(spec):
+    """Short hash naming a generated book in the corpus directory."""
+    payload = json.dumps([GENERATOR_VERSION, list(spec)])
+    return hashlib.sha256(payload.encode()).hexdigest()[:12]
+
+
+def _body_line(rng, words_per_line):
+    """One line of body text."""
+    return " ".join(rng.choice(WORDS) for _ in range(words_per_line))
+
+
+def make_synthetic_book(path, spec):
+    """Write a deterministic book: title page, TOC, chapters and footnotes.
+
+    Chapter headings open every `chapter_every` pages and are listed with
+    their page numbers on the TOC pages. A `hyphen_rate` share of body
+    lines ends in a hyphenated word continued on the next line, and a
+    `footnote_rate` share of pages carries a footnote number in the text
+    and a footnote at the foot of the page.
+    """
+    rng = random.Random(spec.seed)
+    pdf = FPDF(unit="pt", format="letter")
+    pdf.set_auto_page_break(False)
+    pdf.set_creation_date(
+        datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc))
+
+    body_start = 1 + spec.toc_pages
+    chapter_pages = list(range(body_start, spec.pages, spec.chapter_every))
+    titles = [f"Chapter {number} The {rng.choice(LONG_WORDS).title()}"
+              for number in range(1, len(chapter_pages) + 1)]
+
+    pdf.add_page()
+    pdf.set_font(spec.heading_font, "B", 28)
+    pdf.text(150, 300, "A Synthetic Book")
+
+    entries_per_page = -(-len(titles) // spec.toc_pages)
+    for toc_page in range(spec.toc_pages):
+        pdf.add_page()
+        pdf.set_font(spec.heading_font, "B", spec.heading_size)
+        pdf.text(72, 72, "Contents")
+        pdf.set_font(spec.body_font, "", spec.body_size)
+        first = toc_page * entries_per_page
+        entries = zip(titles[first:first + entries_per_page],
+                      chapter_pages[first:first + entries_per_page])
+        for row, (title, page) in enumerate(entries):
+            y = 110 + row * 24
+            pdf.text(90, y, title)
+            pdf.text(500, y, str(page + 1))
+
+    line_height = spec.body_size * 1.3
+    chapter = 0
+    footnote = 0
+    for page in range(body_start, spec.pages):
+        pdf.add_page()
+        y = 80
+        if chapter < len(chapter_pages) and chapter_pages[chapter] == page:
+            pdf.set_font(spec.heading_font, "B", spec.heading_size)
+            pdf.text(150, y + 40, titles[chapter])
+            chapter += 1
+            y += 100
+
+        has_footnote = rng.random() < spec.footnote_rate
+        bottom = 660 if has_footnote else 720
+        carry = None
+        indent = True
+        while y < bottom:
+            pdf.set_font(spec.body_font, "", spec.body_size)
+            line = _body_line(rng, rng.randint(10, 13))
+            if carry:
+                line = f"{carry} {line}"
+                carry = None
+            if rng.random() < spec.hyphen_rate:
+                word = rng.choice(LONG_WORDS)
+                split = rng.randint(3, len(word) - 3)
+                line = f"{line} {word[:split]}-"
+                carry = word[split:]
+            pdf.text(92 if indent else 72, y, line)
+            y += line_height
+            indent = rng.random() < 0.12
+            if indent:
+                y += line_height / 2
+
+        if has_footnote:
+            footnote += 1
+            pdf.set_font(spec.body_font, "", spec.body_size * 0.6)
+            pdf.text(540, y - line_height - spec.body_size / 2, str(footnote))
+            pdf.text(72, 700, str(footnote))
+            pdf.set_font(spec.body_font, "", spec.body_size * 0.8)
+            pdf.text(82, 700, _body_line(rng, 14))
+
+        pdf.set_font(spec.body_font, "", 9)
+        pdf.text(300, 760, str(page + 1))
+
+    pdf.output(path)
+
+
+def corpus_book(corpus_dir, spec):
+    """Path of the generated book for `spec`, generating it if needed."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    path = os.path.join(corpus_dir,
+                        f"synthetic_{spec.pages}p_{spec_hash(spec)}.pdf")
+    if not os.path.exists(path):
+        print(f"Generating {spec.pages}-page book...")
+        tmp_path = f"{path}.tmp"
+        make_synthetic_book(tmp_path, spec)
+        os.replace(tmp_path, path)
+    return path
+
+
+def _peak_rss_bytes():
+    """High-water resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_pipeline(pdf_path, output_path, workers, measure):
+    """Run every benchmarked stage once, timing each through `measure`."""
+    spans = measure("extract_data", extract_data, pdf_path, workers=workers)
+    measure("bunch_lines", bunch_lines, spans)
+    toc, headings, lines = measure("detect_formatting", detect_formatting,
+                                   spans)
+
+    # Untimed glue between the benchmarked stages
+    flagged = export_csv(line_df=lines, toc=toc, chapter_headings_df=headings)
+    paragraphs = group_text_blocks_into_paragraphs(
+        convert_csv_to_lines(flagged))
+    merged = merge_consecutive_headings(
+        join_hyphenated_words(clean_paragraphs(paragraphs)))
+
+    pdf = PDF(dark_mode=False, unit="mm",
+              page_format=(RENDER_PAGE_WIDTH_MM, 2000))
+    indent = calculate_indent_width(pdf, RENDER_FONT, RENDER_FONT_SIZE)
+    formatted = measure(
+        "wrap_text", reformat_paragraphs, pdf, merged, RENDER_PAGE_WIDTH_MM,
+        RENDER_FONT, RENDER_FONT_SIZE, RENDER_LINE_HEIGHT_RATIO, indent,
+        workers=workers,
+    )
+    measure("create_custom_pdf", create_custom_pdf, pdf, formatted,
+            output_path, RENDER_FONT, indent,
+            base_font_size=RENDER_FONT_SIZE)
+
+
+def benchmark_book(pdf_path, pages, workers=1, repeat=1, memory=True):
+    """Time each stage on one book; memory adds one traced run.
+
+    Seconds are the best of `repeat` untraced runs. Peak memory is the
+    tracemalloc high-water mark per stage (Python and NumPy allocations,
+    not PyMuPDF's own buffers), from a separate run because tracing slows
+    allocation-heavy code.
+    """
+    seconds = {}
+
+    def timed(name, func, *args, **kwargs):
+        started = time.perf_counter()
+        value = func(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        seconds[name] = min(seconds.get(name, elapsed), elapsed)
+        return value
+
+    peaks = {}
+
+    def traced(name, func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "out.pdf")
+        for _ in range(repeat):
+            _run_pipeline(pdf_path, output_path, workers, timed)
+        if memory:
+            _run_pipeline(pdf_path, output_path, workers, traced)
+
+    return {
+        "pages": pages,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "stages": {
+            name: {
+                "seconds": round(seconds[name], 6),
+                "pages_per_second": round(pages / seconds[name], 3),
+                "peak_bytes": peaks.get(name),
+            }
+            for name in STAGES
+        },
+    }
+
+
+def run_suite(sizes, corpus_dir, workers=1, repeat=1, memory=True, seed=0):
+    """Benchmark every size, each in a fresh process so peak RSS is its own."""
+    results = {}
+    for pages in sizes:
+        pdf_path = corpus_book(corpus_dir, book_spec(pages, seed=seed))
+        print(f"Benchmarking {pages} pages...")
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[str(pages)] = pool.submit(
+                benchmark_book, pdf_path, pages, workers, repeat, memory
+            ).result()
+    return {
+        "generator_version": GENERATOR_VERSION,
+        "seed": seed,
+        "workers": workers,
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}",
+        "cpus": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": results,
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Print a throughput report and return the stages that regressed.
+
+    A stage regresses when its pages per second falls more than
+    `tolerance` below the baseline for the same book size.
+    """
+    if baseline:
+        for field in ("generator_version", "seed", "workers", "machine",
+                      "cpus"):
+            if baseline.get(field) != results.get(field):
+                print(f"Warning: baseline {field} is "
+                      f"{baseline.get(field)!r}, this run "
+                      f"{results.get(field)!r}")
+
+    regressions = []
+    header = (f"{'pages':>6} {'stage':<18} {'seconds':>10} {'pages/s':>10} "
+              f"{'peak MiB':>9} {'baseline':>10} {'change':>8}")
+    print(header)
+    print("-" * len(header))
+    for size, result in results["sizes"].items():
+        base_stages = (baseline or {}).get("sizes", {}).get(size, {}) \
+            .get("stages", {})
+        for name, stats in result["stages"].items():
+            peak = stats["peak_bytes"]
+            peak_text = f"{peak / 1024 ** 2:9.1f}" if peak is not None \
+                else f"{'-':>9}"
+            base = base_stages.get(name)
+            if base:
+                base_rate = base["pages_per_second"]
+                change = stats["pages_per_second"] / base_rate - 1
+                base_text = f"{base_rate:10.1f} {change:+8.1%}"
+                if change < -tolerance:
+                    regressions.append((size, name, change))
+            else:
+                base_text = f"{'-':>10} {'-':>8}"
+            print(f"{size:>6} {name:<18} {stats['seconds']:10.3f} "
+                  f"{stats['pages_per_second']:10.1f} {peak_text} "
+                  f"{base_text}")
+        print(f"{size:>6} {'peak RSS MiB':<18} "
+              f"{result['peak_rss_bytes'] / 1024 ** 2:10.1f}")
+
+    for size, name, change in regressions:
+        print(f"REGRESSION {name} at {size} pages: {change:+.1%} pages/s")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline on synthetic books."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES),
+                        help="book sizes in pages (default: %(default)s)")
+    parser.add_argument("--corpus-dir",
+                        default=os.path.join(tempfile.gettempdir(),
+                                             "scriptorium_bench"),
+                        help="where generated books are kept between runs")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="extraction and reflow processes (default: 1)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="timed runs per size; the best is kept")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for the book generator")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the traced run that measures memory")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="baseline to compare against and to save to")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed throughput drop before a stage counts "
+                             "as a regression (default: 0.1)")
+    parser.add_argument("--results", help="also write this run's results "
+                                          "to this JSON file")
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.corpus_dir, args.workers,
+                        args.repeat, not args.no_memory, args.seed)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    for path in filter(None, (args.results,
+                              args.baseline if args.save_baseline else None)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {path}")
+
+    sys.exit(1 if regressions else 0)
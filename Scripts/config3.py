@@ -7,3 +7,27 @@ dark_mode = True
 new_font_size = int(12)
 font = "helvetica"
 line_height_ratio = .5
+extract_workers = None  # processes for page extraction; None = all cores, 1 = serial
+cache_dir = '/Users/emmawatts/Desktop/python_work/scriptorium_cache'  # None disables the extraction cache
+cache_max_mb = 2048  # least recently used books are evicted past this size
+stream_window_pages = 50  # pages per window in --stream mode
+reflow_workers = None  # processes for paragraph reflow; None = all cores, 1 = serial
+variant_workers = None  # processes for rendering several variants; None = all cores
+debug_artifacts = False  # write intermediate paragraph dumps for debugging
+debug_dir = '/Users/emmawatts/Desktop/python_work/scriptorium_tests'
+debug_format = 'jsonl.gz'  # 'json', 'jsonl.gz' or 'msgpack'
+debug_pages = None  # e.g. range(40, 46) to only dump those original pages
+metrics_path = None  # e.g. 'metrics.json', or 'scriptorium.prom' for Prometheus
+profile_stages = None  # 'cprofile' or 'pyinstrument' to profile each stage
+profile_dir = '/Users/emmawatts/Desktop/python_work/scriptorium_tests/profiles'
+incremental_render = False  # start chapters on new pages and only re-render changed ones
+service_host = '127.0.0.1'  # conversion service address (conversion_service1.py)
+service_port = 8765
+service_workers = None  # warm worker processes; None = all cores
+unicode_text = False  # keep non-ASCII text (NFC) instead of '?'; needs font to be a ttf_fonts family
+ttf_fonts = {  # TTF families by style: '' regular, 'B', 'I', 'BI'; missing styles fall back to regular
+    'dejavu': {'': '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+               'B': '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'},
+}
+line_breaking = 'greedy'  # 'optimal' evens out ragged right edges (Knuth-Plass style)
+streaming_pdf = False  # write PDF pages to disk as they are rendered, keeping memory flat; core fonts only
@@ -0,0 +1,431 @@
+import argparse
+import json
+import os
+import select
+import socketserver
+import string
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config2 import service_host, service_port, service_workers
+from instrumentation1 import enable_instrumentation, recorded_stages
+from text_metrics1 import forget_words, glyph_widths
+import main3
+
+# Variant fields a job may override; the service picks output_path
+OVERRIDABLE = tuple(field for field in main3.Variant._fields
+                    if field != "output_path")
+
+# Left plus right page margin, see main3.new_pdf
+SIDE_MARGINS_MM = 10
+
+# JSON types accepted for each overridable field, and their description
+FIELD_TYPES = {
+    "font": (str, "a string"),
+    "font_size": (int, "a positive integer"),
+    "line_height_ratio": ((int, float), "a positive number"),
+    "dark_mode": (bool, "true or false"),
+    "page_width_mm": ((int, float), f"a number of millimetres above "
+                                    f"{SIDE_MARGINS_MM}, the side margins"),
+}
+
+CHUNK_SIZE = 64 * 1024
+
+# Tries at starting a pool whose workers die while warming up
+START_ATTEMPTS = 3
+
+# How often a streamed job's pipe is checked for the end of the job
+POLL_SECONDS = 0.1
+
+CONTENT_TYPES = {"pdf": "application/pdf", "epub": "application/epub+zip"}
+
+
+class JobError(Exception):
+    """A conversion request the service cannot accept."""
+
+
+def _warm_worker():
+    """Import the pipeline and load font metrics once per worker, so jobs
+    start converting at once.
+    """
+    main3.load_pipeline()
+    variant = main3.default_variant()
+    pdf = main3.new_pdf(variant.page_width_mm, variant.dark_mode,
+                        fonts=main3.variant_fonts(variant))
+    for style in ("", "B", "I", "BI"):
+        pdf.set_font(variant.font, style=style, size=variant.font_size)
+        widths = glyph_widths(pdf)
+        for char in string.printable:
+            widths.glyph_width(pdf, char)
+
+
+def _ping(_):
+    """No-op job used to start every worker up front."""
+    return os.getpid()
+
+
+class WorkerPool:
+    """The warm worker processes, replaced as a whole if one of them dies.
+
+    A worker killed mid-job (a MuPDF crash, the OOM killer) breaks its
+    ProcessPoolExecutor for good, so the broken pool is swapped for a
+    freshly warmed one; the lock keeps concurrent requests from building
+    several.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self):
+        for attempt in range(1, START_ATTEMPTS + 1):
+            executor = ProcessPoolExecutor(max_workers=self.workers,
+                                           initializer=_warm_worker)
+            try:
+                # One job per worker starts them all before the first request
+                list(executor.map(_ping, range(self.workers)))
+                return executor
+            except BrokenProcessPool:
+                executor.shutdown(wait=False, cancel_futures=True)
+                if attempt == START_ATTEMPTS:
+                    raise
+                print("A worker died while starting; trying again.")
+
+    def broken(self):
+        """Whether a worker has died since the pool was started."""
+        # Set by the executor before it fails the futures it was running
+        return bool(getattr(self._executor, "_broken", False))
+
+    def restart_if_broken(self):
+        """Replace the pool if it is broken; returns whether it was."""
+        with self._lock:
+            if not self.broken():
+                return False
+            print("A worker died; starting a new worker pool.")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._start()
+            self.restarts += 1
+            return True
+
+    def submit(self, fn, *args):
+        """Submit a job, replacing the pool first if it is broken."""
+        self.restart_if_broken()
+        try:
+            return self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self.restart_if_broken()
+            return self._executor.submit(fn, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+def run_job(pdf_path, pages, variant, output_format, submitted,
+            output_path=None):
+    """Convert in a worker; returns the book's bytes (or output_path, if
+    given) and the job's timings.
+    """
+    started = time.time()
+    enable_instrumentation()
+    # The service pool is the parallelism; a job forking extraction and
+    # reflow pools of its own in every worker would oversubscribe the cores
+    try:
+        data = main3.convert(pdf_path, pages=pages, variant=variant,
+                             output_path=output_path,
+                             output_format=output_format, workers=1)
+    finally:
+        # Workers live on between books; another book's words are not
+        # worth the memory
+        forget_words()
+    return data, {
+        "queue_seconds": started - submitted,
+        "convert_seconds": time.time() - started,
+        "stages": recorded_stages(),
+    }
+
+
+def parse_job(body):
+    """Turn a JSON request body into convert() arguments.
+
+    {"pdf_path": "/books/a.pdf", "pages": [40, 46],
+     "variant": "helvetica:12:0.5:dark:80", "font_size": 14}
+    pages is a half-open [start, stop) range as in range(); variant and
+    the individual Variant fields override the config file settings.
+    "format": "epub" asks for one reflowable EPUB instead of a PDF.
+    """
+    try:
+        job = json.loads(body or b"{}")
+    except ValueError as e:
+        raise JobError(f"request body is not JSON: {e}")
+    if not isinstance(job, dict):
+        raise JobError("request body must be a JSON object")
+
+    pdf_path = job.pop("pdf_path", None)
+    if not pdf_path or not os.path.isfile(pdf_path):
+        raise JobError(f"no such PDF: {pdf_path!r}")
+
+    output_format = job.pop("format", "pdf")
+    if output_format not in main3.OUTPUT_FORMATS:
+        raise JobError(f"format must be one of "
+                       f"{', '.join(main3.OUTPUT_FORMATS)}")
+
+    pages = job.pop("pages", None)
+    if pages is not None:
+        try:
+            start, stop = (int(page) for page in pages)
+        except (TypeError, ValueError):
+            raise JobError("pages must be a [start, stop) pair")
+        pages = range(start, stop)
+        try:
+            main3.check_pages(pdf_path, pages)
+        except ValueError as e:
+            raise JobError(str(e))
+
+    variant = main3.default_variant()
+    spec = job.pop("variant", None)
+    if spec is not None:
+        try:
+            variant = main3.parse_variant(spec)
+        except argparse.ArgumentTypeError as e:
+            raise JobError(str(e))
+
+    unknown = set(job) - set(OVERRIDABLE)
+    if unknown:
+        raise JobError(f"unknown fields: {', '.join(sorted(unknown))}")
+    check_overrides(job)
+    variant = variant._replace(output_path=None, **job)
+    return pdf_path, pages, variant, output_format
+
+
+def check_overrides(overrides):
+    """Raise JobError unless every Variant override has a usable value."""
+    for field, value in overrides.items():
+        types, description = FIELD_TYPES[field]
+        # JSON true is a Python int as well, but never a size
+        if (not isinstance(value, types)
+                or (isinstance(value, bool) and types is not bool)):
+            raise JobError(f"{field} must be {description}")
+    for field in ("font_size", "line_height_ratio"):
+        if field in overrides and overrides[field] <= 0:
+            raise JobError(f"{field} must be {FIELD_TYPES[field][1]}")
+    if overrides.get("page_width_mm", SIDE_MARGINS_MM + 1) <= SIDE_MARGINS_MM:
+        raise JobError(f"page_width_mm must be "
+                       f"{FIELD_TYPES['page_width_mm'][1]}")
+    if "font" in overrides:
+        try:
+            main3.check_font(overrides["font"])
+        except ValueError as e:
+            raise JobError(str(e))
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    """POST /convert runs a job on the pool; GET /health reports status."""
+
+    server_version = "Scriptorium/1"
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_error(404)
+            return
+        pool = self.server.pool
+        # A dead worker is replaced here too, so an idle service recovers
+        restarted = pool.restart_if_broken()
+        self._send_json(200, {"status": "ok", "workers": pool.workers,
+                              "pool": "restarted" if restarted else "running",
+                              "restarts": pool.restarts})
+
+    def do_POST(self):
+        if self.path != "/convert":
+            self.send_error(404)
+            return
+
+        received = time.time()
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            pdf_path, pages, variant, output_format = parse_job(
+                self.rfile.read(length))
+        except JobError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        if main3.streaming_pdf and output_format == "pdf":
+            self._stream_job(pdf_path, pages, variant, received)
+            return
+
+        try:
+            data, timings = self.server.pool.submit(
+                run_job, pdf_path, pages, variant, output_format, received
+            ).result()
+        except BrokenProcessPool as e:
+            # This job's worker died; later jobs get a new pool
+            self._send_json(500, {"error": f"worker died: {e}"})
+            self.server.pool.restart_if_broken()
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}",
+                                  "traceback": traceback.format_exc()})
+            return
+
+        total = time.time() - received
+        # Server-Timing durations are milliseconds
+        server_timing = ", ".join(
+            f"{record['stage']};dur={record['wall_seconds'] * 1000:.1f}"
+            for record in timings["stages"]
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[output_format])
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Queue-Seconds", f"{timings['queue_seconds']:.4f}")
+        self.send_header("X-Convert-Seconds",
+                         f"{timings['convert_seconds']:.4f}")
+        self.send_header("X-Total-Seconds", f"{total:.4f}")
+        if server_timing:
+            self.send_header("Server-Timing", server_timing)
+        self.end_headers()
+        for start in range(0, len(data), CHUNK_SIZE):
+            self.wfile.write(data[start:start + CHUNK_SIZE])
+
+    def _stream_job(self, pdf_path, pages, variant, received):
+        """Run a PDF job, sending pages to the client as they are rendered.
+
+        The worker writes the PDF into a named pipe that this thread copies
+        to the connection, so the response starts with the first finished
+        page and neither side holds the whole document. The length and the
+        timings are not known when the headers go out, so the body ends
+        with the connection and the timing headers are left out. The
+        headers wait for the first data: StreamingPDF writes nothing
+        before its first page is finished, so a job that fails earlier
+        still gets a 500. One that fails once the response has started is
+        cut short, which the client sees as a truncated PDF.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            fifo = os.path.join(directory, "output.pdf")
+            os.mkfifo(fifo)
+            # Held open for reading and writing, the pipe never blocks the
+            # worker opening it and only ends when the job does
+            fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+            try:
+                future = self.server.pool.submit(
+                    run_job, pdf_path, pages, variant, "pdf", received, fifo
+                )
+                chunks = _pipe_chunks(fd, future)
+                first = next(chunks, None)
+                if first is None:
+                    try:
+                        future.result()
+                    except BrokenProcessPool as e:
+                        self._send_json(500, {"error": f"worker died: {e}"})
+                        self.server.pool.restart_if_broken()
+                        return
+                    except Exception as e:
+                        self._send_json(
+                            500, {"error": f"{type(e).__name__}: {e}",
+                                  "traceback": traceback.format_exc()})
+                        return
+
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPES["pdf"])
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                if first is not None:
+                    self.wfile.write(first)
+                for chunk in chunks:
+                    self.wfile.write(chunk)
+                if future.exception() is not None:
+                    print(f"Streamed job for {pdf_path} failed: "
+                          f"{future.exception()}")
+                    self.server.pool.restart_if_broken()
+            finally:
+                # Unlinked first, so a worker that has yet to open the pipe
+                # fails instead of waiting for a reader that is gone
+                os.unlink(fifo)
+                os.close(fd)
+
+    def address_string(self):
+        # Unix-socket clients have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def _send_json(self, status, payload):
+        """Reply with a small JSON document."""
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _pipe_chunks(fd, future):
+    """Data written to the pipe `fd` until `future` is done and the pipe is
+    drained.
+    """
+    while True:
+        # Checked first: once the job is done, whatever it wrote is waiting
+        done = future.done()
+        ready, _, _ = select.select([fd], [], [], 0 if done else POLL_SECONDS)
+        if ready:
+            yield os.read(fd, CHUNK_SIZE)
+        elif done:
+            return
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    """HTTP over a Unix socket, one thread per connection."""
+
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def serve(host=service_host, port=service_port, socket_path=None,
+          workers=service_workers):
+    """Start the worker pool, warm every worker, then serve until stopped."""
+    workers = workers or os.cpu_count() or 1
+    pool = WorkerPool(workers)
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ConversionHandler)
+        where = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), ConversionHandler)
+        where = f"http://{host}:{server.server_port}"
+    server.pool = pool
+
+    print(f"Serving conversions on {where} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve PDF conversions from a pool of warm workers."
+    )
+    parser.add_argument("--host", default=service_host)
+    parser.add_argument("--port", type=int, default=service_port)
+    parser.add_argument("--socket", metavar="PATH",
+                        help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=service_workers,
+                        help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.socket, args.workers)
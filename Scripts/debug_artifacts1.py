@@ -0,0 +1,141 @@
+import atexit
+import contextlib
+import gzip
+import json
+import os
+import queue
+import threading
+
+FORMATS = ("json", "jsonl.gz", "msgpack")
+
+# Active writer; None means debug artifacts are off and dumps cost nothing
+_writer = None
+# Appended to artifact names, so each variant of a book gets its own files
+_label = None
+
+
+class DebugArtifactWriter:
+    """Writes paragraph snapshots to disk on a background thread."""
+
+    def __init__(self, directory, fmt="jsonl.gz", pages=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"debug format must be one of {FORMATS}")
+        if fmt == "msgpack":
+            import msgpack  # noqa: F401 - fail now rather than on the thread
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fmt = fmt
+        self.pages = set(pages) if pages is not None else None
+        self.queue = queue.Queue()
+        self.errors = []
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name="debug-artifacts")
+        self.thread.start()
+
+    def submit(self, paragraphs, name):
+        """Snapshot paragraphs now and queue them for writing."""
+        snapshot = []
+        for paragraph in paragraphs:
+            records = [_as_record(line) for line in paragraph]
+            if self.pages is None or any(
+                    record.get("page_number") in self.pages
+                    for record in records):
+                snapshot.append(records)
+        self.queue.put((snapshot, name))
+
+    def close(self):
+        """Wait for queued artifacts to be written and stop the thread."""
+        self.queue.put(None)
+        self.thread.join()
+        for name, error in self.errors:
+            print(f"Could not write debug artifact {name}: {error}")
+
+    def _run(self):
+        """Writer thread: serialise queued snapshots until closed."""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            snapshot, name = item
+            try:
+                self._write(snapshot, name)
+            except Exception as e:
+                self.errors.append((name, e))
+
+    def _write(self, snapshot, name):
+        """Serialise one snapshot in the configured format."""
+        path = os.path.join(self.directory, f"{name}.{self.fmt}")
+        if self.fmt == "json":
+            with open(path, "w") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+        elif self.fmt == "jsonl.gz":
+            with gzip.open(path, "wt", compresslevel=3) as f:
+                for paragraph in snapshot:
+                    f.write(json.dumps(paragraph, separators=(",", ":")))
+                    f.write("\n")
+        else:
+            import msgpack
+            with open(path, "wb") as f:
+                msgpack.pack(snapshot, f)
+
+
+def _as_record(line):
+    """Plain-dict copy of a Line record or formatted line."""
+    return line.as_dict() if hasattr(line, "as_dict") else dict(line)
+
+
+def configure_debug_artifacts(directory, fmt="jsonl.gz", pages=None):
+    """Turn debug artifacts on; pages limits them to some original pages."""
+    global _writer
+    close_debug_artifacts()
+    _writer = DebugArtifactWriter(directory, fmt, pages)
+
+
+def debug_artifact_settings():
+    """Arguments to configure_debug_artifacts that reproduce the active
+    writer in another process, or None if debug artifacts are off.
+    """
+    if _writer is None:
+        return None
+    pages = sorted(_writer.pages) if _writer.pages is not None else None
+    return _writer.directory, _writer.fmt, pages
+
+
+def close_debug_artifacts():
+    """Flush any pending artifacts and turn debug artifacts off."""
+    global _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        writer.close()
+
+
+def dump_paragraphs(paragraphs, name):
+    """Write a paragraph snapshot if debug artifacts are on."""
+    if _writer is not None:
+        if _label is not None:
+            name = f"{name}_{_label}"
+        _writer.submit(paragraphs, name)
+
+
+@contextlib.contextmanager
+def debug_label(label):
+    """Append label to the names of artifacts dumped inside the block."""
+    global _label
+    previous, _label = _label, label
+    try:
+        yield
+    finally:
+        _label = previous
+
+
+def _forget_writer():
+    """A forked child inherits the writer but not its thread, so anything
+    it queued would never be written; workers configure their own.
+    """
+    global _writer
+    _writer = None
+
+
+atexit.register(close_debug_artifacts)
+os.register_at_fork(after_in_child=_forget_writer)
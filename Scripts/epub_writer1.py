@@ -0,0 +1,257 @@
+import datetime
+import html
+import io
+import shutil
+import tempfile
+import uuid
+import zipfile
+from segment_render1 import iter_segments
+
+# Books for unseekable outputs are built in memory up to this size, and in
+# a temporary file beyond it
+SPOOL_BYTES = 32 * 1024 ** 2
+
+# Control characters XML 1.0 does not allow; they are dropped
+XML_INVALID = dict.fromkeys(code for code in range(32)
+                            if code not in (9, 10, 13))
+
+CONTAINER_XML = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" \
+xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" \
+media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+# Typography is left to the reading app; this only keeps the book's
+# structure readable and follows the app's light or dark theme
+STYLESHEET = """p { margin: 0; text-indent: 1.5em; }
+p.cont, p.toc, h1 + p, h2 + p { text-indent: 0; }
+p.toc { margin-left: 1em; }
+h2 { text-align: center; margin: 2em 0 1em; }
+section.frontmatter p { text-indent: 0; margin-bottom: 0.5em; }
+@media (prefers-color-scheme: dark) {
+  body { background: #000; color: #b4b4b4; }
+}
+"""
+
+XHTML_HEAD = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" \
+xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="{language}" \
+lang="{language}">
+<head>
+<meta charset="utf-8"/>
+<title>{title}</title>
+<link rel="stylesheet" type="text/css" href="style.css"/>
+</head>
+<body>
+"""
+
+XHTML_TAIL = "</body>\n</html>\n"
+
+
+def _text(text):
+    """Line text as XML character data."""
+    return html.escape(text.translate(XML_INVALID), quote=False)
+
+
+class _Chapter:
+    """Writes one chapter's XHTML and records its pages and heading."""
+
+    def __init__(self, stream, seen_pages):
+        self.stream = stream
+        self.seen_pages = seen_pages
+        self.heading = None
+        self.pages = []
+        self.pending = None
+
+    def write(self, markup):
+        self.stream.write(markup.encode("utf-8"))
+
+    def inline(self, lines):
+        """Line texts joined into one run, with a page marker wherever an
+        original page starts.
+        """
+        parts = []
+        for line in lines:
+            page = line.page_number
+            if page is not None and page not in self.seen_pages:
+                self.seen_pages.add(page)
+                self.pages.append(page)
+                parts.append(f'<span epub:type="pagebreak" '
+                             f'role="doc-pagebreak" id="page-{page + 1}" '
+                             f'aria-label="{page + 1}"/>')
+            if line.text:
+                parts.append(_text(line.text))
+                parts.append(" ")
+        if parts and parts[-1] == " ":
+            parts.pop()
+        return "".join(parts)
+
+    def paragraph(self, paragraph):
+        """Write a paragraph, joining one split across original pages onto
+        the paragraph it continues.
+        """
+        first_line = paragraph[0]
+        if first_line.chapter_heading == 1 and not first_line.toc:
+            self.flush()
+            if self.heading is None:
+                self.heading = " ".join(line.text for line in paragraph)
+            self.write(f"<h2>{self.inline(paragraph)}</h2>\n")
+        elif first_line.toc == 1:
+            self.flush()
+            for line in paragraph:
+                self.write(f'<p class="toc">{self.inline([line])}</p>\n')
+        elif first_line.split_paragraph and self.pending is not None:
+            self.pending[1].append(self.inline(paragraph))
+        else:
+            self.flush()
+            self.pending = (first_line, [self.inline(paragraph)])
+
+    def flush(self):
+        """Write the paragraph held back in case the next one continues it."""
+        if self.pending is None:
+            return
+        first_line, runs = self.pending
+        self.pending = None
+        text = " ".join(run for run in runs if run)
+        if first_line.italic == 1:
+            text = f"<em>{text}</em>"
+        if first_line.bold == 1:
+            text = f"<strong>{text}</strong>"
+        css_class = ' class="cont"' if first_line.split_paragraph else ""
+        self.write(f"<p{css_class}>{text}</p>\n")
+
+
+def write_epub(merged_paragraphs, output, title, language="en",
+               identifier=None):
+    """Write paragraphs from merge_consecutive_headings as an EPUB 3 book.
+
+    Chapters are streamed into the archive one at a time as they come out
+    of `merged_paragraphs`, which may be a generator; only the chapter
+    list and page numbers are kept for the navigation document and the
+    package file, written last. The mimetype entry comes first and
+    uncompressed, as the EPUB container format requires.
+
+    output: a path, a writable binary file, or None to return the book as
+    bytes. zipfile gives every entry of an unseekable file (a pipe, a
+    socket) a data descriptor, which the mimetype entry must not have,
+    so for those the book is built in a spooled temporary file first and
+    copied out once finished.
+    """
+    if output is None:
+        archive = io.BytesIO()
+    elif hasattr(output, "write") and not output.seekable():
+        archive = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+    else:
+        archive = output
+    identifier = identifier or f"urn:uuid:{uuid.uuid4()}"
+    head = XHTML_HEAD.format(language=html.escape(language),
+                             title=_text(title))
+    chapters = []
+    seen_pages = set()
+
+    with zipfile.ZipFile(archive, "w",
+                         compression=zipfile.ZIP_DEFLATED) as book:
+        book.writestr("mimetype", "application/epub+zip",
+                      compress_type=zipfile.ZIP_STORED)
+        book.writestr("META-INF/container.xml", CONTAINER_XML)
+        book.writestr("OEBPS/style.css", STYLESHEET)
+
+        for segment in iter_segments(merged_paragraphs):
+            chapters.append(_write_chapter(book, len(chapters) + 1, head,
+                                           segment, seen_pages))
+        if not chapters:
+            # The spine needs at least one document
+            chapters.append(_write_chapter(book, 1, head, [], seen_pages))
+
+        book.writestr("OEBPS/nav.xhtml", _navigation(head, title, chapters))
+        book.writestr("OEBPS/content.opf",
+                      _package(title, language, identifier, chapters))
+
+    if output is None:
+        return archive.getvalue()
+    if archive is not output:
+        with archive:
+            archive.seek(0)
+            shutil.copyfileobj(archive, output)
+    return output
+
+
+def _write_chapter(book, number, head, segment, seen_pages):
+    """Stream one chapter segment into the archive as XHTML.
+
+    Returns (file name, heading text or None, original pages started).
+    """
+    name = f"chapter{number:04d}.xhtml"
+    first_line = segment[0][0] if segment and segment[0] else None
+    section_type = "chapter" if (first_line is not None
+                                 and first_line.chapter_heading == 1
+                                 and not first_line.toc) else "frontmatter"
+    with book.open(f"OEBPS/{name}", "w") as stream:
+        chapter = _Chapter(stream, seen_pages)
+        chapter.write(head)
+        chapter.write(f'<section epub:type="{section_type}" '
+                      f'class="{section_type}">\n')
+        for paragraph in segment:
+            if paragraph:
+                chapter.paragraph(paragraph)
+        chapter.flush()
+        chapter.write("</section>\n" + XHTML_TAIL)
+    return name, chapter.heading, chapter.pages
+
+
+def _navigation(head, title, chapters):
+    """The EPUB 3 navigation document: chapters and original pages."""
+    items = [
+        f'<li><a href="{name}">{_text(heading or title)}</a></li>'
+        for name, heading, _ in chapters
+        if heading is not None or len(chapters) == 1
+    ]
+    pages = [
+        f'<li><a href="{name}#page-{page + 1}">{page + 1}</a></li>'
+        for name, _, chapter_pages in chapters for page in chapter_pages
+    ]
+    parts = [head, '<nav epub:type="toc" id="toc">\n',
+             f"<h1>{_text(title)}</h1>\n<ol>\n", "\n".join(items),
+             "\n</ol>\n</nav>\n"]
+    if pages:
+        parts += ['<nav epub:type="page-list" hidden="">\n<ol>\n',
+                  "\n".join(pages), "\n</ol>\n</nav>\n"]
+    parts.append(XHTML_TAIL)
+    return "".join(parts)
+
+
+def _package(title, language, identifier, chapters):
+    """The package document: metadata, manifest and reading order."""
+    modified = datetime.datetime.now(datetime.timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%SZ")
+    manifest = [
+        '<item id="nav" href="nav.xhtml" '
+        'media-type="application/xhtml+xml" properties="nav"/>',
+        '<item id="css" href="style.css" media-type="text/css"/>',
+    ] + [
+        f'<item id="c{index + 1}" href="{name}" '
+        f'media-type="application/xhtml+xml"/>'
+        for index, (name, _, _) in enumerate(chapters)
+    ]
+    spine = [f'<itemref idref="c{index + 1}"/>'
+             for index in range(len(chapters))]
+    return "\n".join([
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+        'unique-identifier="book-id">',
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">',
+        f'<dc:identifier id="book-id">{_text(identifier)}</dc:identifier>',
+        f"<dc:title>{_text(title)}</dc:title>",
+        f"<dc:language>{_text(language)}</dc:language>",
+        f'<meta property="dcterms:modified">{modified}</meta>',
+        "</metadata>",
+        "<manifest>", *manifest, "</manifest>",
+        "<spine>", *spine, "</spine>",
+        "</package>",
+        "",
+    ])
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import re
+import shutil
+
+# Bump whenever extract_data, bunch_lines, detect_formatting or export_csv
+# change their output so that stale cache entries stop matching
+EXTRACTOR_VERSION = "3.3"
+# Bump whenever grouping, cleaning, hyphen joining or heading merging
+# change the cached paragraphs
+PARAGRAPHS_VERSION = "1"
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Content hashes by (path, size, mtime), so one run hashes each file once
+_FILE_HASHES = {}
+
+
+def cache_key(pdf_path):
+    """Build the cache key for a PDF: content hash plus extractor version."""
+    stat = os.stat(pdf_path)
+    identity = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+    digest = _FILE_HASHES.get(identity)
+    if digest is None:
+        digest = _FILE_HASHES[identity] = file_hash(pdf_path)
+    return f"{digest}-v{EXTRACTOR_VERSION}"
+
+
+# Entry names the cache creates: a content hash with the extractor version,
+# a chapter segment hash (seg-) or a font subset hash (font-)
+_ENTRY_NAME = re.compile(r"(font-|seg-)?[0-9a-f]{64}(-v[0-9.]+)?")
+
+
+def _is_entry(entry):
+    """Whether a directory in the cache is one of the cache's own entries."""
+    return entry.is_dir() and _ENTRY_NAME.fullmatch(entry.name) is not None
+
+
+def _entry_dir(cache_dir, key):
+    """Directory holding the cached files for one key."""
+    return os.path.join(cache_dir, key)
+
+
+def _entry_size(entry_dir):
+    """Total size in bytes of the files in a cache entry."""
+    return sum(
+        entry.stat().st_size for entry in os.scandir(entry_dir)
+        if entry.is_file()
+    )
+
+
+def load_frame(cache_dir, key, name):
+    """Load a cached DataFrame, or return None on a miss."""
+    entry_dir = _entry_dir(cache_dir, key)
+    path = os.path.join(entry_dir, f"{name}.parquet")
+    if not os.path.exists(path):
+        return None
+
+    import pandas as pd
+
+    try:
+        df = pd.read_parquet(path)
+    except ImportError as e:
+        print(f"Extraction cache disabled: {e}")
+        return None
+    except Exception as e:
+        print(f"Discarding unreadable cache file {path}: {e}")
+        os.remove(path)
+        return None
+
+    # The entry directory's mtime records its last use for LRU eviction
+    os.utime(entry_dir)
+    print(f"Loaded cached {name} for {key[:12]}")
+    return df
+
+
+def store_frame(cache_dir, key, name, df, max_bytes=DEFAULT_MAX_BYTES):
+    """Write a DataFrame into the cache and evict old entries if needed."""
+    entry_dir = _entry_dir(cache_dir, key)
+    os.makedirs(entry_dir, exist_ok=True)
+    path = os.path.join(entry_dir, f"{name}.parquet")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    try:
+        df.to_parquet(tmp_path, index=False)
+    except ImportError as e:
+        print(f"Extraction cache disabled: {e}")
+        return
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+    enforce_size_limit(cache_dir, max_bytes, keep=key)
+
+
+def load_bytes(cache_dir, key, name):
+    """Load a cached file's bytes, or return None on a miss."""
+    entry_dir = _entry_dir(cache_dir, key)
+    path = os.path.join(entry_dir, name)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        data = f.read()
+    os.utime(entry_dir)
+    return data
+
+
+def cached_path(cache_dir, key, name):
+    """Path of a cached file, for readers that need one, or None."""
+    entry_dir = _entry_dir(cache_dir, key)
+    path = os.path.join(entry_dir, name)
+    if not os.path.exists(path):
+        return None
+
+    os.utime(entry_dir)
+    return path
+
+
+def store_bytes(cache_dir, key, name, data, max_bytes=DEFAULT_MAX_BYTES):
+    """Write raw bytes into the cache and evict old entries if needed."""
+    entry_dir = _entry_dir(cache_dir, key)
+    os.makedirs(entry_dir, exist_ok=True)
+    path = os.path.join(entry_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+    enforce_size_limit(cache_dir, max_bytes, keep=key)
+
+
+def enforce_size_limit(cache_dir, max_bytes, keep=None):
+    """Evict least recently used entries until the cache fits max_bytes."""
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if _is_entry(entry):
+            entries.append(
+                (entry.stat().st_mtime, entry.name, _entry_size(entry.path))
+            )
+
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(_entry_dir(cache_dir, name), ignore_errors=True)
+        total -= size
+        print(f"Evicted cache entry {name[:12]}")
+
+
+def invalidate(cache_dir, pdf_path=None):
+    """Drop the cache entries for one PDF, or every entry if None.
+
+    Only directories named like cache entries are removed, so anything
+    else kept in the cache directory survives a full clear.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    # Entries from older extractor versions share the content-hash prefix
+    prefix = f"{file_hash(pdf_path)}-" if pdf_path is not None else ""
+    for entry in os.scandir(cache_dir):
+        if _is_entry(entry) and entry.name.startswith(prefix):
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -1,524 +1,667 @@
+import os
 import re
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
+import numpy as np
 import pandas as pd
-from fuzzywuzzy import process
+from rapidfuzz import fuzz, process
+from instrumentation1 import stage
 
 
-def extract_data(pdf_path):
-    """Extract text and metadata from a PDF and store it in a DataFrame."""
+LONE_NUMBER = re.compile(r"\d+")
 
-    doc = fitz.open(pdf_path)
+# Heading matching compares texts the way fuzzywuzzy did, see heading_key
+LATIN1_CHARACTERS = dict.fromkeys(range(128, 256))
+NON_WORD = re.compile(r"\W")
 
-    data = []
+# Pages per worker below which a process pool costs more than it saves
+MIN_PAGES_PER_WORKER = 20
+
+# Sampled statistics pass: the front pages, where a table of contents
+# would be, are read in full and the rest of the book is sampled evenly
+SAMPLE_FRONT_PAGES = 30
+SAMPLE_PAGES = 60
+
+
+def _empty_chunk():
+    """Typed column buffers for the spans of some pages."""
+    return {
+        "page_number": array("q"),
+        "width": array("d"),
+        "height": array("d"),
+        "span_count": array("q"),
+        "text": [],
+        "x1": array("d"),
+        "y1": array("d"),
+        "x2": array("d"),
+        "y2": array("d"),
+        "font_size": array("d"),
+        "font_code": array("i"),
+        "span_flags": array("q"),
+        "lone_num": array("b"),
+        "fonts": [],
+    }
+
+
+def _extract_page_range(pdf_path, start, stop):
+    """Extract span columns for pages [start, stop) of a PDF.
+
+    Spans are written straight into typed column buffers (page geometry
+    once per page, fonts as codes into an interned name list) so that no
+    per-span dict is ever built.
+    """
+    chunk = _empty_chunk()
+    font_codes = {}
+    texts = chunk["text"]
+    x1s, y1s = chunk["x1"], chunk["y1"]
+    x2s, y2s = chunk["x2"], chunk["y2"]
+    sizes, codes = chunk["font_size"], chunk["font_code"]
+    span_flags, lone_nums = chunk["span_flags"], chunk["lone_num"]
+
+    with fitz.open(pdf_path) as doc:
+        for page_number in range(start, stop):
+            page = doc.load_page(page_number)
+            span_count = len(texts)
+            # Extract text and metadata (bounding boxes, font sizes, etc.)
+            for block in page.get_text("dict")["blocks"]:
+                if "lines" in block:
+                    for line in block["lines"]:
+                        for span in line["spans"]:
+                            x1, y1, x2, y2 = span["bbox"]
+                            x1s.append(x1)
+                            y1s.append(y1)
+                            x2s.append(x2)
+                            y2s.append(y2)
+                            sizes.append(span["size"])
+                            span_flags.append(span["flags"])
+
+                            font = span["font"]
+                            code = font_codes.get(font)
+                            if code is None:
+                                code = font_codes[font] = len(font_codes)
+                                chunk["fonts"].append(font)
+                            codes.append(code)
+
+                            text = span["text"]
+                            texts.append(text)
+                            lone_nums.append(
+                                1 if LONE_NUMBER.fullmatch(text.strip())
+                                else 0
+                            )
+
+            chunk["page_number"].append(page_number)
+            chunk["width"].append(page.mediabox.width)
+            chunk["height"].append(page.mediabox.height)
+            chunk["span_count"].append(len(texts) - span_count)
+
+    return chunk
+
+
+def _chunks_to_frame(chunks):
+    """Concatenate extracted column chunks into the span DataFrame.
+
+    No chunks (no pages to extract) give an empty frame of the same
+    columns and types.
+    """
+    merged = chunks[0] if chunks else _empty_chunk()
+    fonts = list(merged["fonts"])
+    font_index = {font: code for code, font in enumerate(fonts)}
+
+    for chunk in chunks[1:]:
+        # Re-map chunk-local font codes onto the merged font list
+        for font in chunk["fonts"]:
+            if font not in font_index:
+                font_index[font] = len(fonts)
+                fonts.append(font)
+        remap = np.array([font_index[font] for font in chunk["fonts"]],
+                         dtype=np.int32)
+
+        for key, values in chunk.items():
+            if key == "fonts":
+                continue
+            if key == "font_code":
+                codes = np.frombuffer(values, np.int32)
+                merged[key].frombytes(remap[codes].tobytes())
+                continue
+            merged[key].extend(values)
+
+    span_count = np.frombuffer(merged["span_count"], np.int64)
+    x1 = np.frombuffer(merged["x1"], np.float64)
+    y1 = np.frombuffer(merged["y1"], np.float64)
+    x2 = np.frombuffer(merged["x2"], np.float64)
+    y2 = np.frombuffer(merged["y2"], np.float64)
+    span_flags = np.frombuffer(merged["span_flags"], np.int64)
+
+    return pd.DataFrame(
+        {
+            "page_number": np.repeat(
+                np.frombuffer(merged["page_number"], np.int64), span_count
+            ),
+            "width": np.repeat(
+                np.frombuffer(merged["width"], np.float64), span_count
+            ),
+            "height": np.repeat(
+                np.frombuffer(merged["height"], np.float64), span_count
+            ),
+            "text": pd.Series(merged["text"], dtype=str),
+            "x1": x1,
+            "y1": y1,
+            "x2": x2,
+            "y2": y2,
+            "bbox_area": (x2 - x1) * (y2 - y1),
+            "font_size": np.frombuffer(merged["font_size"], np.float64),
+            "font": pd.Categorical.from_codes(
+                np.frombuffer(merged["font_code"], np.int32),
+                categories=fonts,
+            ),
+            "bold": ((span_flags & 2) != 0).astype(np.int8),
+            "italic": ((span_flags & 1) != 0).astype(np.int8),
+            "lone_num": np.frombuffer(merged["lone_num"], np.int8),
+        }
+    )
+
+
+def _page_chunks(page_count, workers):
+    """Split a page range into contiguous (start, stop) chunks."""
+    # A few chunks per worker keeps the pool busy when pages vary in cost
+    chunk_count = min(workers * 4, page_count // MIN_PAGES_PER_WORKER)
+    chunk_size = -(-page_count // max(chunk_count, 1))
+    return [
+        (start, min(start + chunk_size, page_count))
+        for start in range(0, page_count, chunk_size)
+    ]
+
+
+def extract_data(pdf_path, workers=None):
+    """Extract text and metadata from a PDF and store it in a DataFrame.
+
+    Pages are split into chunks and extracted in a process pool when
+    `workers` allows it (None uses every core); small documents and
+    workers=1 take the serial path. Records are merged in page order.
+    """
 
     print(f"Processing file: {pdf_path}")
 
-    for page_number in range(doc.page_count):
-        page = doc.load_page(page_number)
-        width = page.mediabox.width
-        height = page.mediabox.height
-        # Extract text and metadata (bounding boxes, font sizes, etc.)
-        for block in page.get_text("dict")["blocks"]:
-            if "lines" in block:
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        bbox = span["bbox"]
-                        area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
-
-                        bold = 1 if span["flags"] & 2 else 0
-                        italic = 1 if span["flags"] & 1 else 0
-                        lone_num = (
-                            1 if re.fullmatch(r"\d+",
-                                              span["text"].strip()) else 0
-                        )
-
-                        data.append(
-                            {
-                                "page_number": page_number,
-                                "width": width,
-                                "height": height,
-                                "text": span["text"],
-                                "x1": bbox[0],
-                                "y1": bbox[1],
-                                "x2": bbox[2],
-                                "y2": bbox[3],
-                                "bbox_area": area,
-                                "font_size": span["size"],  # Font size
-                                "font": span["font"],  # Font family
-                                "bold": bold,
-                                "italic": italic,
-                                "lone_num": lone_num,
-                            }
-                        )
-
-    df = pd.DataFrame(data)
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, page_count // MIN_PAGES_PER_WORKER)
+
+    if workers <= 1:
+        chunks = [_extract_page_range(pdf_path, 0, page_count)]
+    else:
+        page_ranges = _page_chunks(page_count, workers)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map() yields in submission order, so pages stay in order
+            chunks = list(pool.map(
+                _extract_page_range,
+                [pdf_path] * len(page_ranges),
+                [start for start, _ in page_ranges],
+                [stop for _, stop in page_ranges],
+            ))
+
+    df = _chunks_to_frame(chunks)
     print(f"Finished processing {pdf_path}")
 
     return df
 
 
+def _page_runs(pages):
+    """Group page numbers into contiguous (start, stop) ranges."""
+    runs = []
+    for page in sorted(set(pages)):
+        if runs and runs[-1][1] == page:
+            runs[-1][1] = page + 1
+        else:
+            runs.append([page, page + 1])
+    return [tuple(run) for run in runs]
+
+
+def extract_pages(pdf_path, pages):
+    """Extract the span DataFrame of some pages only, in page order."""
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    pages = [page for page in pages if 0 <= page < page_count]
+    return _chunks_to_frame([
+        _extract_page_range(pdf_path, start, stop)
+        for start, stop in _page_runs(pages)
+    ])
+
+
+LINE_COLUMNS = [
+    "page_number",
+    "text",
+    "line_bbox_x1",
+    "line_bbox_y1",
+    "line_bbox_x2",
+    "line_bbox_y2",
+    "font_size",
+    "font",
+    "bold",
+    "italic",
+]
+
+
 def bunch_lines(df):
     """Sort words into line-groups based on vertical proximity"""
     df = df.sort_values(by=["page_number", "y1", "x1"])
+    if df.empty:
+        return df.rename(columns={
+            "x1": "line_bbox_x1", "y1": "line_bbox_y1",
+            "x2": "line_bbox_x2", "y2": "line_bbox_y2",
+        })[LINE_COLUMNS]
+
+    pages = df["page_number"].to_numpy()
+    x1 = df["x1"].to_numpy()
+    y1 = df["y1"].to_numpy()
+    x2 = df["x2"].to_numpy()
+    y2 = df["y2"].to_numpy()
+
+    # Vertical overlap between every span and the span before it
+    vertical_overlap = (np.minimum(y2[1:], y2[:-1]) -
+                        np.maximum(y1[1:], y1[:-1]))
+    avg_height = ((y2[1:] - y1[1:]) + (y2[:-1] - y1[:-1])) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        same_line = vertical_overlap / avg_height > 0.5
+
+    # A line starts on a new page or where the overlap is not significant
+    line_start = np.empty(len(df), dtype=bool)
+    line_start[0] = True
+    line_start[1:] = ~same_line | (pages[1:] != pages[:-1])
+    line_ids = np.cumsum(line_start) - 1
+    starts = np.flatnonzero(line_start)
+    ends = np.append(starts[1:], len(df))
+
+    # Join span text left to right; lexsort is stable on x1 ties
+    x_order = np.lexsort((x1, line_ids))
+    texts = df["text"].to_numpy(dtype=object)[x_order].tolist()
+    line_text = [" ".join(texts[start:end])
+                 for start, end in zip(starts, ends)]
 
-    lines = []  # Store information about each line
-
-    # Group spans by page
-    for page_num, page_data in df.groupby("page_number"):
-        spans = page_data.to_dict("records")
-
-        # Initialize variables
-        current_line = []
-        previous_span = None
-
-        for span in spans:
-            if previous_span is None:
-                current_line.append(span)
-            else:
-                # check if the current span is on same line as previous_span
-                # Calculate the vertical overlap between the spans
-                y_top = max(span["y1"], previous_span["y1"])
-                y_bottom = min(span["y2"], previous_span["y2"])
-                vertical_overlap = y_bottom - y_top
-
-                # Calculate the height of the spans
-                span_height = span["y2"] - span["y1"]
-                prev_span_height = previous_span["y2"] - previous_span["y1"]
-                avg_height = (span_height + prev_span_height) / 2
-
-                # If the vertical overlap is significant, same line
-                if vertical_overlap / avg_height > 0.5:
-                    current_line.append(span)
-                else:
-                    # Process the current line and calculate its bounding box
-                    lines.append(process_line(current_line, page_num))
-                    current_line = [span]  # Start a new line
-
-            previous_span = span
-
-        # Process the last line on the page
-        if current_line:
-            lines.append(process_line(current_line, page_num))
-
-    # Create a new DataFrame to store lines
     line_df = pd.DataFrame(
-        lines,
-        columns=[
-            "page_number",
-            "text",
-            "line_bbox_x1",
-            "line_bbox_y1",
-            "line_bbox_x2",
-            "line_bbox_y2",
-            "font_size",
-            "font",
-            "bold",
-            "italic",
-        ],
+        {
+            "page_number": pages[starts],
+            "text": line_text,
+            "line_bbox_x1": np.minimum.reduceat(x1, starts),
+            "line_bbox_y1": np.minimum.reduceat(y1, starts),
+            "line_bbox_x2": np.maximum.reduceat(x2, starts),
+            "line_bbox_y2": np.maximum.reduceat(y2, starts),
+            "font_size": _line_mode(df["font_size"], line_ids, starts, ends),
+            "font": _line_mode(df["font"], line_ids, starts, ends),
+            "bold": _line_mode(df["bold"], line_ids, starts, ends),
+            "italic": _line_mode(df["italic"], line_ids, starts, ends),
+        },
+        columns=LINE_COLUMNS,
     )
     return line_df
 
 
-def process_line(line, page_num):
-    """gathers line metadata"""
-    # Calculate the bounding box for the line
-    x1_min = min(span["x1"] for span in line)
-    y1_min = min(span["y1"] for span in line)
-    x2_max = max(span["x2"] for span in line)
-    y2_max = max(span["y2"] for span in line)
-
-    # Sort spans by x1 to ensure correct order
-    sorted_line = sorted(line, key=lambda span: span["x1"])
-
-    # Join the text of the spans
-    line_text = " ".join(span["text"] for span in sorted_line)
-
-    # Get font size, font, bold, and italic attributes
-    font_sizes = [span["font_size"] for span in line]
-    fonts = [span["font"] for span in line]
-    bolds = [span["bold"] for span in line]
-    italics = [span["italic"] for span in line]
-
-    # Decide how to aggregate these attributes (e.g., take the most common)
-    font_size = max(set(font_sizes), key=font_sizes.count)
-    font = max(set(fonts), key=fonts.count)
-    bold = max(set(bolds), key=bolds.count)
-    italic = max(set(italics), key=italics.count)
+def _line_mode(values, line_ids, starts, ends):
+    """Most common value per line, as max(set(line), key=line.count) picks
+    it.
+
+    Counting is vectorized. On a tie that expression returns whichever
+    tied value set iteration meets first, which no sort order reproduces,
+    so lines where several values tie for the most spans run it as is.
+    """
+    codes, uniques = pd.factorize(values, sort=True)
+    keys = line_ids * len(uniques) + codes
+    unique_keys, counts = np.unique(keys, return_counts=True)
+    key_lines = unique_keys // len(uniques)
+
+    # Highest count first within each line
+    order = np.lexsort((-counts, key_lines))
+    sorted_counts = counts[order]
+    sorted_lines = key_lines[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_lines[1:] != sorted_lines[:-1]
+    best = np.flatnonzero(first)
+    modes = np.asarray(uniques)[unique_keys[order][best] % len(uniques)]
+
+    # The runner-up of a line directly follows its best value
+    runner_up = np.minimum(best + 1, len(order) - 1)
+    tied = ((sorted_lines[runner_up] == sorted_lines[best])
+            & (sorted_counts[runner_up] == sorted_counts[best])
+            & (runner_up != best))
+    if tied.any():
+        span_values = values.tolist()
+        for line in np.flatnonzero(tied):
+            line_values = span_values[starts[line]:ends[line]]
+            modes[line] = max(set(line_values), key=line_values.count)
+    return modes
+
+
+def page_statistics(df, line_df):
+    """Compute every per-page feature in one table indexed by page number.
+
+    Columns: sparsity (ratio of empty space), num_density (lone numbers per
+    unit of sparsity), line_length_avg/line_length_std and margin_mode (the
+    most common rounded left edge of the page's lines).
+    """
+    span_stats = df.groupby("page_number", sort=True).agg(
+        width=("width", "first"),
+        height=("height", "first"),
+        bbox_area=("bbox_area", "sum"),
+        lone_num=("lone_num", "sum"),
+    )
+    page_area = span_stats["width"] * span_stats["height"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sparsity = np.where(page_area > 0,
+                            1 - span_stats["bbox_area"] / page_area, 0)
+        num_density = np.where(sparsity != 0,
+                               span_stats["lone_num"] / sparsity, 0)
+
+    line_lengths = line_df["line_bbox_x2"] - line_df["line_bbox_x1"]
+    line_stats = line_lengths.groupby(line_df["page_number"]).agg(
+        ["mean", "std"]
+    )
 
-    # Return the line data with additional attributes
-    return {
-        "page_number": page_num,
-        "text": line_text,
-        "line_bbox_x1": x1_min,
-        "line_bbox_y1": y1_min,
-        "line_bbox_x2": x2_max,
-        "line_bbox_y2": y2_max,
-        "font_size": font_size,
-        "font": font,
-        "bold": bold,
-        "italic": italic,
-    }
+    # Mode of the rounded left edge; ties go to the smallest position
+    margin_counts = (
+        pd.DataFrame({
+            "page_number": line_df["page_number"],
+            "margin": line_df["line_bbox_x1"].round(0),
+        })
+        .value_counts(sort=False)
+        .reset_index(name="count")
+        .sort_values(["page_number", "count", "margin"],
+                     ascending=[True, False, True], kind="stable")
+        .drop_duplicates("page_number")
+        .set_index("page_number")
+    )
 
+    return pd.DataFrame(
+        {
+            "sparsity": sparsity,
+            "num_density": num_density,
+            "line_length_avg": line_stats["mean"],
+            "line_length_std": line_stats["std"],
+            "margin_mode": margin_counts["margin"],
+        },
+        index=span_stats.index,
+    )
 
-def check_number_density(df, sparsity_df):
-    """calculates the ratio of number-text to total text-volume for a page"""
-    # Create an empty list to store results
-    number_density_results = []
 
-    # Sort values by page number
-    df = df.sort_values(by=["page_number"])
+def _mode_or_mean(series):
+    """First mode of a series, falling back to its mean."""
+    modes = series.mode()
+    return modes.iloc[0] if not modes.empty else series.mean()
 
-    # Loop over each page and calculate total number count and number density
-    for page_num, page_df in df.groupby("page_number"):
-        # Total number count: Sum the 'lone_num' column
-        total_page_num = page_df["lone_num"].sum()
 
-        # Get the sparsity for this page from sparsity_df
-        page_sparsity = sparsity_df.loc[
-            sparsity_df["page_number"] == page_num, "Sparsity"
-        ].values[0]
+def _z_threshold(mode, avg, std, offset):
+    """Standardised distance of the mode from the mean, plus an offset."""
+    return ((mode - avg) / std) + offset if std != 0 else 1
 
-        # Calculate number density
-        page_num_density = total_page_num / page_sparsity if \
-            page_sparsity != 0 else 0
 
-        # Append the result as a dictionary to the results list
-        number_density_results.append(
-            {"page_#": page_num, "page_num_density": page_num_density}
-        )
+def formatting_thresholds(page_stats):
+    """Derive the document-wide thresholds used to classify pages."""
+    sparsity = page_stats["sparsity"]
+    num_density = page_stats["num_density"]
+    line_length = page_stats["line_length_avg"]
+    margin = page_stats["margin_mode"]
 
-    # Convert the results into a DataFrame
-    num_density_df = pd.DataFrame(number_density_results)
-    return num_density_df
+    line_length_mode = _mode_or_mean(line_length)
+    l_margin_mode = _mode_or_mean(margin)
 
+    return {
+        "avg_sparsity": sparsity.mean(),
+        "std_sparsity": sparsity.std(),
+        "sparsity_threshold": _z_threshold(
+            _mode_or_mean(sparsity), sparsity.mean(), sparsity.std(), 0.5
+        ),
+        "num_density_threshold": _z_threshold(
+            _mode_or_mean(num_density), num_density.mean(),
+            num_density.std(), 4
+        ),
+        "line_length_mode": line_length_mode,
+        "line_length_std": line_length.std(),
+        "line_length_threshold": _z_threshold(
+            line_length_mode, line_length.mean(), line_length.std(), 0.1
+        ),
+        "l_margin_mode": l_margin_mode,
+        "off_margin_threshold": _z_threshold(
+            l_margin_mode, margin.mean(), margin.std(), 1
+        ),
+    }
 
-def calculate_sparsity(df):
-    """calulates the ratio of text to empty space of a page"""
-    # Group the data by page number, then calculate sparsity per page
-    sparsity_per_page = []
 
-    # Group the dataframe by page number
-    for page_num, page_df in df.groupby("page_number"):
-        # Get page dimensions from the first row of the group
-        page_width = page_df["width"].iloc[0]
-        page_height = page_df["height"].iloc[0]
+def classify_pages(page_stats, thresholds):
+    """Split pages into TOC candidates and pages with relevant formatting."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sparsity_z = ((page_stats["sparsity"] - thresholds["avg_sparsity"])
+                      / thresholds["std_sparsity"])
+    dense = sparsity_z <= thresholds["sparsity_threshold"]
+    formatted = (
+        (page_stats["line_length_avg"] >= thresholds["line_length_threshold"])
+        | (page_stats["margin_mode"] >= thresholds["off_margin_threshold"])
+    )
+    numbered = (page_stats["num_density"] >=
+                thresholds["num_density_threshold"])
 
-        # Calculate the total page area
-        total_page_area = page_width * page_height
+    toc_mask = ~dense & numbered & formatted
+    relevant_mask = ~dense & ~toc_mask & formatted
+    return (page_stats.index[toc_mask].tolist(),
+            page_stats.index[relevant_mask].tolist())
 
-        # Calculate the total bounding box area for this page
-        total_bbox_area = page_df["bbox_area"].sum()
 
-        # Calculate sparsity for this page
-        sparsity = (
-            (1 - (total_bbox_area / total_page_area)) if total_page_area > 0
-            else 0
-        )
+def longest_page_run(pages):
+    """Longest run of consecutive pages, the earliest one on ties."""
+    previous_page_num = None
+    run = []
+    longest_run = []
 
-        # Store the result for this page
-        sparsity_per_page.append({"page_number": page_num,
-                                  "Sparsity": sparsity})
+    for page_num in sorted(pages):
+        if previous_page_num is None or page_num == previous_page_num + 1:
+            run.append(page_num)
+        else:
+            if len(run) > len(longest_run):
+                longest_run = run
+            run = [page_num]
+        previous_page_num = page_num
 
-    # Convert the list of sparsity values into a DataFrame
-    sparsity_df = pd.DataFrame(sparsity_per_page)
-    return sparsity_df
+    if len(run) > len(longest_run):
+        longest_run = run
+    return longest_run
 
 
-def is_potential_heading(line_data,
+def is_potential_heading(line_df,
                          line_length_mode,
                          std_line_length,
                          left_margin_mode,
                          off_margin_threshold):
     """Identify potential headings based on line length, margin, etc."""
 
-    line_length = line_data["line_bbox_x2"] - line_data["line_bbox_x1"]
+    line_length = line_df["line_bbox_x2"] - line_df["line_bbox_x1"]
     return (
-        line_length < (line_length_mode - 2 * std_line_length)
-        or abs(line_data["line_bbox_x1"] - left_margin_mode) >
-        off_margin_threshold
+        (line_length < (line_length_mode - 2 * std_line_length))
+        | ((line_df["line_bbox_x1"] - left_margin_mode).abs() >
+           off_margin_threshold)
     )
 
 
-def fuzzy_match_heading(extracted_heading, toc_headings, threshold):
-    """Use fuzzy matching to check if extracted heading matches text in TOC."""
-    best_match, similarity = process.extractOne(extracted_heading,
-                                                toc_headings)
-    return best_match if similarity >= threshold else None
+def heading_key(text):
+    """Text as heading matching compares it: lower case, Latin-1 letters
+    dropped and everything but letters, digits and _ turned into spaces,
+    as fuzzywuzzy's full_process(force_ascii=True) left it.
+    """
+    return NON_WORD.sub(" ", text.translate(LATIN1_CHARACTERS)).lower().strip()
+
+
+def build_toc_index(df, toc):
+    """Normalised, de-duplicated TOC span texts for the whole book."""
+    toc_texts = df.loc[df["page_number"].isin(toc), "text"].unique()
+    entries = {heading_key(text) for text in toc_texts}
+    entries.discard("")
+    return sorted(entries)
+
+
+def match_chapter_headings(line_df, pages, toc_index, thresholds,
+                           fuzzy_threshold=95):
+    """Find heading lines on `pages` that fuzzy-match a TOC entry.
+
+    Candidate lines are de-duplicated on their normalised text and each
+    distinct text is scored once against the whole TOC index. Texts are
+    prepared and scores rounded as fuzzywuzzy's extractOne did, so lines
+    match as they did with it on python-Levenshtein; its pure-Python
+    difflib fallback scored some garbled lines lower.
+    """
+    candidates = line_df[line_df["page_number"].isin(pages)]
+    candidates = candidates[is_potential_heading(
+        candidates,
+        thresholds["line_length_mode"],
+        thresholds["line_length_std"],
+        thresholds["l_margin_mode"],
+        thresholds["off_margin_threshold"],
+    )]
+    if candidates.empty or not toc_index:
+        return candidates.iloc[:0][LINE_COLUMNS]
+
+    processed = candidates["text"].map(heading_key)
+    queries = np.asarray(processed.unique(), dtype=object)
+    scores = process.cdist(
+        queries, toc_index, scorer=fuzz.WRatio, processor=None,
+        score_cutoff=fuzzy_threshold - 0.5, workers=-1,
+    )
+    # fuzzywuzzy compared scores rounded half to even, as np.round does
+    matched = set(queries[np.round(scores.max(axis=1)) >= fuzzy_threshold])
+    return candidates.loc[processed.isin(matched), LINE_COLUMNS]
 
 
 def detect_formatting(df):
     """uses statistical measures to identify headings, table of contents"""
-    toc_candidates = []
-    relevant_formatting = []
-
-    # Calculate sparsity per page
-    sparsity_per_page = calculate_sparsity(df)
-    avg_sparsity = sparsity_per_page["Sparsity"].mean()
-    std_sparsity = sparsity_per_page["Sparsity"].std()
-    sparsity_mode_series = sparsity_per_page["Sparsity"].mode()
-    if not sparsity_mode_series.empty:
-        mode_sparsity = sparsity_mode_series.iloc[0]
-    else:
-        mode_sparsity = avg_sparsity
-    sparsity_threshold = (
-        ((mode_sparsity - avg_sparsity) / std_sparsity) + 0.5
-        if std_sparsity != 0
-        else 1
-    )
+    with stage("bunch_lines") as record:
+        original_lines = bunch_lines(df)
+        record.count(spans=len(df), lines=len(original_lines))
 
-    # Calculate number density per page
-    num_density_per_page = check_number_density(df, sparsity_per_page)
-    num_density_avg = num_density_per_page["page_num_density"].mean()
-    num_density_std = num_density_per_page["page_num_density"].std()
-    num_density_mode_series = num_density_per_page["page_num_density"].mode()
-    if not num_density_mode_series.empty:
-        num_density_mode = num_density_mode_series.iloc[0]
-    else:
-        num_density_mode = num_density_avg
-    num_density_threshold = (
-        ((num_density_mode - num_density_avg) / num_density_std) + 4
-        if num_density_std != 0
-        else 1
-    )
+    # Every per-page feature comes from one statistics table
+    page_stats = page_statistics(df, original_lines)
+    thresholds = formatting_thresholds(page_stats)
+    print("Line length and margin stats calculated.")
 
-    original_lines = bunch_lines(df)
-    original_lines_by_page = original_lines.sort_values(by=["page_number"])
+    toc_candidates, relevant_formatting = classify_pages(page_stats,
+                                                         thresholds)
+    toc = longest_page_run(toc_candidates)  # List of page numbers in the TOC
 
-    # Initialize lists to store line lengths and margins per page
-    l_margin_by_page = []
-    line_length_by_page = []
+    chapter_headings_df = match_chapter_headings(
+        original_lines, relevant_formatting, build_toc_index(df, toc),
+        thresholds,
+    )
+    return toc, chapter_headings_df, original_lines
 
-    # Process each page
-    for page_num, page_df in original_lines_by_page.groupby("page_number"):
-        # Calculate line length average
-        line_length_avg = (page_df["line_bbox_x2"] -
-                           page_df["line_bbox_x1"]).mean()
-        line_length_std = (page_df["line_bbox_x2"] -
-                           page_df["line_bbox_x1"]).std()
 
-        page_df["line_bbox_x1_rounded"] = page_df["line_bbox_x1"].round(0)
+def iter_span_windows(pdf_path, window_pages):
+    """Yield the span DataFrame of each run of `window_pages` pages."""
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
 
-        # Calculate line position mode
-        line_pos_mode_series = page_df["line_bbox_x1_rounded"].mode()
+    for start in range(0, page_count, window_pages):
+        stop = min(start + window_pages, page_count)
+        yield _chunks_to_frame([_extract_page_range(pdf_path, start, stop)])
 
-        line_pos_mode_1 = (
-            line_pos_mode_series.iloc[0]
-            if len(line_pos_mode_series) > 0
-            else page_df["line_bbox_x1"].mean()
-        )
-        line_pos_mode_2 = (
-            line_pos_mode_series.iloc[1]
-            if len(line_pos_mode_series) > 1
-            else page_df["line_bbox_x1"].mean()
-        )
-        line_pos_mode_3 = (
-            line_pos_mode_series.iloc[2]
-            if len(line_pos_mode_series) > 2
-            else page_df["line_bbox_x1"].mean()
-        )
-        line_pos_mode_4 = (
-            line_pos_mode_series.iloc[3]
-            if len(line_pos_mode_series) > 3
-            else page_df["line_bbox_x1"].mean()
-        )
 
-        # Append to the lists
-        line_length_by_page.append(
-            {
-                "page_number": page_num,
-                "line_length_avg_page": line_length_avg,
-                "line_length_std_page": line_length_std,
-            }
-        )
+def stream_formatting(pdf_path, window_pages=50):
+    """Yield flagged line DataFrames one page window at a time.
 
-        l_margin_by_page.append(
-            {
-                "page_number": page_num,
-                "page_margin_mode": line_pos_mode_1,
-                "page_margin_mode_2": line_pos_mode_2,
-                "page_margin_mode_3": line_pos_mode_3,
-                "page_margin_mode_4": line_pos_mode_4,
-            }
-        )
+    The first pass extracts every window once, keeps only its per-page
+    statistics and spills its lines to a temporary file. Once the
+    document-wide thresholds and TOC are known, the second pass reads the
+    windows back and flags TOC lines and chapter headings, so memory is
+    bounded by the window size rather than the book length.
+    """
+    print(f"Processing file: {pdf_path}")
 
-    # Convert lists to DataFrames
-    line_length_by_page_df = pd.DataFrame(
-        line_length_by_page,
-        columns=["page_number",
-                 "line_length_avg_page",
-                 "line_length_std_page",
-                 ]
-    ).set_index("page_number")
-    l_margin_by_page_df = pd.DataFrame(
-        l_margin_by_page,
-        columns=[
-            "page_number",
-            "page_margin_mode",
-            "page_margin_mode_2",
-            "page_margin_mode_3",
-        ],
-    ).set_index("page_number")
-
-    # Now, it's safe to check if page_num is in line_length_by_page_df
-    for page_num in original_lines_by_page["page_number"].unique():
-        page_num = int(page_num)  # Ensure page_num is an integer
-
-        if page_num in line_length_by_page_df.index:
-            line_length = line_length_by_page_df.loc[page_num,
-                                                     "line_length_avg_page"]
+    with tempfile.TemporaryDirectory() as spill_dir:
+        stats_parts = []
+        spill_paths = []
+
+        for spans in iter_span_windows(pdf_path, window_pages):
+            line_df = bunch_lines(spans)
+            if not spans.empty:
+                stats_parts.append(page_statistics(spans, line_df))
+            spill_path = os.path.join(spill_dir,
+                                      f"lines_{len(spill_paths)}.pkl")
+            line_df.to_pickle(spill_path)
+            spill_paths.append(spill_path)
+        print(f"Finished processing {pdf_path}")
+
+        page_stats = pd.concat(stats_parts)
+        thresholds = formatting_thresholds(page_stats)
+        print("Line length and margin stats calculated.")
+
+        toc_candidates, relevant_formatting = classify_pages(page_stats,
+                                                             thresholds)
+        toc = longest_page_run(toc_candidates)
+        if toc:
+            toc_spans = _chunks_to_frame(
+                [_extract_page_range(pdf_path, toc[0], toc[-1] + 1)]
+            )
+            toc_index = build_toc_index(toc_spans, toc)
         else:
-            continue
-
-    print("Line length and margin stats calculated.")
-
-    # Calculate overall statistics
-    line_length_avg_overall = \
-        line_length_by_page_df["line_length_avg_page"].mean()
-
-    line_length_std_overall = \
-        line_length_by_page_df["line_length_avg_page"].std()
+            toc_index = []
+
+        for spill_path in spill_paths:
+            line_df = pd.read_pickle(spill_path)
+            os.remove(spill_path)
+            chapter_headings_df = match_chapter_headings(
+                line_df, relevant_formatting, toc_index, thresholds
+            )
+            yield export_csv(line_df, toc, chapter_headings_df)
+
+
+def sample_pages(page_count, front_pages=SAMPLE_FRONT_PAGES,
+                 sample_size=SAMPLE_PAGES):
+    """Page numbers read by the sampled statistics pass."""
+    front = min(front_pages, page_count)
+    rest = np.linspace(front, page_count - 1,
+                       num=min(sample_size, page_count - front))
+    return list(range(front)) + np.unique(rest.round()).astype(int).tolist()
+
+
+def document_profile(pdf_path, front_pages=SAMPLE_FRONT_PAGES,
+                     sample_size=SAMPLE_PAGES):
+    """Thresholds, TOC pages and TOC index from a cheap sampled pass.
+
+    The figures approximate those of a full pass; the TOC is only looked
+    for among the front pages, which are read in full.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+
+    spans = extract_pages(pdf_path, sample_pages(page_count, front_pages,
+                                                 sample_size))
+    page_stats = page_statistics(spans, bunch_lines(spans))
+    thresholds = formatting_thresholds(page_stats)
+    toc_candidates, _ = classify_pages(page_stats, thresholds)
+    toc = longest_page_run([page for page in toc_candidates
+                            if page < front_pages])
+    return {
+        "thresholds": {name: float(value)
+                       for name, value in thresholds.items()},
+        "toc": toc,
+        "toc_index": build_toc_index(spans, toc),
+    }
 
-    line_length_mode_series = \
-        line_length_by_page_df["line_length_avg_page"].mode()
 
-    if not line_length_mode_series.empty:
-        line_length_mode = line_length_mode_series.iloc[0]
+def flag_lines(spans, profile):
+    """Flagged line DataFrame for part of a book, classified against a
+    document-wide profile from document_profile().
+    """
+    line_df = bunch_lines(spans)
+    thresholds = profile["thresholds"]
+    if spans.empty:
+        relevant_formatting = []
     else:
-        line_length_mode = line_length_avg_overall
-    line_length_threshold = (
-        ((line_length_mode - line_length_avg_overall) /
-         line_length_std_overall) + 0.1
-        if line_length_std_overall != 0 else 1
-    )
-
-    l_margin_avg_overall = l_margin_by_page_df["page_margin_mode"].mean()
-    l_margin_std_overall = l_margin_by_page_df["page_margin_mode"].std()
-    l_margin_mode_series = l_margin_by_page_df["page_margin_mode"].mode()
-    if not l_margin_mode_series.empty:
-        l_margin_mode = l_margin_mode_series.iloc[0]
-    else:
-        l_margin_mode = l_margin_avg_overall
-    off_margin_threshold = (
-        ((l_margin_mode - l_margin_avg_overall) / l_margin_std_overall) + 1
-        if l_margin_std_overall != 0
-        else 1
+        _, relevant_formatting = classify_pages(
+            page_statistics(spans, line_df), thresholds
+        )
+    chapter_headings_df = match_chapter_headings(
+        line_df, relevant_formatting, profile["toc_index"], thresholds
     )
-
-    # Now, process each page to identify TOC candidates and relevant formatting
-    for page_num in df["page_number"].unique():
-        sparsity = \
-            sparsity_per_page.set_index("page_number").loc[page_num,
-                                                           "Sparsity"]
-        num_density = \
-            num_density_per_page.set_index("page_#").loc[page_num,
-                                                         "page_num_density"]
-        line_length = \
-            line_length_by_page_df.loc[page_num,
-                                       "line_length_avg_page"]
-        l_margin = l_margin_by_page_df.loc[page_num, "page_margin_mode"]
-
-        if ((sparsity - avg_sparsity) / std_sparsity) <= sparsity_threshold:
-            continue
-        elif (num_density >= num_density_threshold) and (
-            line_length >= line_length_threshold or
-                l_margin >= off_margin_threshold):
-            toc_candidates.append(page_num)
-        elif line_length >= line_length_threshold or \
-                l_margin >= off_margin_threshold:
-            relevant_formatting.append(page_num)
-        else:
-            continue
-
-    # Initialize variables for storing the longest and earliest TOC sequence
-    previous_page_num = None
-    toc_sequence = []
-    longest_toc = []
-    earliest_page_num = float("inf")
-
-    for page_num in sorted(toc_candidates):
-        if previous_page_num is None or page_num == previous_page_num + 1:
-            toc_sequence.append(page_num)
-        else:
-            if (len(toc_sequence) > len(longest_toc)) or (
-                len(toc_sequence) == len(longest_toc)
-                and toc_sequence[0] < earliest_page_num
-            ):
-                longest_toc = toc_sequence.copy()
-                earliest_page_num = toc_sequence[0]
-            toc_sequence = [page_num]
-        previous_page_num = page_num
-
-    if (len(toc_sequence) > len(longest_toc)) or (
-        len(toc_sequence) == len(longest_toc) and
-        toc_sequence[0] < earliest_page_num
-    ):
-        longest_toc = toc_sequence
-
-    toc = longest_toc  # List of page numbers in the TOC
-
-    chapter_headings = []
-
-    fuzzy_threshold = 95
-
-    # Iterate through all relevant formatting pages
-    for page_num in toc:
-        page_df = df[df["page_number"] == page_num]
-        toc_text_entries = page_df["text"].tolist()  # Extract TOC headings
-
-        for relevant_page_num in relevant_formatting:
-            relevant_page_df = original_lines_by_page[
-                original_lines_by_page["page_number"] == relevant_page_num
-            ]
-
-            # Extract relevant fields (text and bounding boxes)
-            relevant_page_texts = relevant_page_df[
-                [
-                    "text",
-                    "line_bbox_x1",
-                    "line_bbox_y1",
-                    "line_bbox_x2",
-                    "line_bbox_y2",
-                    "font_size",
-                    "font",
-                    "bold",
-                    "italic",
-                ]
-            ].to_dict("records")
-
-            for line in relevant_page_texts:
-                if is_potential_heading(
-                    line,
-                    line_length_mode,
-                    line_length_std_overall,
-                    l_margin_mode,
-                    off_margin_threshold,
-                ):
-                    # Extract text from line
-                    extracted_text = line["text"]
-
-                    # Apply fuzzy matching with TOC
-                    matched_heading = fuzzy_match_heading(
-                        extracted_text, toc_text_entries, fuzzy_threshold
-                    )
-
-                    if matched_heading:
-                        chapter_headings.append(
-                            {
-                                "page_number": relevant_page_num,
-                                "text": line["text"],
-                                "line_bbox_x1": line["line_bbox_x1"],
-                                "line_bbox_y1": line["line_bbox_y1"],
-                                "line_bbox_x2": line["line_bbox_x2"],
-                                "line_bbox_y2": line["line_bbox_y2"],
-                                "font_size": line["font_size"],
-                                "font": line["font"],
-                                "bold": line["bold"],
-                                "italic": line["italic"],
-                            }
-                        )
-
-    chapter_headings_df = pd.DataFrame(chapter_headings)
-    return toc, chapter_headings_df, original_lines
+    return export_csv(line_df, profile["toc"], chapter_headings_df)
 
 
 def export_csv(line_df, toc, chapter_headings_df):
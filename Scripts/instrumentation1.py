@@ -0,0 +1,237 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module
+    resource = None
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+# Active recorder; None means stages are not timed and cost nothing
+_recorder = None
+
+
+class StageRecord:
+    """Measurements for one run of a pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = {}
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_bytes = None
+
+    def count(self, **counts):
+        """Record item counts (pages, spans, lines, paragraphs, ...)."""
+        self.counts.update({key: int(value) for key, value in counts.items()})
+
+    def as_dict(self):
+        """JSON-friendly form of the record."""
+        return {
+            "stage": self.name,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "counts": self.counts,
+        }
+
+
+class _NullRecord:
+    """Stand-in handed out while instrumentation is off."""
+
+    def count(self, **counts):
+        """Ignore counts."""
+
+
+_NULL_RECORD = _NullRecord()
+
+
+class StageRecorder:
+    """Collects stage records and runs the optional per-stage profiler."""
+
+    def __init__(self, profile=None, profile_dir=None):
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f"profile must be one of {PROFILERS}")
+        if profile == "pyinstrument":
+            import pyinstrument  # noqa: F401 - fail before the run starts
+        self.profile = profile
+        self.profile_dir = profile_dir or "."
+        self.records = []
+        self.started = time.time()
+        self.depth = 0
+
+    def start_profiler(self):
+        """Start a profiler for one stage, if profiling is on."""
+        # Profilers cannot nest, so inner stages show up in the outer report
+        if self.depth > 0:
+            return None
+        if self.profile == "cprofile":
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        if self.profile == "pyinstrument":
+            import pyinstrument
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            return profiler
+        return None
+
+    def stop_profiler(self, profiler, name):
+        """Stop a stage profiler and write its report."""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, name)
+        if self.profile == "cprofile":
+            profiler.disable()
+            profiler.dump_stats(f"{path}.prof")
+        else:
+            profiler.stop()
+            with open(f"{path}.html", "w") as f:
+                f.write(profiler.output_html())
+
+
+def _cpu_seconds():
+    """CPU time of this process plus its finished child processes."""
+    if resource is None:
+        return time.process_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime +
+            children.ru_utime + children.ru_stime)
+
+
+def _peak_rss_bytes():
+    """High-water resident set size of this process so far."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def enable_instrumentation(profile=None, profile_dir=None):
+    """Start recording stages; profile may be 'cprofile' or 'pyinstrument'."""
+    global _recorder
+    _recorder = StageRecorder(profile, profile_dir)
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage; the yielded record takes item counts.
+
+    Stages may nest (bunch_lines runs inside detect_formatting), in which
+    case the outer stage's figures include the inner one's.
+    """
+    recorder = _recorder
+    if recorder is None:
+        yield _NULL_RECORD
+        return
+
+    record = StageRecord(name)
+    profiler = recorder.start_profiler()
+    recorder.depth += 1
+    wall_start = time.perf_counter()
+    cpu_start = _cpu_seconds()
+    try:
+        yield record
+    finally:
+        recorder.depth -= 1
+        record.wall_seconds = time.perf_counter() - wall_start
+        record.cpu_seconds = _cpu_seconds() - cpu_start
+        record.peak_rss_bytes = _peak_rss_bytes()
+        if profiler is not None:
+            recorder.stop_profiler(profiler, name)
+        recorder.records.append(record)
+
+
+def recorded_stages():
+    """Records of the stages timed since instrumentation was enabled."""
+    if _recorder is None:
+        return []
+    return [record.as_dict() for record in _recorder.records]
+
+
+def _stage_totals(records):
+    """Combine the records of each stage name, in first-run order.
+
+    A stage can run several times (a cache miss, one reflow per variant),
+    but a Prometheus series may only appear once: times and item counts
+    are summed, peak RSS is the highest seen.
+    """
+    totals = {}
+    for record in records:
+        total = totals.get(record.name)
+        if total is None:
+            total = totals[record.name] = {
+                "runs": 0, "wall_seconds": None, "cpu_seconds": None,
+                "peak_rss_bytes": None, "counts": {},
+            }
+        total["runs"] += 1
+        for attribute, combine in (("wall_seconds", sum),
+                                   ("cpu_seconds", sum),
+                                   ("peak_rss_bytes", max)):
+            value = getattr(record, attribute)
+            if value is not None:
+                previous = total[attribute]
+                total[attribute] = value if previous is None else \
+                    combine((previous, value))
+        for item, value in record.counts.items():
+            total["counts"][item] = total["counts"].get(item, 0) + value
+    return totals
+
+
+def _prometheus_lines(records):
+    """Render stage records in the Prometheus text exposition format,
+    one series per stage (see _stage_totals).
+    """
+    totals = _stage_totals(records)
+    lines = []
+    for metric, help_text, attribute in (
+        ("scriptorium_stage_runs", "Times each stage ran.", "runs"),
+        ("scriptorium_stage_wall_seconds", "Wall time per stage, summed "
+         "over its runs.", "wall_seconds"),
+        ("scriptorium_stage_cpu_seconds",
+         "CPU time per stage, including finished worker processes, "
+         "summed over its runs.", "cpu_seconds"),
+        ("scriptorium_stage_peak_rss_bytes",
+         "Highest process peak RSS when the stage finished.",
+         "peak_rss_bytes"),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for name, total in totals.items():
+            value = total[attribute]
+            if value is not None:
+                lines.append(f'{metric}{{stage="{name}"}} {value}')
+
+    lines.append("# HELP scriptorium_stage_items Items handled per stage, "
+                 "summed over its runs.")
+    lines.append("# TYPE scriptorium_stage_items gauge")
+    for name, total in totals.items():
+        for item, value in total["counts"].items():
+            lines.append(f'scriptorium_stage_items{{stage="{name}",'
+                         f'item="{item}"}} {value}')
+    return lines
+
+
+def write_metrics(path):
+    """Write recorded stages as JSON, or as a Prometheus textfile (.prom)."""
+    if _recorder is None:
+        return
+
+    records = _recorder.records
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        if path.endswith(".prom"):
+            f.write("\n".join(_prometheus_lines(records)) + "\n")
+        else:
+            json.dump({
+                "started": _recorder.started,
+                "stages": [record.as_dict() for record in records],
+            }, f, indent=2)
+    # Atomic replace so textfile collectors never read a partial file
+    os.replace(tmp_path, path)
@@ -0,0 +1,121 @@
+from text_metrics1 import WIDTH_TOLERANCE, glyph_widths
+
+# 'greedy' fills each line in turn; 'optimal' minimizes raggedness over
+# the whole paragraph, Knuth-Plass style
+BREAK_MODES = ("greedy", "optimal")
+
+
+def break_lines(pdf, words, first_width, width, mode="greedy"):
+    """Break words into lines for the font currently selected on `pdf`.
+
+    first_width is the space available to the first line, width the
+    space for every other line. Lines are measured with a trailing space
+    after every word, as wrap_text always did. Returns the lines as
+    strings.
+    """
+    widths = glyph_widths(pdf)
+    sizes = [widths.word_width(pdf, word) for word in words]
+    if mode == "greedy":
+        breaks = greedy_breaks(pdf, words, sizes, first_width, width)
+    elif mode == "optimal":
+        breaks = optimal_breaks(pdf, words, sizes, first_width, width)
+    else:
+        raise ValueError(f"break mode must be one of {BREAK_MODES}, "
+                         f"not {mode!r}")
+    return [' '.join(words[start:stop]) for start, stop in breaks]
+
+
+def greedy_breaks(pdf, words, sizes, first_width, width):
+    """(start, stop) word ranges of greedily filled lines.
+
+    A word that fits no line is preceded by an empty line, as wrap_text
+    always did.
+    """
+    widths = glyph_widths(pdf)
+    breaks = []
+    start, current_width = 0, 0.0
+    for i, size in enumerate(sizes):
+        available_width = width if breaks else first_width
+        line_width = current_width + size + widths.space
+        if widths.fits(line_width, available_width,
+                       lambda: pdf.get_string_width(
+                           ''.join(w + ' ' for w in words[start:i + 1]))):
+            current_width = line_width
+        else:
+            breaks.append((start, i))
+            start, current_width = i, size + widths.space
+    if start < len(words):
+        breaks.append((start, len(words)))
+    return breaks
+
+
+def optimal_breaks(pdf, words, sizes, first_width, width):
+    """(start, stop) word ranges minimizing the summed squared slack.
+
+    Dynamic programming over break positions: the best way to end a line
+    before word `stop` is the best over every start whose line fits, and
+    the last line's slack is free. The earliest start that still fits
+    only moves forward, so each end looks back at most one line's worth
+    of words and a paragraph costs O(words * words per line). A word too
+    wide for any line gets a line of its own.
+    """
+    widths = glyph_widths(pdf)
+    count = len(sizes)
+    prefix = [0.0]
+    for size in sizes:
+        prefix.append(prefix[-1] + size + widths.space)
+
+    tolerances = {available_width: WIDTH_TOLERANCE * max(1.0, abs(
+        available_width)) for available_width in (first_width, width)}
+
+    def line_fits(start, stop, available_width):
+        # GlyphWidths.fits, with its clear-cut cases inlined
+        line_width = prefix[stop] - prefix[start]
+        if widths.additive:
+            tolerance = tolerances[available_width]
+            if line_width <= available_width - tolerance:
+                return True
+            if line_width > available_width + tolerance:
+                return False
+        return widths.fits(
+            line_width, available_width,
+            lambda: pdf.get_string_width(
+                ''.join(w + ' ' for w in words[start:stop]))
+        )
+
+    costs = [0.0] * (count + 1)
+    starts = [0] * (count + 1)
+    first = 0
+    for stop in range(1, count + 1):
+        # Earliest start of a full-width line ending here; the first
+        # line (start 0) is narrower when indented, so it is checked alone
+        while first < stop - 1 and not line_fits(first, stop, width):
+            first += 1
+
+        end_width = prefix[stop]
+        best_cost, best_start = float("inf"), stop - 1
+        if first == 0 and line_fits(0, stop, first_width):
+            best_start = 0
+            best_cost = 0.0 if stop == count else \
+                (first_width - end_width) ** 2
+        # Slack of the line from `start` is shift + prefix[start]
+        shift = width - end_width
+        last_line = stop == count
+        for start in range(max(first, 1), stop):
+            slack = shift + prefix[start]
+            cost = costs[start] if last_line else \
+                costs[start] + slack * slack
+            if cost < best_cost:
+                best_cost, best_start = cost, start
+        if best_cost == float("inf"):
+            # A single word too wide for the line: no slack to even out
+            best_cost = costs[stop - 1]
+        costs[stop], starts[stop] = best_cost, best_start
+
+    breaks = []
+    stop = count
+    while stop:
+        breaks.append((starts[stop], stop))
+        stop = starts[stop]
+    breaks.reverse()
+    return breaks
@@ -1,60 +1,750 @@
+import argparse
+import json
+import os
+import pickle
 import traceback
+import uuid
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from config2 import (
     pdf_path, output_path, font, new_font_size,
-    line_height_ratio, dark_mode
+    line_height_ratio, dark_mode, extract_workers,
+    cache_dir, cache_max_mb, stream_window_pages, reflow_workers,
+    variant_workers, debug_artifacts, debug_dir, debug_format, debug_pages,
+    metrics_path, profile_stages, profile_dir, incremental_render,
+    unicode_text, ttf_fonts, line_breaking, streaming_pdf
 )
-from formatting_analyzer3 import extract_data, detect_formatting, export_csv
-from text_extractor3 import group_text_blocks_into_paragraphs, convert_csv_to_dict
-from text_formatter3 import (
-    join_hyphenated_words, clean_paragraphs, reformat_paragraphs,
-    calculate_indent_width, merge_consecutive_headings
+from debug_artifacts1 import (
+    close_debug_artifacts, configure_debug_artifacts, debug_artifact_settings,
+    debug_label
+)
+from instrumentation1 import enable_instrumentation, stage, write_metrics
+from extraction_cache1 import (
+    PARAGRAPHS_VERSION, cache_key, load_frame, store_frame, load_bytes,
+    store_bytes, invalidate
+)
+from text_extractor3 import (
+    group_text_blocks_into_paragraphs, convert_csv_to_lines, iter_paragraphs
+)
+from segment_render1 import (
+    split_segments, reflow_key, render_key, load_reflow, store_reflow,
+    load_render, store_render, merge_segments
+)
+from line_breaker1 import BREAK_MODES
+from unicode_fonts1 import (
+    book_charset, fonts_tag, is_ttf_family, prepare_fonts, register_fonts,
+    text_coverage
 )
-from pdf_handler4 import PDF, create_custom_pdf
 
+# pandas, PyMuPDF, rapidfuzz and fpdf2 are imported inside the functions
+# that use them, so --help, --check-config and cached re-renders do not
+# pay for the modules they never touch
 
-def main():
-    """Main function to handle PDF processing and text formatting."""
-    try:
-        # Extract data and detect formatting features
-        data = extract_data(pdf_path)
+# Fonts fpdf2 can use without a font file
+CORE_FONTS = ("courier", "helvetica", "arial", "times", "symbol",
+              "zapfdingbats")
+
+OUTPUT_FORMATS = ("pdf", "epub")
+
+# One rendering of a book: typography, theme and page width
+Variant = namedtuple("Variant", [
+    "font", "font_size", "line_height_ratio",
+    "dark_mode", "page_width_mm", "output_path",
+])
+
+
+def analyze_pdf(pdf_path, workers=extract_workers):
+    """Return the flagged line DataFrame, reusing cached results if any."""
+    from formatting_analyzer3 import (
+        extract_data, detect_formatting, export_csv
+    )
+
+    key = cache_key(pdf_path) if cache_dir else None
+    max_bytes = cache_max_mb * 1024 ** 2
+
+    if key:
+        with stage("cache_load") as record:
+            text_with_formatting = load_frame(cache_dir, key, "lines")
+            if text_with_formatting is not None:
+                record.count(lines=len(text_with_formatting))
+        if text_with_formatting is not None:
+            return text_with_formatting
+
+    data = load_frame(cache_dir, key, "spans") if key else None
+    if data is None:
+        with stage("extract") as record:
+            data = extract_data(pdf_path, workers=workers)
+            record.count(pages=data["page_number"].nunique(),
+                         spans=len(data))
+        if key:
+            store_frame(cache_dir, key, "spans", data, max_bytes)
+
+    # Detect formatting features
+    with stage("detect_formatting") as record:
         toc, chapter_headings, original_lines = detect_formatting(data)
+        record.count(lines=len(original_lines), toc_pages=len(toc),
+                     headings=len(chapter_headings))
+    with stage("export_lines") as record:
         text_with_formatting = export_csv(
             line_df=original_lines,
             toc=toc,
             chapter_headings_df=chapter_headings
         )
+        record.count(lines=len(text_with_formatting))
+    if key:
+        store_frame(cache_dir, key, "lines", text_with_formatting, max_bytes)
+    return text_with_formatting
+
+
+def new_pdf(page_width_mm, dark=dark_mode, page_offset=0, fonts=None):
+    """Create the output PDF with the page layout used for phones.
+
+    fonts: TTF files to register, as returned by variant_fonts.
+    """
+    from pdf_handler4 import PDF
+
+    pdf = PDF(dark_mode=dark, unit='mm',
+              page_format=(page_width_mm, 2000), page_offset=page_offset)
+    pdf.set_margins(left=5, top=5, right=5)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    register_fonts(pdf, fonts)
+    return pdf
+
+
+def output_pdf(page_width_mm, output, dark=dark_mode, fonts=None):
+    """The document a variant is rendered into.
+
+    With streaming_pdf, and core fonts only, pages go to `output` (a
+    path, a writable binary file, or None for bytes) as they are
+    finished instead of piling up until the end; otherwise this is
+    new_pdf. Either way create_custom_pdf(pdf, ..., output, ...) then
+    writes or returns the document.
+    """
+    if not streaming_pdf:
+        return new_pdf(page_width_mm, dark, fonts=fonts)
+    if fonts:
+        print("streaming_pdf only supports core fonts; rendering in memory.")
+        return new_pdf(page_width_mm, dark, fonts=fonts)
+
+    from stream_pdf1 import StreamingPDF
+
+    pdf = StreamingPDF(output, dark_mode=dark, unit='mm',
+                       page_format=(page_width_mm, 2000))
+    pdf.set_margins(left=5, top=5, right=5)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    return pdf
+
+
+def variant_fonts(variant, merged_paragraphs=None):
+    """TTF files for a variant's body font and the header and footer font.
+
+    Given the book's paragraphs, the files are cached subsets holding only
+    the book's characters. Core fonts need no files.
+    """
+    families = (variant.font, font)
+    if not any(map(is_ttf_family, families)):
+        return {}
+    charset = None
+    if merged_paragraphs is not None:
+        charset = book_charset(merged_paragraphs)
+    with stage("prepare_fonts"):
+        return prepare_fonts(families, charset, cache_dir,
+                             cache_max_mb * 1024 ** 2)
+
+
+def cleaning_coverage():
+    """Coverage for clean_paragraphs: the TTF fonts' characters in Unicode
+    mode, None for the ASCII cleaning used with core fonts.
+    """
+    return text_coverage() if unicode_text else None
+
+
+def stream_main(epub=False):
+    """Run the pipeline over bounded page windows for very long books.
+
+    Every stage is a generator, so lines, paragraphs and rendered lines
+    flow through a window at a time instead of being held for the whole
+    book. Reflow measures text on its own PDF object so it never touches
+    the document being rendered. With epub, the merged paragraphs go
+    straight into an EPUB, a chapter at a time.
+    """
+    from formatting_analyzer3 import stream_formatting
+    from text_formatter3 import (
+        calculate_indent_width, iter_cleaned_paragraphs,
+        iter_joined_paragraphs, iter_merged_headings,
+        iter_reformatted_paragraphs
+    )
+    from pdf_handler4 import create_custom_pdf
+
+    try:
+        line_windows = stream_formatting(pdf_path, stream_window_pages)
+        text_list = (line for line_df in line_windows
+                     for line in convert_csv_to_lines(line_df))
+
+        paragraphs = iter_paragraphs(text_list)
+        cleaned_paragraphs = iter_cleaned_paragraphs(
+            paragraphs, cleaning_coverage()
+        )
+        joined_paragraphs = iter_joined_paragraphs(cleaned_paragraphs)
+        merged_paragraphs = iter_merged_headings(joined_paragraphs)
+
+        if epub:
+            render_epub(merged_paragraphs, epub_output_path(output_path),
+                        pdf_path)
+            return
+
+        page_width_mm = 80
+        # The book's characters are not known up front: whole font files
+        fonts = variant_fonts(default_variant())
+        pdf = output_pdf(page_width_mm, output_path, fonts=fonts)
+        measure_pdf = new_pdf(page_width_mm, fonts=fonts)
+
+        new_indent = calculate_indent_width(measure_pdf, font, new_font_size)
+        reformatted_paragraphs = iter_reformatted_paragraphs(
+            measure_pdf, merged_paragraphs, page_width_mm, font,
+            new_font_size, line_height_ratio, new_indent, line_breaking
+        )
+
+        # Stages are interleaved generators, so only the whole run is timed
+        with stage("stream") as record:
+            create_custom_pdf(
+                pdf, reformatted_paragraphs, output_path,
+                font, new_indent, base_font_size=new_font_size
+            )
+            record.count(output_pages=pdf.page_no())
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        traceback.print_exc()
+
+
+def preview_lines(pdf_path, pages):
+    """Flagged line DataFrame for some original pages only.
+
+    Lines come straight from the cache when the whole book has been
+    analysed before. Otherwise only `pages` are extracted and classified
+    against document-wide statistics from a cached or sampled pass, so
+    the cost follows the number of pages asked for, not the book length.
+    """
+    from formatting_analyzer3 import (
+        document_profile, extract_pages, flag_lines
+    )
 
-        text_list = convert_csv_to_dict(text_with_formatting)
+    key = cache_key(pdf_path) if cache_dir else None
+    max_bytes = cache_max_mb * 1024 ** 2
+    profile = None
+
+    if key:
+        text_with_formatting = load_frame(cache_dir, key, "lines")
+        if text_with_formatting is not None:
+            in_range = text_with_formatting["page_number"].isin(pages)
+            return text_with_formatting[in_range].reset_index(drop=True)
+        data = load_bytes(cache_dir, key, "profile.json")
+        if data is not None:
+            profile = json.loads(data)
+
+    if profile is None:
+        with stage("sample_statistics"):
+            profile = document_profile(pdf_path)
+        if key:
+            store_bytes(cache_dir, key, "profile.json",
+                        json.dumps(profile).encode(), max_bytes)
+
+    with stage("extract") as record:
+        spans = extract_pages(pdf_path, pages)
+        record.count(pages=spans["page_number"].nunique(), spans=len(spans))
+    with stage("detect_formatting") as record:
+        text_with_formatting = flag_lines(spans, profile)
+        record.count(lines=len(text_with_formatting))
+    return text_with_formatting
+
+
+def prepare_paragraphs(pdf_path, workers=extract_workers, pages=None):
+    """Run analysis and cleaning once; the result can feed any variant.
+
+    With `pages`, only those original pages are converted (see
+    preview_lines). Whole-book results are cached, so a re-render of an
+    unchanged book starts from here without pandas or PyMuPDF.
+    """
+    key = cache_key(pdf_path) if cache_dir and pages is None else None
+    paragraphs_file = f"paragraphs-v{PARAGRAPHS_VERSION}.pkl"
+    if unicode_text:
+        # Unicode text depends on which characters the fonts can print
+        paragraphs_file = (f"paragraphs-v{PARAGRAPHS_VERSION}"
+                           f"-unicode-{fonts_tag()}.pkl")
+    if key:
+        with stage("cache_load") as record:
+            data = load_bytes(cache_dir, key, paragraphs_file)
+            if data is not None:
+                merged_paragraphs = pickle.loads(data)
+                record.count(paragraphs=len(merged_paragraphs))
+        if data is not None:
+            print(f"Loaded cached paragraphs for {key[:12]}")
+            return merged_paragraphs
+
+    from text_formatter3 import (
+        clean_paragraphs, join_hyphenated_words, merge_consecutive_headings
+    )
+
+    # Extract data and detect formatting features
+    if pages is None:
+        text_with_formatting = analyze_pdf(pdf_path, workers)
+    else:
+        text_with_formatting = preview_lines(pdf_path, pages)
+
+    with stage("convert_lines") as record:
+        text_list = convert_csv_to_lines(text_with_formatting)
+        record.count(lines=len(text_list))
+    with stage("group_paragraphs") as record:
         paragraphs = group_text_blocks_into_paragraphs(text_list)
+        record.count(paragraphs=len(paragraphs))
 
-        # Clean and reformat paragraphs
-        cleaned_paragraphs = clean_paragraphs(paragraphs)
+    # Clean paragraphs
+    with stage("clean") as record:
+        cleaned_paragraphs = clean_paragraphs(paragraphs, cleaning_coverage())
+        record.count(paragraphs=len(cleaned_paragraphs))
+    with stage("join_hyphenated") as record:
         joined_paragraphs = join_hyphenated_words(cleaned_paragraphs)
+        record.count(paragraphs=len(joined_paragraphs))
+    with stage("merge_headings") as record:
         merged_paragraphs = merge_consecutive_headings(joined_paragraphs)
+        record.count(paragraphs=len(merged_paragraphs))
+
+    if key:
+        store_bytes(cache_dir, key, paragraphs_file,
+                    pickle.dumps(merged_paragraphs, protocol=4),
+                    cache_max_mb * 1024 ** 2)
+    return merged_paragraphs
+
+
+def render_variant(merged_paragraphs, variant, workers=reflow_workers,
+                   incremental=incremental_render):
+    """Reflow and render the prepared paragraphs for one variant.
+
+    Returns the output path, or the PDF bytes if the variant has none.
+    With streaming_pdf the output path may also be a writable binary file,
+    such as a pipe.
+    """
+    with debug_label(variant_label(variant)):
+        if incremental:
+            if cache_dir:
+                return render_variant_incremental(merged_paragraphs,
+                                                  variant, workers)
+            print("Incremental rendering needs cache_dir; rendering in full.")
+        return _render_variant_full(merged_paragraphs, variant, workers)
+
+
+def _render_variant_full(merged_paragraphs, variant, workers):
+    """render_variant without the segment cache."""
+    from text_formatter3 import calculate_indent_width, reformat_paragraphs
+    from pdf_handler4 import create_custom_pdf
 
-        # PDF settings
-        page_width_mm = 80  # Should match the width used in PDF initialization
-        pdf = PDF(dark_mode=dark_mode, unit='mm', format=(page_width_mm, 2000))
-        pdf.set_margins(left=5, top=5, right=5)
-        pdf.set_auto_page_break(auto=True, margin=15)
+    fonts = variant_fonts(variant, merged_paragraphs)
+    pdf = output_pdf(variant.page_width_mm, variant.output_path,
+                     variant.dark_mode, fonts)
 
-        # Set indent and reformat paragraphs
-        new_indent = calculate_indent_width(pdf, font, new_font_size)
+    # Set indent and reformat paragraphs
+    new_indent = calculate_indent_width(pdf, variant.font, variant.font_size)
+    with stage("reflow") as record:
         reformatted_paragraphs = reformat_paragraphs(
-            pdf, merged_paragraphs, page_width_mm, font,
-            new_font_size, line_height_ratio, new_indent
+            pdf, merged_paragraphs, variant.page_width_mm, variant.font,
+            variant.font_size, variant.line_height_ratio, new_indent,
+            workers=workers, fonts=fonts, break_mode=line_breaking
         )
+        record.count(paragraphs=len(merged_paragraphs),
+                     lines=sum(map(len, reformatted_paragraphs)))
 
-        # Create and save the customized PDF
-        create_custom_pdf(
-            pdf, reformatted_paragraphs, output_path,
-            font, new_indent, base_font_size=new_font_size
+    # Create and save the customized PDF
+    with stage("render") as record:
+        data = create_custom_pdf(
+            pdf, reformatted_paragraphs, variant.output_path,
+            variant.font, new_indent, base_font_size=variant.font_size
         )
+        record.count(output_pages=pdf.page_no())
+    if variant.output_path is None:
+        return bytes(data)
+    return variant.output_path
+
+
+def render_variant_incremental(merged_paragraphs, variant,
+                               workers=reflow_workers):
+    """Render a variant chapter by chapter, reusing cached segments.
+
+    Every chapter starts on a new page. A segment is reflowed again only
+    when its lines or the reflow settings change, and rendered again only
+    when its reflow or its first page number changes; the output is then
+    stitched together from the segment PDFs.
+    """
+    from text_formatter3 import calculate_indent_width, reformat_paragraphs
+    from pdf_handler4 import create_custom_pdf
+
+    max_bytes = cache_max_mb * 1024 ** 2
+    segments = split_segments(merged_paragraphs)
+    reflow_settings = (variant.font, variant.font_size,
+                       variant.line_height_ratio, variant.page_width_mm,
+                       fonts_tag() if ttf_fonts else None, line_breaking)
+    # The header and footer use the configured font
+    render_settings = (reflow_settings, variant.dark_mode, font)
+    fonts = variant_fonts(variant, merged_paragraphs)
+    pdf = new_pdf(variant.page_width_mm, variant.dark_mode, fonts=fonts)
+    new_indent = calculate_indent_width(pdf, variant.font, variant.font_size)
+
+    keys = [reflow_key(segment, reflow_settings) for segment in segments]
+    with stage("reflow") as record:
+        formatted = [load_reflow(cache_dir, key) for key in keys]
+        missing = [i for i, paragraphs in enumerate(formatted)
+                   if paragraphs is None]
+        if missing:
+            # One call, so the changed segments share the reflow pool
+            reformatted = reformat_paragraphs(
+                pdf, [paragraph for i in missing for paragraph in segments[i]],
+                variant.page_width_mm, variant.font, variant.font_size,
+                variant.line_height_ratio, new_indent, workers=workers,
+                fonts=fonts, break_mode=line_breaking
+            )
+            start = 0
+            for i in missing:
+                stop = start + len(segments[i])
+                formatted[i] = reformatted[start:stop]
+                store_reflow(cache_dir, keys[i], formatted[i], max_bytes)
+                start = stop
+        record.count(segments=len(segments), reflowed=len(missing))
+
+    with stage("render") as record:
+        segment_pdfs = []
+        page_offset = 0
+        rendered = 0
+        for key, paragraphs in zip(keys, formatted):
+            key = render_key(key, render_settings, page_offset)
+            cached = load_render(cache_dir, key)
+            if cached is None:
+                segment_pdf = new_pdf(variant.page_width_mm,
+                                      variant.dark_mode, page_offset, fonts)
+                data = create_custom_pdf(
+                    segment_pdf, paragraphs, None, variant.font,
+                    new_indent, base_font_size=variant.font_size
+                )
+                cached = (data, segment_pdf.page_no())
+                store_render(cache_dir, key, *cached, max_bytes)
+                rendered += 1
+            segment_pdfs.append(cached[0])
+            page_offset += cached[1]
+
+        merge_segments(segment_pdfs, variant.output_path)
+        record.count(segments=len(segments), rendered=rendered,
+                     output_pages=page_offset)
+    print(f"Re-rendered {rendered} of {len(segments)} chapter segments.")
+    return variant.output_path
+
+
+def render_epub(merged_paragraphs, output, source_path):
+    """Write the prepared paragraphs as one reflowable EPUB.
+
+    Reading apps reflow EPUB text for the device, font and theme, so this
+    one file stands in for every PDF variant. Returns what write_epub
+    does: the output, or the book's bytes if output is None.
+    """
+    from epub_writer1 import write_epub
+
+    with stage("epub") as record:
+        result = write_epub(merged_paragraphs, output,
+                            book_title(source_path),
+                            identifier=book_identifier(source_path))
+        if output is None:
+            record.count(bytes=len(result))
+    return result
+
+
+def book_title(source_path):
+    """Title for a converted book, from its file name."""
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return name.replace("_", " ").strip() or "Untitled"
+
+
+def book_identifier(source_path):
+    """Stable EPUB identifier derived from the source PDF's contents."""
+    return f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, cache_key(source_path))}"
+
+
+def epub_output_path(base_path):
+    """Output path of the EPUB: the base path with an .epub extension."""
+    return f"{os.path.splitext(base_path)[0]}.epub"
+
+
+def render_variants(merged_paragraphs, variants, workers=None,
+                    incremental=incremental_render):
+    """Render several variants of one prepared book, in parallel if allowed.
+
+    Each variant is reflowed serially inside its own worker process; with
+    workers=1 (or a single variant) everything runs in this process.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(variants))
+
+    if workers <= 1:
+        return [render_variant(merged_paragraphs, variant,
+                               incremental=incremental)
+                for variant in variants]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_variant_worker,
+                             repeat(debug_artifact_settings()),
+                             repeat(merged_paragraphs), variants,
+                             repeat(incremental)))
+
+
+def _render_variant_worker(debug_settings, merged_paragraphs, variant,
+                           incremental):
+    """render_variant in a variant worker, writing its own debug artifacts.
+
+    Pool workers never run atexit, so the artifacts are flushed before
+    the result goes back.
+    """
+    if debug_settings is not None:
+        configure_debug_artifacts(*debug_settings)
+    try:
+        return render_variant(merged_paragraphs, variant, 1, incremental)
+    finally:
+        close_debug_artifacts()
+
+
+def check_font(name):
+    """Raise ValueError unless `name` is a font variants can use."""
+    if unicode_text and not is_ttf_family(name):
+        raise ValueError("unicode_text needs a font from ttf_fonts")
+    if not is_ttf_family(name) and name.lower() not in CORE_FONTS:
+        raise ValueError(f"unknown font {name!r}")
+
+
+def parse_variant(spec):
+    """Parse 'font:size:line_height_ratio:light|dark:page_width_mm'."""
+    try:
+        name, size, ratio, theme, width = spec.split(":")
+        if theme not in ("light", "dark"):
+            raise ValueError(f"theme must be light or dark, not {theme!r}")
+        size, ratio, width = int(size), float(ratio), float(width)
+        check_font(name)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"bad variant {spec!r}: {e}")
+
+    variant = Variant(
+        font=name, font_size=size, line_height_ratio=ratio,
+        dark_mode=theme == "dark", page_width_mm=width, output_path=None,
+    )
+    return variant._replace(
+        output_path=variant_output_path(output_path, variant)
+    )
+
+
+def variant_label(variant):
+    """Short name of a variant's settings, e.g. helvetica_11_light_80."""
+    theme = "dark" if variant.dark_mode else "light"
+    return (f"{variant.font}_{variant.font_size}_{theme}_"
+            f"{variant.page_width_mm:g}")
+
+
+def variant_output_path(base_path, variant):
+    """Output path for a variant: the base path with its settings appended."""
+    root, ext = os.path.splitext(base_path)
+    return f"{root}_{variant_label(variant)}{ext}"
+
+
+def default_variant():
+    """The single variant described by the config file."""
+    # PDF settings; 80mm should match the width used for the pages
+    return Variant(
+        font=font, font_size=new_font_size,
+        line_height_ratio=line_height_ratio, dark_mode=dark_mode,
+        page_width_mm=80, output_path=output_path,
+    )
+
+
+def check_config():
+    """Problems with the config file settings, as readable messages."""
+    problems = []
+    if not os.path.isfile(pdf_path):
+        problems.append(f"pdf_path does not exist: {pdf_path}")
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    if not os.path.isdir(output_dir):
+        problems.append(f"output directory does not exist: {output_dir}")
+    for family, files in ttf_fonts.items():
+        if not files.get(""):
+            problems.append(f"ttf_fonts[{family!r}] has no regular ('') "
+                            f"font file")
+        for path in files.values():
+            if not os.path.isfile(path):
+                problems.append(f"font file does not exist: {path}")
+    if unicode_text and not is_ttf_family(font):
+        problems.append("unicode_text needs font to be one of the "
+                        "ttf_fonts families")
+    elif not is_ttf_family(font) and font.lower() not in CORE_FONTS:
+        problems.append(f"font must be one of {', '.join(CORE_FONTS)} or "
+                        f"a ttf_fonts family")
+    if new_font_size <= 0 or line_height_ratio <= 0:
+        problems.append("new_font_size and line_height_ratio must be "
+                        "positive")
+    for name, value in (("extract_workers", extract_workers),
+                        ("reflow_workers", reflow_workers),
+                        ("variant_workers", variant_workers)):
+        if value is not None and (not isinstance(value, int) or value < 1):
+            problems.append(f"{name} must be None or a positive integer")
+    if line_breaking not in BREAK_MODES:
+        problems.append(f"line_breaking must be one of "
+                        f"{', '.join(BREAK_MODES)}")
+    if profile_stages not in (None, "cprofile", "pyinstrument"):
+        problems.append("profile_stages must be None, 'cprofile' or "
+                        "'pyinstrument'")
+    return problems
+
+
+def main(variants=None, incremental=incremental_render, epub=False):
+    """Main function to handle PDF processing and text formatting."""
+    if not variants:
+        variants = [default_variant()]
+
+    try:
+        merged_paragraphs = prepare_paragraphs(pdf_path)
+        if epub:
+            render_epub(merged_paragraphs, epub_output_path(output_path),
+                        pdf_path)
+            return
+        render_variants(merged_paragraphs, variants, workers=variant_workers,
+                        incremental=incremental)
 
     except Exception as e:
         print(f"An error occurred: {e}")
         traceback.print_exc()
 
 
+def load_pipeline():
+    """Import everything convert() imports lazily.
+
+    The CLI starts fast by leaving pandas, PyMuPDF, rapidfuzz and fpdf2
+    until a stage needs them; a long-lived process that converts many
+    books calls this once so that its first book does not pay for them.
+    """
+    import formatting_analyzer3  # noqa: F401 - pandas, PyMuPDF, rapidfuzz
+    import text_formatter3  # noqa: F401
+    import pdf_handler4  # noqa: F401 - fpdf2
+    import stream_pdf1  # noqa: F401
+    import epub_writer1  # noqa: F401
+    if cache_dir:
+        try:
+            # What pandas loads on its first parquet read of a cached frame
+            import pyarrow.dataset  # noqa: F401
+            import pyarrow.pandas_compat  # noqa: F401
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            pass  # load_frame reports the cache as disabled
+    if incremental_render:
+        import PyPDF2  # noqa: F401 - merging segment renders
+
+
+def check_pages(pdf_path, pages):
+    """Raise ValueError unless `pages` names at least one page and every
+    one of them is in the book.
+    """
+    import fitz  # PyMuPDF
+
+    try:
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+    except RuntimeError as e:
+        raise ValueError(f"cannot read {pdf_path}: {e}")
+    if not pages:
+        raise ValueError("pages must name at least one page")
+    if min(pages) < 0 or max(pages) >= page_count:
+        raise ValueError(f"pages must be between 0 and {page_count - 1}; "
+                         f"the book has {page_count} pages")
+
+
+def convert(pdf_path, pages=None, variant=None, output_path=None,
+            output_format="pdf", workers=None):
+    """Convert a book, or just some of its pages, for use as a library.
+
+    pages: original page numbers as the pipeline counts them (from 0),
+    e.g. range(40, 46); None converts the whole book.
+    variant: a Variant; defaults to the config file settings.
+    output_format: "pdf", or "epub" for one reflowable book (the variant
+    is then unused).
+    workers: processes for extraction and reflow; None uses
+    extract_workers and reflow_workers from the config file.
+    Returns the PDF or EPUB bytes, or writes output_path and returns it.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}")
+    if pages is not None:
+        check_pages(pdf_path, pages)
+    merged_paragraphs = prepare_paragraphs(
+        pdf_path, extract_workers if workers is None else workers, pages
+    )
+    if output_format == "epub":
+        return render_epub(merged_paragraphs, output_path, pdf_path)
+
+    variant = (variant or default_variant())._replace(
+        output_path=output_path
+    )
+    return render_variant(merged_paragraphs, variant,
+                          reflow_workers if workers is None else workers,
+                          incremental=False)
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Reformat a PDF for phones.")
+    parser.add_argument("--invalidate-cache", action="store_true",
+                        help="drop cached extraction results for pdf_path")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="drop every cached extraction result")
+    parser.add_argument("--stream", action="store_true",
+                        help="process the book in bounded page windows")
+    parser.add_argument("--epub", action="store_true",
+                        help="write one reflowable EPUB next to output_path "
+                             "instead of PDF variants")
+    parser.add_argument("--variant", action="append", type=parse_variant,
+                        metavar="FONT:SIZE:RATIO:light|dark:WIDTH",
+                        help="render this variant after one analysis pass; "
+                             "repeat for several outputs")
+    parser.add_argument("--incremental", action="store_true",
+                        default=incremental_render,
+                        help="render chapter by chapter and only rebuild "
+                             "chapters that changed (needs cache_dir)")
+    parser.add_argument("--debug-artifacts", action="store_true",
+                        default=debug_artifacts,
+                        help="dump intermediate paragraphs to debug_dir")
+    parser.add_argument("--metrics", default=metrics_path, metavar="PATH",
+                        help="write per-stage timings to PATH (JSON, or a "
+                             "Prometheus textfile if it ends in .prom)")
+    parser.add_argument("--profile", choices=("cprofile", "pyinstrument"),
+                        default=profile_stages,
+                        help="profile each stage into profile_dir")
+    parser.add_argument("--check-config", action="store_true",
+                        help="validate the config file and exit")
+    args = parser.parse_args()
+
+    if args.check_config:
+        problems = check_config()
+        for problem in problems:
+            print(f"Config problem: {problem}")
+        if not problems:
+            print("Config OK.")
+        raise SystemExit(1 if problems else 0)
+
+    if args.debug_artifacts:
+        configure_debug_artifacts(debug_dir, debug_format, debug_pages)
+    if args.metrics or args.profile:
+        enable_instrumentation(args.profile, profile_dir)
+
+    if cache_dir and args.clear_cache:
+        invalidate(cache_dir)
+    elif cache_dir and args.invalidate_cache:
+        invalidate(cache_dir, pdf_path)
+
+    if args.stream:
+        stream_main(args.epub)
+    else:
+        main(args.variant, args.incremental, args.epub)
+
+    if args.metrics:
+        write_metrics(args.metrics)
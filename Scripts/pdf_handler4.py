@@ -1,5 +1,7 @@
 from fpdf import FPDF
+from fpdf.enums import XPos, YPos
 from config2 import font, line_height_ratio
+from text_metrics1 import WIDTH_TOLERANCE, glyph_widths
 
 # Define mobile-friendly page dimensions
 PAGE_WIDTH_MM = 80  # Adjust as needed
@@ -16,10 +18,12 @@ class PDF(FPDF):
 
     def __init__(
         self, dark_mode=False, unit="mm",
-        page_format=(PAGE_WIDTH_MM, PAGE_HEIGHT_MM)
+        page_format=(PAGE_WIDTH_MM, PAGE_HEIGHT_MM), page_offset=0
     ):
         super().__init__(unit=unit, format=page_format)
         self.dark_mode = dark_mode
+        # Pages before this document when it is one segment of a book
+        self.page_offset = page_offset
         self.set_margins(left=5, top=5, right=5)
         self.set_auto_page_break(auto=True, margin=15)
 
@@ -37,7 +41,8 @@ class PDF(FPDF):
         if self.dark_mode:
             self.set_text_color(180, 180, 180)
         self.set_font(FONT_NAME, "I", size=8)
-        self.cell(0, 1, f"Page {self.page_no()}", 0, 0, "C")
+        page_number = self.page_no() + self.page_offset
+        self.cell(0, 1, f"Page {page_number}", 0, 0, "C")
 
     def add_page(self, orientation="", page_format="", same=False):
         """method for creating a new page"""
@@ -49,6 +54,16 @@ class PDF(FPDF):
             self.set_text_color(180, 180, 180)
 
 
+def _fits_one_line(pdf, text, width):
+    """Whether `text` fits `width` without multi_cell having to wrap it."""
+    if "\n" in text:
+        return False
+    usable = width - 2 * pdf.c_margin
+    # Near-ties go to multi_cell so its own line breaking decides them
+    tolerance = WIDTH_TOLERANCE * max(1.0, usable)
+    return glyph_widths(pdf).text_width(pdf, text) < usable - tolerance
+
+
 def create_custom_pdf(
     pdf,
     formatted_paragraphs,
@@ -57,14 +72,41 @@ def create_custom_pdf(
     indent_width,
     base_font_size=BASE_FONT_SIZE,
 ):
-    """Render paragraphs into a custom PDF with optional dark mode"""
+    """Render paragraphs into a custom PDF with optional dark mode
 
+    With output_path=None the document is returned as bytes instead of
+    being written to disk.
+
+    Lines arrive already wrapped by reformat_paragraphs, so each is placed
+    with a single cell; multi_cell, which wraps the text a second time, is
+    only used for a line too wide for the page. Font changes are only made
+    when the style or size actually changes.
+    """
     pdf.set_font(new_font, size=base_font_size)
+    font_state = ("", base_font_size)
     available_width = pdf.w - pdf.l_margin - pdf.r_margin
     previous_original_page_number = None
     previous_formatting = None
     pdf.add_page()
 
+    # Only page separators stroke lines, so their pen is set up once
+    pdf.set_draw_color(128, 128, 128)
+    pdf.set_line_width(0.1)
+
+    def set_font(style, size):
+        nonlocal font_state
+        if (style, size) != font_state:
+            pdf.set_font(new_font, style=style, size=size)
+            font_state = (style, size)
+
+    def place_line(text, line_height):
+        if _fits_one_line(pdf, text, available_width):
+            pdf.cell(available_width, line_height, text=text,
+                     new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="L")
+        else:
+            pdf.multi_cell(available_width, line_height, text=text,
+                           new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="L")
+
     for paragraph in formatted_paragraphs:
         if not paragraph:
             continue
@@ -74,46 +116,35 @@ def create_custom_pdf(
         if is_toc:
             if previous_formatting != "is_toc":
                 pdf.cell(
-                    0, LINE_HEIGHT_RATIO * base_font_size, txt=" ",
-                    ln=1, align="C"
+                    0, LINE_HEIGHT_RATIO * base_font_size, text=" ",
+                    new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C"
                 )
 
-            pdf.set_font(
-                new_font, size=paragraph[0]["font_size"],
-                style=paragraph[0]["style"]
-            )
+            set_font(paragraph[0]["style"], paragraph[0]["font_size"])
             for line in paragraph:
                 pdf.set_x(pdf.l_margin)
-                pdf.multi_cell(
-                    available_width, line["line_height"],
-                    txt=line["text"], align="L"
-                )
+                place_line(line["text"], line["line_height"])
             previous_formatting = "is_toc"
             continue
 
         for line in paragraph:
             line_height = line["line_height"]
-            effective_font_size = line["font_size"]
-            style = line["style"]
             text = line["text"]
             is_heading = line.get("is_heading", False)
             indent = line.get("indent", False)
             original_page_number = line.get("page_number")
 
-            pdf.set_font(new_font, style=style, size=effective_font_size)
+            set_font(line["style"], line["font_size"])
 
             # Draw separator line if there's a page break in the original text
             if (
                 previous_original_page_number is not None
                 and original_page_number != previous_original_page_number
             ):
-                pdf.set_draw_color(128, 128, 128)
-                pdf.set_line_width(0.1)
                 y_position = pdf.get_y() + line_height / 2
                 pdf.line(pdf.l_margin, y_position,
                          pdf.w - pdf.r_margin, y_position)
                 pdf.ln(6)
-                pdf.set_draw_color(0, 0, 0)
 
             previous_original_page_number = original_page_number
 
@@ -126,16 +157,18 @@ def create_custom_pdf(
             # Render headings as centered text
             if is_heading:
                 if previous_formatting != "is_heading":
-                    pdf.cell(0, line_height, txt=" ", ln=1, align="C")
-                pdf.cell(0, line_height, txt=text, ln=1, align="C")
+                    pdf.cell(0, line_height, text=" ",
+                             new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
+                pdf.cell(0, line_height, text=text,
+                         new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
                 previous_formatting = "is_heading"
             elif indent and line == paragraph[0]:
                 pdf.set_x(pdf.l_margin + indent_width)
-                pdf.cell(0, line_height, txt=text, ln=1, align="L")
+                pdf.cell(0, line_height, text=text,
+                         new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="L")
                 previous_formatting = "body_text"
             else:
-                pdf.multi_cell(available_width, line_height,
-                               txt=text, align="L")
+                place_line(text, line_height)
                 previous_formatting = "body_text"
 
-    pdf.output(output_path)
+    return pdf.output(output_path)
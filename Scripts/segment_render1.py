@@ -0,0 +1,95 @@
+import hashlib
+import io
+import json
+import pickle
+from extraction_cache1 import (
+    DEFAULT_MAX_BYTES, load_bytes, store_bytes
+)
+
+# Bump whenever reflow or rendering change their output so that stale
+# segment renders stop matching
+SEGMENT_VERSION = "1"
+
+
+def split_segments(merged_paragraphs):
+    """Split a book into chapter segments at each chapter heading.
+
+    Anything before the first heading (title page, contents) is a segment
+    of its own. TOC lines are never split on, even if they were also
+    flagged as headings.
+    """
+    return list(iter_segments(merged_paragraphs))
+
+
+def iter_segments(merged_paragraphs):
+    """Yield the chapter segments of split_segments one at a time."""
+    current = []
+    for paragraph in merged_paragraphs:
+        first_line = paragraph[0] if paragraph else None
+        starts_chapter = (first_line is not None
+                          and first_line.chapter_heading == 1
+                          and not first_line.toc)
+        if starts_chapter and current:
+            yield current
+            current = []
+        current.append(paragraph)
+    if current:
+        yield current
+
+
+def _digest(*parts):
+    """SHA-256 hex digest of pickled parts."""
+    return hashlib.sha256(pickle.dumps(parts, protocol=4)).hexdigest()
+
+
+def reflow_key(segment, reflow_settings):
+    """Cache key of a segment's reflow: its lines plus the reflow settings."""
+    return f"seg-{_digest(SEGMENT_VERSION, reflow_settings, segment)}"
+
+
+def render_key(reflow_cache_key, render_settings, page_offset):
+    """Cache key of a segment's render, which also depends on where it
+    starts in the book because page numbers are printed in the footer.
+    """
+    return f"seg-{_digest(reflow_cache_key, render_settings, page_offset)}"
+
+
+def load_reflow(cache_dir, key):
+    """Cached reflowed paragraphs of a segment, or None."""
+    data = load_bytes(cache_dir, key, "reflow.pkl")
+    return pickle.loads(data) if data is not None else None
+
+
+def store_reflow(cache_dir, key, formatted, max_bytes=DEFAULT_MAX_BYTES):
+    """Cache the reflowed paragraphs of a segment."""
+    store_bytes(cache_dir, key, "reflow.pkl",
+                pickle.dumps(formatted, protocol=4), max_bytes)
+
+
+def load_render(cache_dir, key):
+    """Cached (pdf_bytes, page_count) of a segment, or None."""
+    meta = load_bytes(cache_dir, key, "render.json")
+    data = load_bytes(cache_dir, key, "render.pdf")
+    if meta is None or data is None:
+        return None
+    return data, json.loads(meta)["pages"]
+
+
+def store_render(cache_dir, key, data, pages, max_bytes=DEFAULT_MAX_BYTES):
+    """Cache a segment's rendered PDF and its page count."""
+    store_bytes(cache_dir, key, "render.pdf", bytes(data), max_bytes)
+    # Written last: a render only counts as cached once its page count is
+    store_bytes(cache_dir, key, "render.json",
+                json.dumps({"pages": pages}).encode(), max_bytes)
+
+
+def merge_segments(segment_pdfs, output_path):
+    """Stitch rendered segment PDFs, in order, into the output file."""
+    from PyPDF2 import PdfMerger
+
+    merger = PdfMerger()
+    for data in segment_pdfs:
+        merger.append(io.BytesIO(data))
+    with open(output_path, "wb") as f:
+        merger.write(f)
+    merger.close()
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must not load just because main3 was imported
+HEAVY_MODULES = ("pandas", "fitz", "pymupdf", "rapidfuzz", "fpdf", "PyPDF2")
+
+# Default budget for `import main3`, in milliseconds of cumulative import
+# time as reported by -X importtime
+DEFAULT_BUDGET_MS = 150
+
+
+def _run(args):
+    """Run a Python command from the Scripts directory; return the result
+    and its wall time in seconds.
+    """
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *args], cwd=SCRIPTS_DIR, capture_output=True,
+        text=True,
+    )
+    return result, time.perf_counter() - started
+
+
+def parse_importtime(stderr):
+    """Map module name to (self_us, cumulative_us) from -X importtime."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented; the name itself has no spaces
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def import_profile(module="main3"):
+    """Cumulative import time of `module` and its slowest dependencies."""
+    result, _ = _run(["-X", "importtime", "-c", f"import {module}"])
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    modules = parse_importtime(result.stderr)
+    return modules[module][1] / 1000, modules
+
+
+def loaded_heavy_modules(module="main3"):
+    """Heavy modules that importing `module` pulls in."""
+    result, _ = _run([
+        "-c",
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))",
+    ])
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    return result.stdout.split()
+
+
+def command_seconds(args, repeat):
+    """Median wall time of a CLI invocation over `repeat` runs."""
+    times = []
+    for _ in range(repeat):
+        result, seconds = _run(args)
+        if result.returncode not in (0, 1):
+            raise RuntimeError(f"{' '.join(args)} failed:\n{result.stderr}")
+        times.append(seconds)
+    return statistics.median(times)
+
+
+def run_benchmark(repeat=5, top=10):
+    """Measure import and CLI startup times."""
+    import_ms = []
+    modules = {}
+    for _ in range(repeat):
+        total_ms, modules = import_profile()
+        import_ms.append(total_ms)
+
+    slowest = sorted(modules.items(), key=lambda item: item[1][0],
+                     reverse=True)[:top]
+    return {
+        "python": sys.version.split()[0],
+        "import_main3_ms": round(statistics.median(import_ms), 1),
+        "heavy_modules_loaded": loaded_heavy_modules(),
+        "help_seconds": round(
+            command_seconds(["main3.py", "--help"], repeat), 3),
+        "check_config_seconds": round(
+            command_seconds(["main3.py", "--check-config"], repeat), 3),
+        "slowest_imports_ms": {
+            name: round(self_us / 1000, 1) for name, (self_us, _) in slowest
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure CLI startup time with -X importtime."
+    )
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs per measurement; the median is kept")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="fail if importing main3 takes longer "
+                             "(default: %(default)s)")
+    parser.add_argument("--results", help="write the results to this JSON "
+                                          "file")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.repeat)
+    print(f"import main3:    {results['import_main3_ms']:.1f} ms "
+          f"(budget {args.budget_ms:g} ms)")
+    print(f"main3 --help:    {results['help_seconds']:.3f} s")
+    print(f"--check-config:  {results['check_config_seconds']:.3f} s")
+    print("Slowest imports (self time):")
+    for name, ms in results["slowest_imports_ms"].items():
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failures = []
+    if results["import_main3_ms"] > args.budget_ms:
+        failures.append("import main3 is over budget")
+    if results["heavy_modules_loaded"]:
+        failures.append("import main3 loads "
+                        + ", ".join(results["heavy_modules_loaded"]))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+
+    if args.results:
+        with open(args.results, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,452 @@
+import io
+import os
+import time
+import zlib
+from config2 import font
+
+# PostScript names of the standard fonts every PDF reader has, by family
+# and style; these need no font file, so nothing but widths is kept
+CORE_FONT_NAMES = {
+    "courier": {"": "Courier", "B": "Courier-Bold",
+                "I": "Courier-Oblique", "BI": "Courier-BoldOblique"},
+    "helvetica": {"": "Helvetica", "B": "Helvetica-Bold",
+                  "I": "Helvetica-Oblique", "BI": "Helvetica-BoldOblique"},
+    "times": {"": "Times-Roman", "B": "Times-Bold",
+              "I": "Times-Italic", "BI": "Times-BoldItalic"},
+    "symbol": {"": "Symbol"},
+    "zapfdingbats": {"": "ZapfDingbats"},
+}
+FAMILY_ALIASES = {"arial": "helvetica"}
+
+# Objects written last but referenced by every page
+PAGES_ID = 1
+RESOURCES_ID = 2
+FIRST_FREE_ID = 3
+
+UNITS = {"pt": 1.0, "mm": 72 / 25.4, "cm": 72 / 2.54, "in": 72.0}
+
+BLACK = (0.0, 0.0, 0.0)
+
+
+def is_core_font(family):
+    """Whether StreamingPDF can write text in `family`."""
+    family = family.lower()
+    return FAMILY_ALIASES.get(family, family) in CORE_FONT_NAMES
+
+
+def _number(value):
+    """A colour component as fpdf2 writes it: up to 4 decimals."""
+    return f"{value:.4f}".rstrip("0").rstrip(".") or "0"
+
+
+def _color(r, g=None, b=None):
+    """RGB components in 0..1 from FPDF-style 0..255 arguments."""
+    if g is None:
+        g = b = r
+    return (r / 255, g / 255, b / 255)
+
+
+def _escape(text):
+    """Text as the body of a PDF string literal."""
+    return (text.replace("\\", "\\\\").replace("(", "\\(")
+            .replace(")", "\\)").replace("\r", "\\r"))
+
+
+class StreamingPDF:
+    """The part of the FPDF interface create_custom_pdf uses, writing each
+    page to the output as soon as the next one starts.
+
+    FPDF keeps every page's content stream until output(); here a page is
+    compressed and written the moment it is finished, followed by its page
+    object, and only object offsets and page ids are kept. The page tree,
+    font and catalog objects, the cross-reference table and the trailer
+    come last. Offsets are counted rather than asked of the file, so the
+    output can be a pipe or a socket.
+
+    Page layout, header and footer match pdf_handler4.PDF. Only the core
+    fonts are supported; text is measured by an FPDF object that never
+    gets a page.
+    """
+
+    def __init__(self, output=None, dark_mode=False, unit="mm",
+                 page_format=(80, 150), page_offset=0):
+        from fpdf import FPDF
+
+        self.dark_mode = dark_mode
+        self.page_offset = page_offset
+        self.k = UNITS[unit]
+        self.w, self.h = page_format
+        # Measures strings and supplies FPDF's default margins
+        self._measure = FPDF(unit=unit, format=page_format)
+        self.c_margin = self._measure.c_margin
+        self.l_margin = self.t_margin = self.r_margin = self._measure.l_margin
+        self.b_margin = self._measure.b_margin
+        self.auto_page_break = True
+        self.font_family = ""
+        self.font_style = ""
+        self.font_size_pt = 12
+        self.font_size = 12 / self.k
+        self.font_stretching = 100
+        self.char_spacing = 0
+        self.line_width = 0.567 / self.k
+        self.draw_color = BLACK
+        self.fill_color = BLACK
+        self.text_color = BLACK
+        self.x = self.y = 0.0
+        self.lasth = 0.0
+
+        self.page = 0
+        self._content = []
+        self._page_font = None
+        self._in_footer = False
+        self._fonts = {}
+        self._offsets = {}
+        self._next_id = FIRST_FREE_ID
+        self._kids = []
+
+        if output is None:
+            self._stream = io.BytesIO()
+        elif isinstance(output, (str, os.PathLike)):
+            self._stream = open(output, "wb")
+        else:
+            self._stream = output
+        self._owns_stream = output is None or self._stream is not output
+        self._position = 0
+
+    # Layout state, as on FPDF
+
+    def set_margins(self, left, top, right=-1):
+        self.l_margin = left
+        self.t_margin = top
+        self.r_margin = left if right == -1 else right
+
+    def set_auto_page_break(self, auto, margin=0):
+        self.auto_page_break = auto
+        self.b_margin = margin
+
+    def set_font(self, family=None, style="", size=0):
+        family = (family or self.font_family).lower()
+        family = FAMILY_ALIASES.get(family, family)
+        style = "".join(sorted(style.upper().replace("U", "")))
+        if not is_core_font(family):
+            raise ValueError(f"StreamingPDF only supports the core fonts, "
+                             f"not {family!r}")
+        if size:
+            self.font_size_pt = size
+            self.font_size = size / self.k
+        self.font_family = family
+        self.font_style = style
+        self._measure.set_font(family, style, self.font_size_pt)
+
+    def get_string_width(self, text):
+        return self._measure.get_string_width(text)
+
+    def page_no(self):
+        return self.page
+
+    def get_x(self):
+        return self.x
+
+    def get_y(self):
+        return self.y
+
+    def set_x(self, x):
+        self.x = x if x >= 0 else self.w + x
+
+    def set_y(self, y):
+        self.x = self.l_margin
+        self.y = y if y >= 0 else self.h + y
+
+    def ln(self, h=None):
+        self.x = self.l_margin
+        self.y += self.lasth if h is None else h
+
+    def set_draw_color(self, r, g=None, b=None):
+        color = _color(r, g, b)
+        if color != self.draw_color and self.page:
+            self._out(" ".join(map(_number, color)) + " RG")
+        self.draw_color = color
+
+    def set_fill_color(self, r, g=None, b=None):
+        color = _color(r, g, b)
+        if color != self.fill_color and self.page:
+            self._out(" ".join(map(_number, color)) + " rg")
+        self.fill_color = color
+
+    def set_text_color(self, r, g=None, b=None):
+        self.text_color = _color(r, g, b)
+
+    def set_line_width(self, width):
+        if width != self.line_width and self.page:
+            self._out(f"{width * self.k:.2f} w")
+        self.line_width = width
+
+    # Drawing
+
+    def line(self, x1, y1, x2, y2):
+        k, h = self.k, self.h
+        self._out(f"{x1 * k:.2f} {(h - y1) * k:.2f} m "
+                  f"{x2 * k:.2f} {(h - y2) * k:.2f} l S")
+
+    def rect(self, x, y, w, h, style=""):
+        op = {"F": "f", "FD": "B", "DF": "B"}.get(style.upper(), "S")
+        k = self.k
+        self._out(f"{x * k:.2f} {(self.h - y) * k:.2f} {w * k:.2f} "
+                  f"{-h * k:.2f} re {op}")
+
+    def cell(self, w=None, h=None, text="", align="L", new_x="RIGHT",
+             new_y="TOP"):
+        """One line of text in a box, placed as FPDF.cell places it.
+
+        new_x and new_y take fpdf's XPos and YPos or their names.
+        """
+        if h is None:
+            h = self.font_size
+        if (self.auto_page_break and not self._in_footer
+                and self.y + h > self.h - self.b_margin):
+            x = self.x
+            self.add_page()
+            self.x = x
+        if not w:
+            w = self.w - self.r_margin - self.x
+        if text:
+            # "C" or Align.C, whose value is "CENTER"
+            self._text(text, w, h, str(getattr(align, "value", align))[:1])
+        self.lasth = h
+
+        new_x = getattr(new_x, "name", new_x)
+        new_y = getattr(new_y, "name", new_y)
+        if new_x == "LMARGIN":
+            self.x = self.l_margin
+        elif new_x == "RIGHT":
+            self.x += w
+        if new_y == "NEXT":
+            self.y += h
+
+    def multi_cell(self, w, h=None, text="", align="L", new_x="RIGHT",
+                   new_y="NEXT"):
+        """Text wrapped at spaces into cells of width w, one per line.
+
+        A word wider than a line is split between characters.
+        """
+        if not w:
+            w = self.w - self.r_margin - self.x
+        x = self.x
+        lines = self._wrap(text, w - 2 * self.c_margin)
+        for i, line in enumerate(lines):
+            self.x = x
+            last = i == len(lines) - 1
+            self.cell(w, h, line, align,
+                      new_x=new_x if last else "LEFT", new_y="NEXT")
+        new_y = getattr(new_y, "name", new_y)
+        if new_y == "TOP" and lines:
+            self.y -= self.lasth * len(lines)
+
+    def _wrap(self, text, width):
+        """Lines of `text` no wider than `width`, breaking at spaces."""
+        lines = []
+        for paragraph in text.split("\n"):
+            line = ""
+            for word in paragraph.split(" "):
+                candidate = f"{line} {word}" if line else word
+                if self.get_string_width(candidate) <= width:
+                    line = candidate
+                    continue
+                if line:
+                    lines.append(line)
+                line = ""
+                for char in word:
+                    if line and self.get_string_width(line + char) > width:
+                        lines.append(line)
+                        line = ""
+                    line += char
+            lines.append(line)
+        return lines
+
+    def _text(self, text, w, h, align):
+        """Write a cell's text at the current position."""
+        try:
+            text.encode("latin-1")
+        except UnicodeEncodeError as e:
+            raise ValueError(f"core fonts can only print latin-1 text: "
+                             f"{text!r}") from e
+        width = self.get_string_width(text)
+        if align == "C":
+            dx = (w - width) / 2
+        elif align == "R":
+            dx = w - self.c_margin - width
+        else:
+            dx = self.c_margin
+        self._use_font()
+        k = self.k
+        x = (self.x + dx) * k
+        y = (self.h - self.y - 0.5 * h - 0.3 * self.font_size) * k
+        body = f"({_escape(text)}) Tj"
+        if self.text_color == self.fill_color:
+            self._out(f"BT {x:.2f} {y:.2f} Td {body} ET")
+        else:
+            color = " ".join(map(_number, self.text_color))
+            self._out(f"q BT {x:.2f} {y:.2f} Td {color} rg {body} ET Q")
+
+    def _use_font(self):
+        """Select the current font in the page's content, if it changed."""
+        names = CORE_FONT_NAMES[self.font_family]
+        name = names.get(self.font_style, names[""])
+        if name not in self._fonts:
+            self._fonts[name] = len(self._fonts) + 1
+        selected = (name, self.font_size_pt)
+        if selected != self._page_font:
+            self._page_font = selected
+            self._out(f"BT /F{self._fonts[name]} "
+                      f"{self.font_size_pt:.2f} Tf ET")
+
+    # Pages
+
+    def header(self):
+        """Same header as pdf_handler4.PDF."""
+        if self.dark_mode:
+            self.set_fill_color(0, 0, 0)
+            self.rect(0, 0, self.w, 5, "F")
+            self.set_text_color(180, 180, 180)
+        self.set_font(font, "B", size=8)
+
+    def footer(self):
+        """Same footer as pdf_handler4.PDF."""
+        self.set_y(-5)
+        if self.dark_mode:
+            self.set_text_color(180, 180, 180)
+        self.set_font(font, "I", size=8)
+        page_number = self.page_no() + self.page_offset
+        self.cell(0, 1, f"Page {page_number}", align="C")
+
+    def add_page(self):
+        """Finish and write the current page, then start a new one.
+
+        The font, colours and pen survive the header and footer, as they
+        do with FPDF.
+        """
+        state = (self.font_family, self.font_style, self.font_size_pt,
+                 self.text_color, self.fill_color, self.draw_color,
+                 self.line_width)
+        if self.page:
+            self._end_page()
+        self.page += 1
+        self._content = ["2 J", f"{self.line_width * self.k:.2f} w"]
+        if self.draw_color != BLACK:
+            self._out(" ".join(map(_number, self.draw_color)) + " RG")
+        if self.fill_color != BLACK:
+            self._out(" ".join(map(_number, self.fill_color)) + " rg")
+        self._page_font = None
+        self.x, self.y = self.l_margin, self.t_margin
+        self.header()
+
+        family, style, size, text, fill, draw, width = state
+        if family:
+            self.set_font(family, style, size)
+        self.text_color = text
+        self.set_fill_color(*(c * 255 for c in fill))
+        self.set_draw_color(*(c * 255 for c in draw))
+        self.set_line_width(width)
+        if self.dark_mode:
+            self.set_fill_color(0, 0, 0)
+            self.rect(0, 0, self.w, self.h, "F")
+            self.set_text_color(180, 180, 180)
+
+    def _end_page(self):
+        """Run the footer and write the page; its content is dropped."""
+        self._in_footer = True
+        self.footer()
+        self._in_footer = False
+
+        data = zlib.compress("\n".join(self._content).encode("latin-1"))
+        self._content = []
+        contents_id = self._begin_object()
+        self._write(f"<</Filter /FlateDecode /Length {len(data)}>>\n"
+                    f"stream\n".encode() + data + b"\nendstream\nendobj\n")
+        page_id = self._begin_object()
+        self._write(f"<</Type /Page /Parent {PAGES_ID} 0 R "
+                    f"/Resources {RESOURCES_ID} 0 R "
+                    f"/Contents {contents_id} 0 R>>\nendobj\n".encode())
+        self._kids.append(page_id)
+
+    def _out(self, line):
+        self._content.append(line)
+
+    # File structure
+
+    def _write(self, data):
+        self._stream.write(data)
+        self._position += len(data)
+
+    def _begin_object(self, object_id=None):
+        if not self._position:
+            # Held back until the first page is done, so a document that
+            # fails while being set up leaves its output empty
+            self._write(b"%PDF-1.3\n%\xe9\xeb\xf1\xbf\n")
+        if object_id is None:
+            object_id = self._next_id
+            self._next_id += 1
+        self._offsets[object_id] = self._position
+        self._write(f"{object_id} 0 obj\n".encode())
+        return object_id
+
+    def _write_object(self, body, object_id=None):
+        object_id = self._begin_object(object_id)
+        self._write(f"{body}\nendobj\n".encode("latin-1"))
+        return object_id
+
+    def output(self, name=None):
+        """Write the last page and the closing objects.
+
+        The document has already gone to the output given to the
+        constructor; `name` is accepted for FPDF compatibility. Returns
+        the bytes when there was no output, else None.
+        """
+        if self.page:
+            self._end_page()
+
+        font_refs = []
+        for base_font, number in self._fonts.items():
+            font_id = self._write_object(
+                f"<</Type /Font /Subtype /Type1 /BaseFont /{base_font}"
+                + ("" if base_font in ("Symbol", "ZapfDingbats")
+                   else " /Encoding /WinAnsiEncoding") + ">>"
+            )
+            font_refs.append(f"/F{number} {font_id} 0 R")
+        self._write_object(
+            f"<</Font <<{' '.join(font_refs)}>> "
+            f"/ProcSet [/PDF /Text /ImageB /ImageC /ImageI]>>",
+            RESOURCES_ID,
+        )
+        kids = " ".join(f"{kid} 0 R" for kid in self._kids)
+        self._write_object(
+            f"<</Type /Pages /Count {len(self._kids)} /Kids [{kids}] "
+            f"/MediaBox [0 0 {self.w * self.k:.2f} {self.h * self.k:.2f}]>>",
+            PAGES_ID,
+        )
+        catalog_id = self._write_object(
+            f"<</Type /Catalog /Pages {PAGES_ID} 0 R "
+            f"/PageLayout /OneColumn>>"
+        )
+        created = time.strftime("%Y%m%d%H%M%S")
+        info_id = self._write_object(
+            f"<</CreationDate (D:{created})>>"
+        )
+
+        xref_position = self._position
+        count = self._next_id
+        entries = ["xref", f"0 {count}", "0000000000 65535 f "]
+        entries += [f"{self._offsets[object_id]:010d} 00000 n "
+                    for object_id in range(1, count)]
+        self._write(("\n".join(entries) + "\n").encode())
+        self._write(f"trailer\n<</Size {count} /Root {catalog_id} 0 R "
+                    f"/Info {info_id} 0 R>>\nstartxref\n{xref_position}\n"
+                    f"%%EOF\n".encode())
+
+        if isinstance(self._stream, io.BytesIO) and self._owns_stream:
+            return self._stream.getvalue()
+        if self._owns_stream:
+            self._stream.close()
+        else:
+            self._stream.flush()
+        return None
@@ -1,30 +1,71 @@
-import pandas as pd
-from config2 import save_list_to_file
-
-
-def convert_csv_to_dict(line_df):
-    """Convert CSV data to a dictionary format for text processing."""
-    text_dict = []
-    for _, row in line_df.iterrows():
-        line_data = {
-            'page_number': row['page_number'],
-            'text': row['text'],
-            'line_bbox_x1': row['line_bbox_x1'],
-            'line_bbox_y1': row['line_bbox_y1'],
-            'line_bbox_x2': row['line_bbox_x2'],
-            'line_bbox_y2': row['line_bbox_y2'],
-            'font_size': row['font_size'],
-            'font': row['font'],
+from debug_artifacts1 import dump_paragraphs
+
+
+class Line:
+    """A single text line with its position and formatting flags."""
+
+    __slots__ = (
+        'page_number', 'text',
+        'line_bbox_x1', 'line_bbox_y1', 'line_bbox_x2', 'line_bbox_y2',
+        'font_size', 'font', 'bold', 'italic',
+        'toc', 'chapter_heading', 'split_paragraph',
+    )
+
+    def __init__(self, page_number, text,
+                 line_bbox_x1, line_bbox_y1, line_bbox_x2, line_bbox_y2,
+                 font_size, font, bold, italic,
+                 toc, chapter_heading, split_paragraph=False):
+        self.page_number = page_number
+        self.text = text
+        self.line_bbox_x1 = line_bbox_x1
+        self.line_bbox_y1 = line_bbox_y1
+        self.line_bbox_x2 = line_bbox_x2
+        self.line_bbox_y2 = line_bbox_y2
+        self.font_size = font_size
+        self.font = font
+        self.bold = bold
+        self.italic = italic
+        self.toc = toc
+        self.chapter_heading = chapter_heading
+        self.split_paragraph = split_paragraph
+
+    def __reduce__(self):
+        """Pickle as a flat argument tuple for cheap transfer to workers."""
+        return (Line, tuple(getattr(self, name) for name in self.__slots__))
+
+    def as_dict(self):
+        """Nested dict form of the line, as written to debug artifacts."""
+        return {
+            'page_number': self.page_number,
+            'text': self.text,
+            'line_bbox_x1': self.line_bbox_x1,
+            'line_bbox_y1': self.line_bbox_y1,
+            'line_bbox_x2': self.line_bbox_x2,
+            'line_bbox_y2': self.line_bbox_y2,
+            'font_size': self.font_size,
+            'font': self.font,
             'flags': {
-                'bold': row['bold'],
-                'italic': row['italic'],
-                'toc': row['TOC'],
-                'chapter_heading': row['chapter_heading'],
-                'split_paragraph': False
+                'bold': self.bold,
+                'italic': self.italic,
+                'toc': self.toc,
+                'chapter_heading': self.chapter_heading,
+                'split_paragraph': self.split_paragraph
             }
         }
-        text_dict.append(line_data)
-    return text_dict
+
+
+LINE_SOURCE_COLUMNS = [
+    'page_number', 'text',
+    'line_bbox_x1', 'line_bbox_y1', 'line_bbox_x2', 'line_bbox_y2',
+    'font_size', 'font', 'bold', 'italic', 'TOC', 'chapter_heading',
+]
+
+
+def convert_csv_to_lines(line_df):
+    """Build Line records from the flagged line DataFrame, column-wise."""
+    # tolist() turns each column into plain Python values in one call
+    columns = [line_df[column].tolist() for column in LINE_SOURCE_COLUMNS]
+    return [Line(*values) for values in zip(*columns)]
 
 
 def group_text_blocks_into_paragraphs(
@@ -32,22 +73,35 @@ def group_text_blocks_into_paragraphs(
     indent_threshold=10.0, font_size_change_threshold=1
 ):
     """Group lines into paragraphs based on vertical and indent changes."""
-    paragraphs = []
+    paragraphs = list(iter_paragraphs(
+        text_dict, vertical_threshold,
+        indent_threshold, font_size_change_threshold
+    ))
+
+    dump_paragraphs(paragraphs, 'paragraphs')
+    return paragraphs
+
+
+def iter_paragraphs(
+    text_dict, vertical_threshold=5.0,
+    indent_threshold=10.0, font_size_change_threshold=1
+):
+    """Yield paragraphs one at a time from any iterable of lines."""
     current_paragraph = []
     previous_bottom = previous_indent = \
         previous_font_size = previous_page_number = None
 
     for line in text_dict:
-        line_indent = line['line_bbox_x1']
-        line_font_size = line['font_size']
-        line_bottom = line['line_bbox_y2']
-        line_page_number = line['page_number']
+        line_indent = line.line_bbox_x1
+        line_font_size = line.font_size
+        line_bottom = line.line_bbox_y2
+        line_page_number = line.page_number
 
         # Check if the line is a TOC or Chapter Heading
-        if line['flags']['toc'] or line['flags']['chapter_heading']:
+        if line.toc or line.chapter_heading:
             if current_paragraph:
-                paragraphs.append(current_paragraph)
-            paragraphs.append([line])  # Each heading is a separate paragraph
+                yield current_paragraph
+            yield [line]  # Each heading is a separate paragraph
             current_paragraph = []
             previous_bottom = line_bottom
             previous_indent = line_indent
@@ -63,9 +117,9 @@ def group_text_blocks_into_paragraphs(
         if is_new_page:
             new_paragraph = True
             if line_indent - previous_indent <= indent_threshold:
-                line['flags']['split_paragraph'] = True
+                line.split_paragraph = True
         elif previous_bottom is not None:
-            vertical_gap = line['line_bbox_y1'] - previous_bottom
+            vertical_gap = line.line_bbox_y1 - previous_bottom
             indent_change = line_indent - previous_indent if \
                 previous_indent is not None else 0
             font_size_change = abs(line_font_size - previous_font_size) if \
@@ -78,7 +132,7 @@ def group_text_blocks_into_paragraphs(
 
         if new_paragraph:
             if current_paragraph:
-                paragraphs.append(current_paragraph)
+                yield current_paragraph
             current_paragraph = [line]
         else:
             current_paragraph.append(line)
@@ -89,9 +143,6 @@ def group_text_blocks_into_paragraphs(
         previous_font_size = line_font_size
         previous_page_number = line_page_number
 
-    # Append any remaining lines in the last paragraph
+    # Yield any remaining lines in the last paragraph
     if current_paragraph:
-        paragraphs.append(current_paragraph)
-
-    save_list_to_file(paragraphs, filename='paragraphs.json')
-    return paragraphs
+        yield current_paragraph
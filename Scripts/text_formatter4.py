@@ -1,13 +1,21 @@
-import re
-import logging
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from fpdf import FPDF
-import json
-from config2 import save_list_to_file
+from debug_artifacts1 import dump_paragraphs
+from line_breaker1 import break_lines
+from unicode_fonts1 import printable_texts, register_fonts
 
-logging.basicConfig(
-    filename='/Users/emmawatts/Desktop/python_work/scriptorium_tests/reformatted_lengths.log',
-    level=logging.INFO
-)
+# Joins line texts for batch cleaning; see clean_texts
+LINE_SEPARATOR = '\x00'
+# Once text is ASCII these are the characters str.split() and the regex
+# \s treat as whitespace besides the space itself
+ASCII_WHITESPACE = bytes.maketrans(b'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f',
+                                   b' ' * 9)
+
+# Paragraphs per worker below which a process pool costs more than it saves
+MIN_PARAGRAPHS_PER_WORKER = 500
 
 
 def calculate_indent_width(pdf, font, new_font_size, num_spaces=8):
@@ -18,82 +26,155 @@ def calculate_indent_width(pdf, font, new_font_size, num_spaces=8):
 
 def join_hyphenated_words(paragraphs):
     """Join hyphenated words split across lines in paragraphs."""
+    paragraphs = list(iter_joined_paragraphs(paragraphs))
+
+    dump_paragraphs(paragraphs, 'de-hyphenated_paragraphs')
+    return paragraphs
+
+
+def iter_joined_paragraphs(paragraphs):
+    """Yield paragraphs with hyphenated line breaks joined."""
     for paragraph in paragraphs:
         lines = paragraph
         for i in range(len(lines) - 1):
             current_line, next_line = lines[i], lines[i + 1]
-            current_text, next_text = \
-                current_line['text'].rstrip(), next_line['text'].lstrip()
-
-            if current_text.endswith('-'):
-                current_text = current_text[:-1]
-                last_word = current_text.split()[-1] if \
-                    current_text.split() else None
-                first_word = next_text.split()[0] if \
-                    next_text.split() else None
-                if last_word and first_word:
-                    combined_word = last_word + first_word
-                    current_line['text'] = \
-                        ' '.join(current_text.split()[:-1] + [combined_word])
-                    next_line['text'] = ' '.join(next_text.split()[1:])
-
-    save_list_to_file(paragraphs, filename='de-hyphenated_paragraphs.json')
-    return paragraphs
+            current_text = current_line.text.rstrip()
+            if not current_text.endswith('-'):
+                continue
+
+            # Each side is split once; the joined word moves up a line
+            current_words = current_text[:-1].split()
+            next_words = next_line.text.split()
+            if current_words and next_words:
+                current_words[-1] += next_words[0]
+                current_line.text = ' '.join(current_words)
+                next_line.text = ' '.join(next_words[1:])
+        yield paragraph
+
+
+def clean_texts(texts, coverage=None):
+    """Replace non-ASCII characters with '?' and collapse whitespace.
+
+    The texts are cleaned as one string, joined on NUL (ASCII and not
+    whitespace, so no substitution crosses a boundary), with one encode
+    and one translate table instead of a generator and a regex per line.
+
+    With `coverage`, the characters the TTF fonts can print (see
+    unicode_fonts1), text stays Unicode: it is NFC-normalized and only
+    characters outside the coverage become '?'.
+    """
+    if coverage is not None:
+        return [' '.join(text.split())
+                for text in printable_texts(texts, coverage)]
+    joined = LINE_SEPARATOR.join(texts)
+    if joined.count(LINE_SEPARATOR) != len(texts) - 1:
+        # A text contains the separator itself; clean line by line
+        return [_clean_text(text) for text in texts]
+    return [text.strip() for text in
+            _ascii_spaces(joined).split(LINE_SEPARATOR)]
+
+
+def _ascii_spaces(text):
+    """Non-ASCII characters to '?', whitespace runs to single spaces."""
+    data = text.encode('ascii', 'replace').translate(ASCII_WHITESPACE)
+    # Each pass halves the longest run of spaces
+    while b'  ' in data:
+        data = data.replace(b'  ', b' ')
+    return data.decode('ascii')
+
 
+def _clean_text(text):
+    """clean_texts for a single line."""
+    return _ascii_spaces(text).strip()
 
-def clean_paragraphs(paragraphs):
-    """Clean non-ASCII characters and unwanted whitespace in paragraphs."""
+
+def _is_heading_or_toc(paragraph):
+    """TOC and heading paragraphs are passed on uncleaned, a line each."""
+    return all(line.toc == 1 for line in paragraph) or \
+        all(line.chapter_heading == 1 for line in paragraph)
+
+
+def clean_paragraphs(paragraphs, coverage=None):
+    """Clean non-ASCII characters and unwanted whitespace in paragraphs.
+
+    Every body line of the book is cleaned in a single clean_texts call.
+    With `coverage`, heading and TOC lines are made printable as well.
+    """
     cleaned_paragraphs = []
+    body_lines = []
+    heading_lines = []
     for paragraph in paragraphs:
-        if all(line.get('flags', {}).get('toc', 0) == 1 for line in paragraph)\
-           or all(line.get('flags', {}).get('chapter_heading', 0) == 1
-           for line in paragraph):
-            cleaned_paragraphs.extend([[line] for line in paragraph])
+        if _is_heading_or_toc(paragraph):
+            cleaned_paragraphs.extend([line] for line in paragraph)
+            heading_lines.extend(paragraph)
             continue
+        cleaned_paragraphs.append(list(paragraph))
+        body_lines.extend(paragraph)
 
-        cleaned_paragraph = []
-        for line in paragraph:
-            clean_text = re.sub(r'\s+', ' ', ''.join(char if ord(char) < 128
-                                else '?' for char in line['text'])).strip()
-            line['text'] = clean_text
-            cleaned_paragraph.append(line)
-        cleaned_paragraphs.append(cleaned_paragraph)
+    for line, text in zip(body_lines, clean_texts(
+            [line.text for line in body_lines], coverage)):
+        line.text = text
+    if coverage is not None:
+        _print_headings(heading_lines, coverage)
 
-    save_list_to_file(cleaned_paragraphs, filename='cleaned_paragraphs.json')
+    dump_paragraphs(cleaned_paragraphs, 'cleaned_paragraphs')
     return cleaned_paragraphs
 
 
+def iter_cleaned_paragraphs(paragraphs, coverage=None):
+    """Yield cleaned paragraphs; TOC and heading lines come out one each."""
+    for paragraph in paragraphs:
+        if _is_heading_or_toc(paragraph):
+            if coverage is not None:
+                _print_headings(paragraph, coverage)
+            yield from ([line] for line in paragraph)
+            continue
+
+        for line, text in zip(paragraph, clean_texts(
+                [line.text for line in paragraph], coverage)):
+            line.text = text
+        yield list(paragraph)
+
+
+def _print_headings(lines, coverage):
+    """Make heading and TOC lines printable without touching whitespace."""
+    for line, text in zip(lines, printable_texts(
+            [line.text for line in lines], coverage)):
+        line.text = text
+
+
 def merge_consecutive_headings(paragraphs):
     """Merge consecutive chapter headings into single paragraphs."""
-    merged_paragraphs, i = [], 0
-    while i < len(paragraphs):
-        paragraph = paragraphs[i]
+    return list(iter_merged_headings(paragraphs))
+
+
+def iter_merged_headings(paragraphs):
+    """Yield paragraphs with runs of chapter headings merged into one."""
+    heading_run = []
+
+    for paragraph in paragraphs:
         if not paragraph:
-            i += 1
             continue
 
-        first_line = paragraph[0]
-        is_heading = first_line.get('flags', {}).get('chapter_heading', 0) == 1
+        if paragraph[0].chapter_heading == 1:
+            heading_run.append(paragraph)
+            continue
+
+        if heading_run:
+            yield _merge_heading_run(heading_run)
+            heading_run = []
+        yield paragraph
+
+    if heading_run:
+        yield _merge_heading_run(heading_run)
 
-        if is_heading:
-            merged_text_lines = []
-            while i < len(paragraphs) and (paragraphs[i][0].get('flags', {})
-                                           .get('chapter_heading', 0) == 1):
-                merged_text_lines.extend(line['text']
-                                         for line in paragraphs[i])
-                i += 1
-
-            merged_paragraph = [{
-                'text': ' '.join(merged_text_lines),
-                'flags': first_line.get('flags', {}),
-                'page_number': first_line.get('page_number', 1)
-            }]
-            merged_paragraphs.append(merged_paragraph)
-        else:
-            merged_paragraphs.append(paragraph)
-            i += 1
-
-    return merged_paragraphs
+
+def _merge_heading_run(heading_run):
+    """Combine consecutive heading paragraphs into a one-line paragraph."""
+    merged_line = copy.copy(heading_run[0][0])
+    merged_line.text = ' '.join(line.text for paragraph in heading_run
+                                for line in paragraph)
+    return [merged_line]
 
 
 def wrap_text(pdf,
@@ -102,24 +183,18 @@ def wrap_text(pdf,
               new_font_size,
               max_width,
               indent_width,
-              split_paragraph):
-    """Wrap text to fit within specified width in the PDF."""
-    pdf.set_font(font, size=new_font_size)
-    words = text.split()
-    lines, current_line = [], ''
-
-    for word in words:
-        available_width = max_width - (indent_width + 1 if not lines
-                                       and not split_paragraph else 1)
-        if pdf.get_string_width(current_line + word + ' ') <= available_width:
-            current_line += word + ' '
-        else:
-            lines.append(current_line.strip())
-            current_line = word + ' '
-    if current_line:
-        lines.append(current_line.strip())
+              split_paragraph,
+              break_mode='greedy'):
+    """Wrap text to fit within specified width in the PDF.
 
-    return lines
+    The first line leaves room for the indent unless the paragraph
+    continues one split across pages; break_mode picks the line breaker
+    (see line_breaker1).
+    """
+    pdf.set_font(font, size=new_font_size)
+    first_width = max_width - (1 if split_paragraph else indent_width + 1)
+    return break_lines(pdf, text.split(), first_width, max_width - 1,
+                       break_mode)
 
 
 def reformat_paragraphs(pdf,
@@ -127,11 +202,69 @@ def reformat_paragraphs(pdf,
                         page_width_mm,
                         font, new_font_size,
                         line_height_ratio,
-                        indent_width):
-    """Reformat paragraphs with specified font, size, and alignment options."""
+                        indent_width,
+                        workers=None,
+                        fonts=None,
+                        break_mode='greedy'):
+    """Reformat paragraphs with specified font, size, and alignment options.
+
+    With workers other than 1 (None uses every core), batches of
+    paragraphs are wrapped in a process pool against the same font metrics
+    and reassembled in order; short books stay on the serial path. `fonts`
+    are the TTF files registered on `pdf` (see unicode_fonts1), which the
+    workers register as well. break_mode is 'greedy' or 'optimal'.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paragraphs) // MIN_PARAGRAPHS_PER_WORKER)
+
+    if workers <= 1:
+        formatted_paragraphs = list(iter_reformatted_paragraphs(
+            pdf, paragraphs, page_width_mm, font, new_font_size,
+            line_height_ratio, indent_width, break_mode
+        ))
+    else:
+        pdf.set_margins(left=5, top=5, right=5)
+        # Several batches per worker even out uneven paragraph lengths
+        batch_size = -(-len(paragraphs) // (workers * 4))
+        batches = [paragraphs[start:start + batch_size]
+                   for start in range(0, len(paragraphs), batch_size)]
+        formatted_paragraphs = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for formatted_batch in pool.map(
+                _reformat_batch, batches, repeat(pdf.k),
+                repeat(page_width_mm), repeat(font), repeat(new_font_size),
+                repeat(line_height_ratio), repeat(indent_width), repeat(fonts),
+                repeat(break_mode)
+            ):
+                formatted_paragraphs.extend(formatted_batch)
+
+    dump_paragraphs(formatted_paragraphs, 'formatted_paragraphs')
+    return formatted_paragraphs
+
+
+def _reformat_batch(paragraphs, unit, page_width_mm, font, new_font_size,
+                    line_height_ratio, indent_width, fonts=None,
+                    break_mode='greedy'):
+    """Reformat one batch of paragraphs in a worker process."""
+    pdf = FPDF(unit=unit)
+    register_fonts(pdf, fonts)
+    return list(iter_reformatted_paragraphs(
+        pdf, paragraphs, page_width_mm, font, new_font_size,
+        line_height_ratio, indent_width, break_mode
+    ))
+
+
+def iter_reformatted_paragraphs(pdf,
+                                paragraphs,
+                                page_width_mm,
+                                font, new_font_size,
+                                line_height_ratio,
+                                indent_width,
+                                break_mode='greedy'):
+    """Yield reformatted paragraphs one at a time."""
     pdf.set_margins(left=5, top=5, right=5)
     max_width = page_width_mm - pdf.l_margin - pdf.r_margin
-    formatted_paragraphs = []
 
     for paragraph in paragraphs:
         if not paragraph:
@@ -139,14 +272,11 @@ def reformat_paragraphs(pdf,
 
         first_line = paragraph[0]
         style = ''
-        style += 'B' if \
-            first_line.get('flags', {}).get('bold', 0) == 1 else ''
-        style += 'I' if \
-            first_line.get('flags', {}).get('italic', 0) == 1 else ''
-        is_heading = first_line.get('flags', {}).get('chapter_heading', 0) == 1
-        is_toc = first_line.get('flags', {}).get('toc', 0) == 1
-        split_paragraph = first_line.get('flags', {}).get('split_paragraph',
-                                                          False)
+        style += 'B' if first_line.bold == 1 else ''
+        style += 'I' if first_line.italic == 1 else ''
+        is_heading = first_line.chapter_heading == 1
+        is_toc = first_line.toc == 1
+        split_paragraph = first_line.split_paragraph
 
         effective_font_size = new_font_size + 4 if \
             is_heading else new_font_size
@@ -154,42 +284,37 @@ def reformat_paragraphs(pdf,
         line_height = effective_font_size * line_height_ratio
 
         if is_toc:
-            formatted_paragraphs.extend(
-                [[{'text': line['text'], 'line_height': line_height,
-                   'font_size': effective_font_size, 'style': style,
-                   'is_heading': is_heading, 'is_toc': is_toc, 'indent': False,
-                   'page_number': line.get('page_number', 1)}]
-                    for line in paragraph]
+            yield from (
+                [{'text': line.text, 'line_height': line_height,
+                  'font_size': effective_font_size, 'style': style,
+                  'is_heading': is_heading, 'is_toc': is_toc, 'indent': False,
+                  'page_number': line.page_number}]
+                for line in paragraph
             )
             continue
 
-        paragraph_text = re.sub(r'\s+', ' ', ' '.join(line.get('text', '')
-                                for line in paragraph)).strip()
+        # wrap_text splits on whitespace, so the lines need no cleaning here
+        paragraph_text = ' '.join(line.text for line in paragraph)
 
         if is_heading:
-            formatted_paragraphs.append(
-                [{'text': line, 'line_height': line_height,
-                  'font_size': effective_font_size, 'style': style,
-                  'is_heading': is_heading, 'is_toc': is_toc, 'indent': False,
-                  'page_number': first_line.get('page_number', 1)}
-                 for line in wrap_text(pdf, paragraph_text, font,
-                                       effective_font_size, max_width,
-                                       indent_width, False)]
-            )
+            yield [{'text': line, 'line_height': line_height,
+                    'font_size': effective_font_size, 'style': style,
+                    'is_heading': is_heading, 'is_toc': is_toc,
+                    'indent': False,
+                    'page_number': first_line.page_number}
+                   for line in wrap_text(pdf, paragraph_text, font,
+                                         effective_font_size, max_width,
+                                         indent_width, False, break_mode)]
             continue
 
         new_lines = wrap_text(pdf, paragraph_text, font, effective_font_size,
-                              max_width, indent_width, split_paragraph)
-        new_paragraph = [
+                              max_width, indent_width, split_paragraph,
+                              break_mode)
+        yield [
             {'text': line, 'line_height': line_height,
              'font_size': effective_font_size, 'style': style,
              'is_heading': is_heading, 'is_toc': is_toc,
              'indent': idx == 0 and not split_paragraph,
-             'page_number': first_line.get('page_number', 1)}
+             'page_number': first_line.page_number}
             for idx, line in enumerate(new_lines)
         ]
-        formatted_paragraphs.append(new_paragraph)
-
-    save_list_to_file(formatted_paragraphs,
-                      filename='formatted_paragraphs.json')
-    return formatted_paragraphs
@@ -0,0 +1,87 @@
+# Relative slack under which a summed width is re-measured by FPDF itself
+WIDTH_TOLERANCE = 1e-9
+
+# Caps that keep long-lived processes, such as service workers, from
+# growing with every book; a full cache is emptied and filled again
+MAX_CACHED_WORDS = 50000
+MAX_WIDTH_TABLES = 16
+
+_WIDTH_TABLES = {}
+
+
+class GlyphWidths:
+    """Cached glyph advances and word widths for one font setting.
+
+    Widths come from FPDF, one character at a time, so a word's width is
+    the sum of its glyph advances and a line's width the sum of its word
+    and space widths. This holds for core fonts and unshaped TTF fonts;
+    with text shaping (kerning, ligatures) widths are not additive and
+    every measurement falls back to FPDF.
+    """
+
+    def __init__(self, pdf):
+        self.additive = not getattr(pdf, "text_shaping", None)
+        self.glyphs = {}
+        self.words = {}
+        self.space = self.glyph_width(pdf, " ")
+
+    def glyph_width(self, pdf, char):
+        """Advance width of one character in user units."""
+        width = self.glyphs.get(char)
+        if width is None:
+            width = self.glyphs[char] = pdf.get_string_width(char)
+        return width
+
+    def word_width(self, pdf, word):
+        """Width of a word, built up from its glyph advances."""
+        width = self.words.get(word)
+        if width is None:
+            if self.additive:
+                width = sum(self.glyph_width(pdf, char) for char in word)
+            else:
+                width = pdf.get_string_width(word)
+            if len(self.words) >= MAX_CACHED_WORDS:
+                self.words.clear()
+            self.words[word] = width
+        return width
+
+    def text_width(self, pdf, text):
+        """Width of a line of text, built up from its word widths."""
+        if not self.additive:
+            return pdf.get_string_width(text)
+        words = text.split(" ")
+        return (sum(self.word_width(pdf, word) for word in words)
+                + self.space * (len(words) - 1))
+
+    def fits(self, width, available_width, width_of):
+        """Whether a line whose summed width is `width` fits the space.
+
+        Sums of glyph widths can differ from FPDF's own figure in the last
+        bits, so near-ties are settled by width_of(), which measures the
+        line with FPDF; it is only called when needed.
+        """
+        tolerance = WIDTH_TOLERANCE * max(1.0, abs(available_width))
+        if self.additive and width <= available_width - tolerance:
+            return True
+        if self.additive and width > available_width + tolerance:
+            return False
+        return width_of() <= available_width
+
+
+def glyph_widths(pdf):
+    """Width table for the font currently selected on `pdf`."""
+    key = (pdf.font_family, pdf.font_style, pdf.font_size_pt, pdf.k,
+           getattr(pdf, "font_stretching", 100),
+           getattr(pdf, "char_spacing", 0))
+    table = _WIDTH_TABLES.get(key)
+    if table is None:
+        if len(_WIDTH_TABLES) >= MAX_WIDTH_TABLES:
+            _WIDTH_TABLES.clear()
+        table = _WIDTH_TABLES[key] = GlyphWidths(pdf)
+    return table
+
+
+def forget_words():
+    """Drop cached word widths, keeping the glyph advances they sum."""
+    for table in _WIDTH_TABLES.values():
+        table.words.clear()
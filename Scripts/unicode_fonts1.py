@@ -0,0 +1,166 @@
+import hashlib
+import io
+import string
+import unicodedata
+from config2 import ttf_fonts
+from extraction_cache1 import (
+    DEFAULT_MAX_BYTES, cache_key, cached_path, store_bytes
+)
+
+# Bump whenever the subsetting options change so old subsets stop matching
+SUBSET_VERSION = "1"
+
+# Font files to try, in order, for a style that has no file of its own
+STYLE_FALLBACKS = {"": ("",), "B": ("B", ""), "I": ("I", ""),
+                   "BI": ("BI", "B", "I", "")}
+
+# Printed in place of characters the fonts have no glyph for
+FALLBACK_CHAR = "?"
+
+# Kept in every subset: page numbers, the footer and the fallback character
+BASE_CHARSET = frozenset(string.printable)
+
+_COVERAGE = {}
+
+
+def is_ttf_family(family):
+    """Whether `family` is one of the TTF families in the config file."""
+    return family in ttf_fonts
+
+
+def family_files(family):
+    """Font file for each of the four styles of a configured TTF family."""
+    files = ttf_fonts[family]
+    resolved = {}
+    for style, candidates in STYLE_FALLBACKS.items():
+        for candidate in candidates:
+            if files.get(candidate):
+                resolved[style] = files[candidate]
+                break
+    return resolved
+
+
+def font_coverage(path):
+    """Code points a font file has glyphs for."""
+    coverage = _COVERAGE.get(path)
+    if coverage is None:
+        from fontTools.ttLib import TTFont
+
+        with TTFont(path, lazy=True) as ttfont:
+            coverage = frozenset(map(chr, ttfont.getBestCmap()))
+        _COVERAGE[path] = coverage
+    return coverage
+
+
+def text_coverage():
+    """Characters every configured TTF family can print in every style.
+
+    Text is cleaned once for all variants, so it is limited to what any
+    of the families could be asked to render.
+    """
+    coverage = None
+    for family in sorted(ttf_fonts):
+        for path in sorted(set(family_files(family).values())):
+            if coverage is None:
+                coverage = font_coverage(path)
+            else:
+                coverage &= font_coverage(path)
+    return coverage or frozenset()
+
+
+def fonts_tag():
+    """Short digest of the configured font files, for cache file names."""
+    identity = sorted(
+        (family, style, cache_key(path))
+        for family in ttf_fonts
+        for style, path in family_files(family).items()
+    )
+    return hashlib.sha256(repr(identity).encode()).hexdigest()[:12]
+
+
+def printable_texts(texts, coverage):
+    """NFC-normalize texts and replace characters the fonts lack.
+
+    Whitespace is left alone for the caller to collapse or keep.
+    """
+    texts = [unicodedata.normalize("NFC", text) for text in texts]
+    missing = {char for char in set("".join(texts)) - coverage
+               if not char.isspace()}
+    if not missing:
+        return texts
+    table = dict.fromkeys(map(ord, missing), FALLBACK_CHAR)
+    return [text.translate(table) for text in texts]
+
+
+def book_charset(paragraphs):
+    """Characters used by a book's cleaned lines, plus BASE_CHARSET."""
+    return BASE_CHARSET.union(
+        "".join(line.text for paragraph in paragraphs for line in paragraph)
+    )
+
+
+def subset_font(path, charset, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    """Path of a copy of the font holding only the glyphs in `charset`.
+
+    Subsets are cached per font file and character set, so a book pays
+    for subsetting once; fpdf2 then parses a font of a few hundred glyphs
+    instead of thousands every time a document registers it, and
+    subsets that again to the glyphs a document actually prints.
+    """
+    digest = hashlib.sha256(repr(
+        (SUBSET_VERSION, cache_key(path), sorted(charset))
+    ).encode()).hexdigest()
+    key = f"font-{digest}"
+    subset_path = cached_path(cache_dir, key, "subset.ttf")
+    if subset_path is not None:
+        return subset_path
+
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    options = subset.Options()
+    options.notdef_outline = True
+    # fpdf2 reads the font's full name and drops layout tables itself
+    options.name_IDs = ["*"]
+    options.name_languages = ["*"]
+    options.layout_features = []
+    options.drop_tables += ["FFTM"]
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=map(ord, charset))
+    with TTFont(path) as ttfont:
+        subsetter.subset(ttfont)
+        data = io.BytesIO()
+        ttfont.save(data)
+    store_bytes(cache_dir, key, "subset.ttf", data.getvalue(), max_bytes)
+    return cached_path(cache_dir, key, "subset.ttf")
+
+
+def prepare_fonts(families, charset=None, cache_dir=None,
+                  max_bytes=DEFAULT_MAX_BYTES):
+    """Font files to register for the TTF families among `families`.
+
+    Returns {family: {style: path}}; core fonts are left out. With a
+    charset and a cache_dir the files are cached subsets of the
+    configured fonts.
+    """
+    fonts = {}
+    subsets = {}
+    for family in families:
+        if not is_ttf_family(family) or family in fonts:
+            continue
+        files = family_files(family)
+        if charset is not None and cache_dir:
+            for path in set(files.values()) - set(subsets):
+                subsets[path] = subset_font(path, charset, cache_dir,
+                                            max_bytes)
+            files = {style: subsets[path] for style, path in files.items()}
+        fonts[family] = files
+    return fonts
+
+
+def register_fonts(pdf, fonts):
+    """Add the font files from prepare_fonts to an FPDF document."""
+    for family, files in (fonts or {}).items():
+        for style, path in files.items():
+            if f"{family.lower()}{style}" not in pdf.fonts:
+                pdf.add_font(family, style, path)
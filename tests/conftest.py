@@ -0,0 +1,79 @@
+"""Shared test setup.
+
+The pipeline reads its settings from a user's config2 module. When none
+is on the path, one is written from the sample config3 with the paths
+pointed at a temporary directory and the caches off, and the directory
+is exported on PYTHONPATH for the subprocesses some tests start.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+SCRIPTS = os.path.abspath(os.path.join(os.path.dirname(__file__), "..",
+                                       "Scripts"))
+sys.path.insert(0, SCRIPTS)
+
+TEST_SETTINGS = {
+    "dark_mode": False,
+    "cache_dir": None,
+    "extract_workers": 1,
+    "reflow_workers": 1,
+    "variant_workers": 1,
+    "service_workers": 1,
+    "metrics_path": None,
+    "profile_stages": None,
+}
+
+
+def _write_test_config():
+    directory = tempfile.mkdtemp(prefix="scriptorium-tests-")
+    settings = {}
+    with open(os.path.join(SCRIPTS, "config3.py")) as f:
+        exec(f.read(), settings)
+    settings.update(TEST_SETTINGS)
+    settings.update(
+        pdf_path=os.path.join(directory, "book.pdf"),
+        output_path=os.path.join(directory, "result.pdf"),
+        debug_dir=os.path.join(directory, "debug"),
+        profile_dir=os.path.join(directory, "profiles"),
+    )
+    with open(os.path.join(directory, "config2.py"), "w") as f:
+        for name, value in settings.items():
+            if not name.startswith("__"):
+                f.write(f"{name} = {value!r}\n")
+    return directory
+
+
+_paths = [SCRIPTS]
+try:
+    import config2  # noqa: F401
+except ImportError:
+    _paths.insert(0, _write_test_config())
+    sys.path.insert(0, _paths[0])
+os.environ["PYTHONPATH"] = os.pathsep.join(
+    filter(None, _paths + [os.environ.get("PYTHONPATH")])
+)
+
+
+def _make_book(path, pages=3):
+    """A small PDF with a few lines of body text per page."""
+    import fitz
+
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        y = 72
+        for line in range(12):
+            page.insert_text((72, y), f"Page {page_number} line {line} of "
+                             f"some ordinary body text.", fontsize=11)
+            y += 14
+    document.save(path)
+    return path
+
+
+@pytest.fixture
+def make_book(tmp_path):
+    """make_book(pages=3) writes a small PDF and returns its path."""
+    return lambda pages=3: _make_book(str(tmp_path / "book.pdf"), pages)
@@ -0,0 +1,58 @@
+import json
+import os
+
+import batch_runner1
+from batch_runner1 import book_output_path, convert_books, run_batch
+from main3 import default_variant
+
+
+def fake_convert_book(pdf_path, variants):
+    """convert_book stand-in whose worker dies on crash.pdf."""
+    if os.path.basename(pdf_path) == "crash.pdf":
+        os._exit(1)
+    return {"status": "done", "seconds": 0}
+
+
+def test_missing_book_fails_alone(tmp_path):
+    missing = str(tmp_path / "library" / "missing.pdf")
+    manifest_path = str(tmp_path / "manifest.json")
+
+    failures = run_batch([missing], str(tmp_path / "out"), manifest_path,
+                         [default_variant()], workers=1,
+                         root=str(tmp_path / "library"))
+
+    assert list(failures) == [missing]
+    assert "FileNotFoundError" in failures[missing]
+    with open(manifest_path) as f:
+        assert json.load(f)["books"][missing]["status"] == "failed"
+
+
+def test_same_named_books_get_separate_outputs(tmp_path):
+    root = str(tmp_path / "library")
+    first = book_output_path(os.path.join(root, "a", "intro.pdf"), "out",
+                             root)
+    second = book_output_path(os.path.join(root, "b", "intro.pdf"), "out",
+                              root)
+    assert first == os.path.join("out", "a", "intro.pdf")
+    assert second == os.path.join("out", "b", "intro.pdf")
+
+
+def test_book_outside_the_root_keeps_its_full_path(tmp_path):
+    root = str(tmp_path / "library")
+    outside = str(tmp_path / "elsewhere" / "intro.pdf")
+    assert book_output_path(outside, "out", root) == os.path.join(
+        "out", outside.lstrip(os.sep))
+
+
+def test_only_the_crashing_book_fails(monkeypatch):
+    monkeypatch.setattr(batch_runner1, "convert_book", fake_convert_book)
+    jobs = [(f"/books/{name}.pdf", []) for name in
+            ("a", "b", "crash", "c", "d", "e")]
+    results = {}
+
+    convert_books(jobs, 3, lambda path, result: results.update({
+        os.path.basename(path): result["status"]}))
+
+    assert results == {"a.pdf": "done", "b.pdf": "done",
+                       "crash.pdf": "failed", "c.pdf": "done",
+                       "d.pdf": "done", "e.pdf": "done"}
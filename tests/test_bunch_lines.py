@@ -0,0 +1,95 @@
+import os
+import random
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Scripts"))
+
+from formatting_analyzer3 import bunch_lines  # noqa: E402
+
+
+def reference_bunch_lines(df):
+    """The span-by-span bunch_lines that the vectorized one replaced."""
+    df = df.sort_values(by=["page_number", "y1", "x1"])
+    lines = []
+    for page_num, page_data in df.groupby("page_number"):
+        current_line = []
+        previous_span = None
+        for span in page_data.to_dict("records"):
+            if previous_span is not None:
+                overlap = (min(span["y2"], previous_span["y2"])
+                           - max(span["y1"], previous_span["y1"]))
+                avg_height = ((span["y2"] - span["y1"])
+                              + (previous_span["y2"] - previous_span["y1"])
+                              ) / 2
+                if not overlap / avg_height > 0.5:
+                    lines.append(reference_line(current_line, page_num))
+                    current_line = []
+            current_line.append(span)
+            previous_span = span
+        if current_line:
+            lines.append(reference_line(current_line, page_num))
+    return lines
+
+
+def reference_line(line, page_num):
+    def mode(values):
+        return max(set(values), key=values.count)
+
+    return (
+        page_num,
+        " ".join(span["text"]
+                 for span in sorted(line, key=lambda span: span["x1"])),
+        min(span["x1"] for span in line),
+        min(span["y1"] for span in line),
+        max(span["x2"] for span in line),
+        max(span["y2"] for span in line),
+        mode([span["font_size"] for span in line]),
+        mode([span["font"] for span in line]),
+        mode([span["bold"] for span in line]),
+        mode([span["italic"] for span in line]),
+    )
+
+
+def spans(rows):
+    return pd.DataFrame(rows, columns=[
+        "page_number", "text", "x1", "y1", "x2", "y2", "font_size", "font",
+        "bold", "italic",
+    ])
+
+
+def assert_same_lines(df):
+    result = bunch_lines(df)
+    assert list(result.itertuples(index=False, name=None)) == \
+        reference_bunch_lines(df)
+
+
+def test_tied_font_sizes_pick_what_the_reference_picks():
+    # A body-text span and a footnote marker: one span each
+    df = spans([
+        (0, "Body", 10.0, 100.0, 40.0, 111.0, 11.0, "Times", False, False),
+        (0, "1", 41.0, 100.0, 44.0, 106.6, 6.6, "Times", False, False),
+    ])
+    assert bunch_lines(df)["font_size"].tolist() == [11.0]
+    assert_same_lines(df)
+
+
+def test_random_lines_with_ties_match_the_reference():
+    rng = random.Random(4)
+    rows = []
+    for page in range(5):
+        for line in range(40):
+            y = 20.0 + line * 14
+            x = 10.0
+            for _ in range(rng.randint(1, 6)):
+                size = rng.choice([6.6, 8.0, 11.0, 12.0, 14.0])
+                width = rng.uniform(5, 40)
+                rows.append((
+                    page, f"w{len(rows)}", x, y, x + width,
+                    y + rng.uniform(10, 12), size,
+                    rng.choice(["Times", "Times-Bold", "Helvetica"]),
+                    rng.random() < 0.3, rng.random() < 0.2,
+                ))
+                x += width + 2
+    assert_same_lines(spans(rows))
@@ -0,0 +1,102 @@
+import importlib.util
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+import conversion_service1
+from conversion_service1 import JobError, WorkerPool, parse_job
+
+# The pipeline imports its formatter as text_formatter3
+needs_pipeline = pytest.mark.skipif(
+    importlib.util.find_spec("text_formatter3") is None,
+    reason="text_formatter3 is not installed"
+)
+
+HEAVY_MODULES = ("pandas", "numpy", "fitz", "pymupdf", "rapidfuzz", "fpdf",
+                 "pyarrow", "formatting_analyzer3", "text_formatter3",
+                 "text_formatter4", "pdf_handler4")
+
+
+FIRST_JOB = """
+import json, sys, time
+import conversion_service1, main3
+
+conversion_service1._warm_worker()
+before = {name.split(".")[0] for name in sys.modules}
+conversion_service1.run_job(sys.argv[1], None,
+                            main3.default_variant()._replace(output_path=None),
+                            "pdf", time.time())
+print(json.dumps(sorted({name.split(".")[0] for name in sys.modules}
+                        - before)))
+"""
+
+
+@needs_pipeline
+def test_first_job_after_warm_up_imports_nothing(tmp_path, make_book):
+    book = make_book()
+    result = subprocess.run([sys.executable, "-c", FIRST_JOB, book],
+                            capture_output=True, text=True, check=True,
+                            cwd=str(tmp_path), env=os.environ)
+    # Packages the first job had to import for itself
+    imported = json.loads(result.stdout.strip().splitlines()[-1])
+    assert set(imported) & set(HEAVY_MODULES) == set()
+
+
+def job(pdf_path, **fields):
+    return json.dumps(dict(fields, pdf_path=pdf_path)).encode()
+
+
+@pytest.mark.parametrize("overrides", [
+    {"font_size": "abc"},
+    {"font_size": True},
+    {"font_size": 0},
+    {"line_height_ratio": -1},
+    {"dark_mode": "false"},
+    {"page_width_mm": 5},
+    {"font": "nosuchfont"},
+])
+def test_bad_overrides_are_rejected(make_book, overrides):
+    with pytest.raises(JobError):
+        parse_job(job(make_book(1), **overrides))
+
+
+def test_good_overrides_reach_the_variant(make_book):
+    _, _, variant, _ = parse_job(job(
+        make_book(1), font="times", font_size=14, line_height_ratio=0.6,
+        dark_mode=False, page_width_mm=100
+    ))
+    assert variant == variant._replace(
+        font="times", font_size=14, line_height_ratio=0.6, dark_mode=False,
+        page_width_mm=100, output_path=None
+    )
+
+
+def test_jobs_run_serially_inside_a_service_worker(monkeypatch):
+    calls = []
+    monkeypatch.setattr(conversion_service1.main3, "convert",
+                        lambda *args, **kwargs: calls.append(kwargs))
+    conversion_service1.run_job("book.pdf", None, None, "pdf", time.time())
+    assert calls[0]["workers"] == 1
+
+
+@needs_pipeline
+def test_pool_is_replaced_after_a_worker_dies():
+    pool = WorkerPool(1)
+    try:
+        pid = pool.submit(conversion_service1._ping, 0).result()
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.time() + 10
+        while not pool.broken() and time.time() < deadline:
+            time.sleep(0.05)
+        assert pool.broken()
+
+        new_pid = pool.submit(conversion_service1._ping, 0).result()
+        assert new_pid != pid
+        assert pool.restarts == 1 and not pool.broken()
+    finally:
+        pool.shutdown()
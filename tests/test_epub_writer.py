@@ -0,0 +1,62 @@
+import io
+import struct
+import zipfile
+
+import pytest
+
+from epub_writer1 import write_epub
+from text_extractor3 import Line
+
+MIMETYPE = b"application/epub+zip"
+
+
+class Unseekable(io.RawIOBase):
+    """A write-only stream that cannot seek, like a pipe or socket."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def paragraphs():
+    return [[Line(0, "One", 0, 0, 100, 10, 14.0, "Times", 1, 0, 0, 1)],
+            [Line(0, "Some text.", 0, 20, 100, 30, 11.0, "Times", 0, 0,
+                  0, 0)]]
+
+
+def book_bytes(kind, tmp_path):
+    if kind == "bytes":
+        return write_epub(paragraphs(), None, "Book")
+    if kind == "path":
+        path = str(tmp_path / "book.epub")
+        write_epub(paragraphs(), path, "Book")
+        with open(path, "rb") as f:
+            return f.read()
+    stream = Unseekable() if kind == "unseekable" else io.BytesIO()
+    assert write_epub(paragraphs(), stream, "Book") is stream
+    return bytes(stream.data if kind == "unseekable" else stream.getvalue())
+
+
+@pytest.mark.parametrize("kind", ["bytes", "path", "seekable", "unseekable"])
+def test_mimetype_is_first_stored_and_without_descriptor(kind, tmp_path):
+    data = book_bytes(kind, tmp_path)
+    (signature, _, flags, method, _, _, _, compressed, size, name_length,
+     extra_length) = struct.unpack("<IHHHHHIIIHH", data[:30])
+
+    assert signature == 0x04034B50
+    assert not flags & 0x08, "data descriptor"
+    assert method == zipfile.ZIP_STORED
+    assert compressed == size == len(MIMETYPE)
+    assert extra_length == 0
+    assert data[30:30 + name_length] == b"mimetype"
+    assert data[30 + name_length:30 + name_length + size] == MIMETYPE
+
+    with zipfile.ZipFile(io.BytesIO(data)) as book:
+        assert book.namelist()[0] == "mimetype"
+        assert book.testzip() is None
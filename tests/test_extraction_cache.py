@@ -0,0 +1,59 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Scripts"))
+
+from extraction_cache1 import (  # noqa: E402
+    cache_key, enforce_size_limit, invalidate, store_bytes
+)
+from segment_render1 import reflow_key, store_reflow  # noqa: E402
+
+UNRELATED = ["notes", "readme.txt"]
+
+
+def make_cache(tmp_path, pdf_path):
+    """A cache holding one entry of every kind plus unrelated files."""
+    cache_dir = str(tmp_path / "cache")
+    os.makedirs(os.path.join(cache_dir, "notes"))
+    with open(os.path.join(cache_dir, "readme.txt"), "w") as f:
+        f.write("not a cache entry")
+
+    store_bytes(cache_dir, cache_key(pdf_path), "lines.bin", b"x" * 100)
+    store_bytes(cache_dir, f"font-{'a' * 64}", "subset.ttf", b"x" * 100)
+    store_reflow(cache_dir, reflow_key([["line"]], ("helvetica", 12)),
+                 [["formatted"]])
+    return cache_dir
+
+
+def write_pdf(tmp_path):
+    path = str(tmp_path / "book.pdf")
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.3 not really a book")
+    return path
+
+
+def test_size_limit_evicts_segment_entries(tmp_path):
+    cache_dir = make_cache(tmp_path, write_pdf(tmp_path))
+    assert any(name.startswith("seg-") for name in os.listdir(cache_dir))
+
+    enforce_size_limit(cache_dir, 0)
+    assert sorted(os.listdir(cache_dir)) == UNRELATED
+
+
+def test_clear_removes_every_entry_but_keeps_other_files(tmp_path):
+    cache_dir = make_cache(tmp_path, write_pdf(tmp_path))
+
+    invalidate(cache_dir)
+    assert sorted(os.listdir(cache_dir)) == UNRELATED
+
+
+def test_invalidate_one_book_keeps_other_entries(tmp_path):
+    pdf_path = write_pdf(tmp_path)
+    cache_dir = make_cache(tmp_path, pdf_path)
+
+    invalidate(cache_dir, pdf_path)
+    remaining = os.listdir(cache_dir)
+    assert cache_key(pdf_path) not in remaining
+    assert sorted(name.split("-")[0] for name in remaining) == [
+        "font", "notes", "readme.txt", "seg"
+    ]
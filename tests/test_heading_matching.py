@@ -0,0 +1,80 @@
+import logging
+import random
+import string
+
+import pandas as pd
+import pytest
+
+from formatting_analyzer3 import (
+    LINE_COLUMNS, build_toc_index, match_chapter_headings
+)
+
+# Every line counts as a potential heading, so only the matching decides
+THRESHOLDS = {"line_length_mode": 1e9, "line_length_std": 0.0,
+              "l_margin_mode": 0.0, "off_margin_threshold": 1e9}
+
+# (heading line, TOC entry, whether fuzzywuzzy's extractOne scored it at
+# least 95), on both its python-Levenshtein and difflib backends
+CASES = [
+    ("Chapter One", "CHAPTER ONE .......... 12", False),
+    ("The Winter Garden", "The Winter Gardens", True),
+    ("The Winter Garden", "A Winter Garden", False),
+    ("Prologue", "Prologue and Epilogue", False),
+    # Scores of 94 and 95, either side of the threshold
+    ("Hist0ry of the War", "History of the War", False),
+    ("River Naeïe Three", "River Naïve Three", False),
+    ("one river th ree café café summer",
+     "one river three café café summer 12", False),
+    ("two café of two river", "two café of two river 12", True),
+    ("Naïve Art", "Naïve Art 7", True),
+    ("Über Alles", "Uber Alles", True),
+    # Latin-1 letters were dropped, other scripts kept
+    ("Café Society", "Cafe Society", True),
+    ("Épilogue", "Epilogue", False),
+    ("Straße", "Strasse", False),
+    ("Глава первая", "Глава первая", True),
+    ("Глава первая", "Chapter One", False),
+]
+
+
+def matches(headings, toc_entries):
+    """Which heading lines match_chapter_headings finds in the TOC."""
+    toc_df = pd.DataFrame({"page_number": 0, "text": toc_entries})
+    line_df = pd.DataFrame({
+        column: [0.0] * len(headings) for column in LINE_COLUMNS
+    })
+    line_df["page_number"] = 1
+    line_df["text"] = headings
+    found = match_chapter_headings(
+        line_df, [1], build_toc_index(toc_df, [0]), THRESHOLDS
+    )
+    return set(found["text"])
+
+
+@pytest.mark.parametrize("heading, entry, expected", CASES)
+def test_matches_agree_with_fuzzywuzzy(heading, entry, expected):
+    assert (heading in matches([heading], [entry, "Contents"])) == expected
+
+
+def test_matches_agree_with_fuzzywuzzy_on_random_headings():
+    pytest.importorskip("Levenshtein")
+    fuzzywuzzy_process = pytest.importorskip("fuzzywuzzy.process")
+    logging.disable(logging.WARNING)
+
+    rng = random.Random(7)
+    words = ("the of and chapter one history war night garden summer "
+             "café naïve über straße глава первая σκιά under_score").split()
+    for _ in range(200):
+        entry = " ".join(rng.choice(words)
+                         for _ in range(rng.randint(1, 6)))
+        heading = list(entry)
+        for _ in range(rng.choice([0, 1, 1, 2, 3])):
+            if heading:
+                heading[rng.randrange(len(heading))] = rng.choice(
+                    string.ascii_lowercase + "é ")
+        heading = "".join(heading)
+        toc_entries = [entry + rng.choice(["", " 12", " ....... 47"]),
+                       "Contents"]
+
+        _, score = fuzzywuzzy_process.extractOne(heading, toc_entries)
+        assert (heading in matches([heading], toc_entries)) == (score >= 95)
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from conversion_service1 import JobError, parse_job
+from formatting_analyzer3 import _chunks_to_frame, extract_data, extract_pages
+import main3
+
+
+def test_no_chunks_give_an_empty_frame_of_the_same_columns(make_book):
+    full = extract_data(make_book(1), workers=1)
+    empty = _chunks_to_frame([])
+    assert empty.empty
+    # The font categories are the book's own, so only the kinds compare
+    assert (empty.dtypes.astype(str).to_dict()
+            == full.dtypes.astype(str).to_dict())
+
+
+@pytest.mark.parametrize("pages", [[], [7, 8]])
+def test_extracting_no_pages_of_the_book_is_empty(make_book, pages):
+    assert extract_pages(make_book(3), pages).empty
+
+
+@pytest.mark.parametrize("pages", [range(0), range(2, 5), range(-1, 1)])
+def test_convert_rejects_pages_outside_the_book(make_book, pages):
+    with pytest.raises(ValueError):
+        main3.convert(make_book(3), pages=pages)
+
+
+@pytest.mark.parametrize("pages", [[1, 1], [3, 6], [-2, 1]])
+def test_service_answers_bad_page_ranges_with_400(make_book, pages):
+    body = json.dumps({"pdf_path": make_book(3), "pages": pages}).encode()
+    with pytest.raises(JobError):
+        parse_job(body)
+
+
+def test_service_accepts_pages_in_the_book(make_book):
+    body = json.dumps({"pdf_path": make_book(3), "pages": [1, 3]}).encode()
+    assert parse_job(body)[1] == range(1, 3)
@@ -0,0 +1,75 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Scripts"))
+
+from extraction_cache1 import enforce_size_limit  # noqa: E402
+from segment_render1 import (  # noqa: E402
+    load_reflow, load_render, reflow_key, render_key, split_segments,
+    store_reflow, store_render
+)
+from text_extractor3 import Line  # noqa: E402
+
+SETTINGS = ("helvetica", 12, 0.5, 80, None, "greedy")
+
+
+def line(text, chapter_heading=0, toc=0):
+    return Line(0, text, 0, 0, 100, 10, 11.0, "Times", 0, 0,
+                toc, chapter_heading)
+
+
+def book():
+    return [
+        [line("Title page")],
+        [line("Chapter 1", toc=1, chapter_heading=1)],
+        [line("One", chapter_heading=1)],
+        [line("First chapter text.")],
+        [line("Two", chapter_heading=1)],
+        [line("Second chapter text.")],
+    ]
+
+
+def test_split_segments_at_headings_but_not_toc():
+    segments = split_segments(book())
+    assert [[p[0].text for p in segment] for segment in segments] == [
+        ["Title page", "Chapter 1"],
+        ["One", "First chapter text."],
+        ["Two", "Second chapter text."],
+    ]
+
+
+def test_only_the_edited_segment_gets_a_new_reflow_key():
+    before = [reflow_key(s, SETTINGS) for s in split_segments(book())]
+    edited = book()
+    edited[5] = [line("Second chapter, edited.")]
+    after = [reflow_key(s, SETTINGS) for s in split_segments(edited)]
+
+    assert before[:2] == after[:2]
+    assert before[2] != after[2]
+
+
+def test_reflow_settings_change_every_key():
+    segments = split_segments(book())
+    wider = SETTINGS[:3] + (100,) + SETTINGS[4:]
+    assert not ({reflow_key(s, SETTINGS) for s in segments}
+                & {reflow_key(s, wider) for s in segments})
+
+
+def test_render_key_depends_on_page_offset():
+    key = reflow_key(split_segments(book())[1], SETTINGS)
+    assert render_key(key, SETTINGS, 3) != render_key(key, SETTINGS, 4)
+
+
+def test_cached_segments_round_trip_and_are_evicted(tmp_path):
+    cache_dir = str(tmp_path)
+    key = reflow_key(split_segments(book())[1], SETTINGS)
+    store_reflow(cache_dir, key, [["formatted"]])
+    rendered = render_key(key, SETTINGS, 0)
+    store_render(cache_dir, rendered, b"%PDF-1.3", 2)
+
+    assert load_reflow(cache_dir, key) == [["formatted"]]
+    assert load_render(cache_dir, rendered) == (b"%PDF-1.3", 2)
+
+    enforce_size_limit(cache_dir, 0)
+    assert load_reflow(cache_dir, key) is None
+    assert load_render(cache_dir, rendered) is None